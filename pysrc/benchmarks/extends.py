@@ -0,0 +1,122 @@
+"""Times loading variants of a layout written with `extends`, and checks them.
+
+Builds two bundles from examples/sme.kbdgen holding COUNT (default 200)
+variants of se-NO, each with its own English name and a changed `ctrl` mode
+for Windows. In one bundle every variant is a full copy of se-NO, in the other
+it `extends: se-NO` with just those changes. Both are loaded without the
+decode cache, timed and measured, and it fails unless every variant decodes to
+the same layout both ways.
+
+    $ python benchmarks/extends.py [COUNT]
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+PYSRC_DIR = Path(__file__).resolve().parents[1]
+REPO_DIR = PYSRC_DIR.parent
+BUNDLE_DIR = REPO_DIR / "examples" / "sme.kbdgen"
+
+sys.path.insert(0, str(PYSRC_DIR))
+
+from kbdgen.bundle import ProjectBundle  # noqa: E402
+
+BASE = "se-NO"
+NAME_LINE = "  en: Northern Sami (Norway)\n"
+CTRL_LINE = "    ctrl: |\n"
+
+
+def variant_texts(base, n):
+    """Returns the full text of variant `n` and the text of its overrides."""
+    lines = base.splitlines(keepends=True)
+    # The ctrl mode of win is the last mode before the transforms.
+    start = len(lines) - lines[::-1].index(CTRL_LINE)
+    ctrl = lines[start : start + 4]
+    ctrl[0] = ctrl[0].replace("\\u{0}", chr(0x100 + n), 1)
+
+    name = "  en: Variant %d\n" % n
+    full = lines[:start] + ctrl + lines[start + 4 :]
+    full[full.index(NAME_LINE)] = name
+
+    overrides = ["extends: %s\n" % BASE, "displayNames:\n", name, "modes:\n"]
+    overrides += ["  win:\n", CTRL_LINE] + ctrl
+    return "".join(full), "".join(overrides)
+
+
+def make_bundles(tmp, count):
+    base = (BUNDLE_DIR / "layouts" / ("%s.yaml" % BASE)).read_text(encoding="utf-8")
+    bundles = []
+    for kind in ("full", "extends"):
+        path = Path(tmp) / ("%s.kbdgen" % kind)
+        shutil.copytree(str(BUNDLE_DIR), str(path))
+        for n in range(count):
+            text = variant_texts(base, n)[0 if kind == "full" else 1]
+            (path / "layouts" / ("variant-%d.yaml" % n)).write_text(
+                text, encoding="utf-8"
+            )
+        bundles.append(path)
+    return bundles
+
+
+def load(path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    bundle = ProjectBundle.load(str(path))
+    layouts = {name: bundle.layouts[name] for name in bundle.layouts}
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return layouts, seconds, size
+
+
+def same(a, b):
+    fields = (
+        "display_names",
+        "modes",
+        "decimal",
+        "space",
+        "dead_keys",
+        "longpress",
+        "transforms",
+        "targets",
+    )
+    return all(getattr(a, x) == getattr(b, x) for x in fields)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("count", type=int, nargs="?", default=200)
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full_path, extends_path = make_bundles(tmp, args.count)
+        full, full_seconds, full_size = load(full_path)
+        extends, extends_seconds, extends_size = load(extends_path)
+
+    print("full copies %8.3fs %8d KiB" % (full_seconds, full_size // 1024))
+    print("extends     %8.3fs %8d KiB" % (extends_seconds, extends_size // 1024))
+
+    base = extends[BASE]
+    shared = sum(
+        1
+        for name, layout in extends.items()
+        if name.startswith("variant-")
+        for keymap, base_keymap in (
+            (layout.modes["mac"][m], base.modes["mac"][m]) for m in base.modes["mac"]
+        )
+        if keymap is base_keymap
+    )
+    print("%d mac mode tables shared with %s" % (shared, BASE))
+
+    different = [name for name in full if not same(full[name], extends[name])]
+    for name in different:
+        print("  %s differs" % name)
+    return 1 if different else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Times building the Windows DLLs of a bundle under a stub wine.
+
+The layouts of examples/sme.kbdgen, copied COUNT (default 4) times over, have
+their KLC files written and DLLs built as a release build does
+(`WindowsGenerator.build_layouts`), once with a persistent wine session and
+once with `-f no-wine-session`. wine and wineserver are the stubs in
+benchmarks/wine_stub, which record every run: the number of wine processes
+and how many of them had to start cold are reported with the time taken, and
+it fails unless both ways build the same DLLs.
+
+    $ python benchmarks/wine_session.py [COUNT] [-j JOBS] [--startup SECONDS]
+"""
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PYSRC_DIR = Path(__file__).resolve().parents[1]
+REPO_DIR = PYSRC_DIR.parent
+BUNDLE_DIR = REPO_DIR / "examples" / "sme.kbdgen"
+STUB_DIR = PYSRC_DIR / "benchmarks" / "wine_stub"
+
+sys.path.insert(0, str(PYSRC_DIR))
+
+from kbdgen.bundle import ProjectBundle  # noqa: E402
+from kbdgen.gen.win import DLL_ARCHS, WindowsGenerator  # noqa: E402
+
+
+def make_bundle(tmp, count):
+    path = Path(tmp) / "bundle.kbdgen"
+    shutil.copytree(str(BUNDLE_DIR), str(path))
+    layouts = path / "layouts"
+    for layout in sorted(layouts.glob("*.yaml")):
+        for n in range(1, count):
+            # At most five characters, as the names of KLC files are cut to that.
+            name = "x%d%s" % (n, layout.stem[-2:])
+            text = "extends: %s\ndisplayNames:\n  %s: Copy %d of %s\n" % (
+                layout.stem,
+                name,
+                n,
+                layout.stem,
+            )
+            (layouts / ("%s.yaml" % name)).write_text(text, encoding="utf-8")
+    return path
+
+
+def build(bundle_path, out_dir, flags, jobs, log_path):
+    bundle = ProjectBundle.load(str(bundle_path))
+    generator = WindowsGenerator(
+        bundle, {"flags": flags, "jobs": jobs, "no_cache": True, "release": True}
+    )
+    os.makedirs(str(out_dir))
+
+    start = time.perf_counter()
+    generator.build_layouts(generator.klc_contexts(str(out_dir)), str(out_dir))
+    seconds = time.perf_counter() - start
+
+    with open(str(log_path), encoding="utf-8") as f:
+        runs = [json.loads(line) for line in f]
+    os.remove(str(log_path))
+    wine = [r for r in runs if r["argv"][0] != "wineserver"]
+    return {
+        "layouts": len(bundle.layouts),
+        "seconds": seconds,
+        "wine": len(wine),
+        "cold": sum(1 for r in wine if not r["warm"]),
+        "wineserver": [" ".join(r["argv"]) for r in runs if r not in wine],
+    }
+
+
+def same_dlls(a, b):
+    for arch in DLL_ARCHS:
+        names = sorted(os.listdir(str(a / arch)))
+        if names != sorted(os.listdir(str(b / arch))):
+            return False
+        _, mismatch, errors = filecmp.cmpfiles(
+            str(a / arch), str(b / arch), names, shallow=False
+        )
+        if len(mismatch) > 0 or len(errors) > 0:
+            return False
+    return True
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("count", type=int, nargs="?", default=4)
+    p.add_argument("-j", "--jobs", type=int, default=None)
+    p.add_argument(
+        "--startup",
+        default="1",
+        help="Seconds a wine process takes to start without a wineserver",
+    )
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        msklc = tmp / "msklc"
+        (msklc / "bin" / "i386").mkdir(parents=True)
+        (msklc / "bin" / "i386" / "kbdutool.exe").write_bytes(b"kbdutool")
+
+        log_path = tmp / "wine.log"
+        os.environ.update(
+            WINE=str(STUB_DIR / "wine"),
+            WINESERVER=str(STUB_DIR / "wineserver"),
+            WINE_STUB_LOG=str(log_path),
+            WINE_STUB_STATE=str(tmp),
+            WINE_STUB_STARTUP=args.startup,
+            MSKLC_PATH=str(msklc),
+        )
+
+        bundle_path = make_bundle(tmp, args.count)
+        results = []
+        for name, flags in (("session", []), ("no session", ["no-wine-session"])):
+            out_dir = tmp / name.replace(" ", "-")
+            results.append(
+                (name, out_dir, build(bundle_path, out_dir, flags, args.jobs, log_path))
+            )
+
+        for name, _, r in results:
+            print(
+                "%-10s %3d layouts  %7.2fs  %3d wine processes (%d cold)  %s"
+                % (
+                    name,
+                    r["layouts"],
+                    r["seconds"],
+                    r["wine"],
+                    r["cold"],
+                    ", ".join(r["wineserver"]) or "no wineserver",
+                )
+            )
+
+        if not same_dlls(results[0][1], results[1][1]):
+            print("The DLLs built differ.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
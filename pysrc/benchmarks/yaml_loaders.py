@@ -0,0 +1,56 @@
+"""Compares the pure Python and libyaml ordered YAML loaders.
+
+Every layout in examples/sme.kbdgen is repeated SCALE times (default 50)
+under its own top-level key, then parsed with both loaders.
+
+    $ python benchmarks/yaml_loaders.py [SCALE]
+"""
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from kbdgen import orderedyaml  # noqa: E402
+
+EXAMPLES_DIR = Path(__file__).resolve().parents[2] / "examples"
+LAYOUTS_DIR = EXAMPLES_DIR / "sme.kbdgen" / "layouts"
+
+
+def scaled_document(scale):
+    chunks = []
+    for path in sorted(LAYOUTS_DIR.glob("*.yaml")):
+        body = path.read_text(encoding="utf-8")
+        indented = "".join("  %s" % line for line in body.splitlines(True))
+        for n in range(scale):
+            chunks.append("%s-%d:\n%s\n" % (path.stem, n, indented))
+    return "".join(chunks)
+
+
+def main(scale=50):
+    doc = scaled_document(scale)
+    layouts = doc.count(":\n  displayNames")
+    print("Document: %d layouts, %d KiB" % (layouts, len(doc) // 1024))
+
+    pure = orderedyaml.OrderedDictYAMLLoader
+    fast = orderedyaml.OrderedDictCYAMLLoader
+    if fast is None:
+        print("libyaml is not available; only the pure Python loader can be timed.")
+
+    candidates = [("pure", pure)] + ([("libyaml", fast)] if fast is not None else [])
+    results = {}
+    for name, loader in candidates:
+        results[name] = orderedyaml.loads(doc, loader)
+        seconds = min(
+            timeit.repeat(lambda: orderedyaml.loads(doc, loader), number=1, repeat=3)
+        )
+        print("%-8s %8.3fs" % (name, seconds))
+
+    if fast is not None:
+        assert results["pure"] == results["libyaml"], "loaders disagree"
+        assert list(results["pure"]) == list(results["libyaml"]), "key order differs"
+        print("Both loaders produced identical ordered output.")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:2]))
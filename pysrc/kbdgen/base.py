@@ -9,6 +9,9 @@ from collections import OrderedDict, namedtuple
 
 from . import orderedyaml, log, models
 from .bundle import ProjectBundle
+from .bundle.snapshot import SnapshotError
+from .bundle.source import is_archive
+from .keys import ISO_KEYS
 
 
 class KbdgenException(Exception):
@@ -29,57 +32,6 @@ ProjectLocaleData = namedtuple("ProjectLocaleData", ["name", "description"])
 
 VALID_ID_RE = re.compile(r"^[a-z][0-9a-z-_]+$")
 
-ISO_KEYS = (
-    "E00",
-    "E01",
-    "E02",
-    "E03",
-    "E04",
-    "E05",
-    "E06",
-    "E07",
-    "E08",
-    "E09",
-    "E10",
-    "E11",
-    "E12",
-    "D01",
-    "D02",
-    "D03",
-    "D04",
-    "D05",
-    "D06",
-    "D07",
-    "D08",
-    "D09",
-    "D10",
-    "D11",
-    "D12",
-    "C01",
-    "C02",
-    "C03",
-    "C04",
-    "C05",
-    "C06",  # TODO fix the D13 special case.
-    "C07",
-    "C08",
-    "C09",
-    "C10",
-    "C11",
-    "D13",  # C12 -> D13
-    "B00",
-    "B01",
-    "B02",
-    "B03",
-    "B04",
-    "B05",
-    "B06",
-    "B07",
-    "B08",
-    "B09",
-    "B10",
-)
-
 MODE_LIST_ERROR = """\
 '%s' must be defined as a string using block string format, not a list.
 
@@ -325,8 +277,18 @@ class Parser:
         except Exception:
             raise Exception("Error: invalid key-value pair provided.")
 
-    def parse(self, proj_path, cfg_pairs=None, cfg_file=None):
-        if not proj_path.endswith(".kbdgen"):
+    def parse(self, proj_path, cfg_pairs=None, cfg_file=None, jobs=None, cache=None):
+        if proj_path.endswith(".kbdc"):
+            try:
+                project = ProjectBundle.load_snapshot(proj_path)
+            except SnapshotError as e:
+                raise UserException(str(e))
+            except Exception as e:
+                raise UserException("Could not load snapshot '%s'." % proj_path, e)
+            self.apply_overrides(project, cfg_pairs)
+            return project
+
+        if not proj_path.endswith(".kbdgen") and not is_archive(proj_path):
             items = list(filter(lambda x: x.endswith(".kbdgen"), os.listdir(proj_path)))
             if len(items) > 1:
                 raise UserException(
@@ -335,10 +297,15 @@ class Parser:
             if len(items) > 0:
                 proj_path = os.path.join(proj_path, items.pop())
         try:
-            project = ProjectBundle.load(proj_path)
+            project = ProjectBundle.load(proj_path, jobs=jobs, cache=cache)
+        except UserException:
+            raise
         except Exception as e:
             raise UserException("Could not load project bundle. Invalid YAML?", e)
+        self.apply_overrides(project, cfg_pairs)
+        return project
+
+    def apply_overrides(self, project, cfg_pairs):
         if cfg_pairs is not None:
             logger.trace("cfg_pairs: %r" % cfg_pairs)
             self._overrides(project, self._parse_cfg_pairs(cfg_pairs))
-        return project
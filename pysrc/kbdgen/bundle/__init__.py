@@ -1,69 +1,28 @@
 import os
 import os.path
 import shutil
+import sys
+import threading
+import weakref
 import yaml
 import re
 import itertools
 import unicodedata
 import logging
+import concurrent.futures
+import collections.abc
 
 from collections import OrderedDict
 from kbdgen import orderedyaml
 from kbdgen.models import *
+from ..keys import ISO_KEYS, ISO_KEY_INDEX
+from .pool import ValuePool
+from .snapshot import read_snapshot, write_snapshot
+from .source import open_source
+from .transforms import TransformAutomaton
 
 logger = logging.getLogger()
 
-ISO_KEYS = (
-    "E00",
-    "E01",
-    "E02",
-    "E03",
-    "E04",
-    "E05",
-    "E06",
-    "E07",
-    "E08",
-    "E09",
-    "E10",
-    "E11",
-    "E12",
-    "D01",
-    "D02",
-    "D03",
-    "D04",
-    "D05",
-    "D06",
-    "D07",
-    "D08",
-    "D09",
-    "D10",
-    "D11",
-    "D12",
-    "C01",
-    "C02",
-    "C03",
-    "C04",
-    "C05",
-    "C06",  # TODO fix the D13 special case.
-    "C07",
-    "C08",
-    "C09",
-    "C10",
-    "C11",
-    "D13",  # C12 -> D13
-    "B00",
-    "B01",
-    "B02",
-    "B03",
-    "B04",
-    "B05",
-    "B06",
-    "B07",
-    "B08",
-    "B09",
-    "B10",
-)
-
 MOBILE_MODES = frozenset(
     ("default", "shift", "alt", "alt+shift", "symbols-1", "symbols-2")
 )
@@ -75,27 +34,166 @@ DESKTOP_MODES = frozenset(
 MAC_MODES = frozenset(("cmd", "cmd+shift", "cmd+alt", "cmd+alt+shift"))
 
 
+class DesktopKeymapItems(collections.abc.ItemsView):
+    def __iter__(self):
+        return zip(ISO_KEYS, self._mapping.values())
+
+
+# Matches "\u{...}" codepoint escapes in key values.
+CP_REGEX = re.compile(r"\\u{(.+?)}")
+
+
+def decode_codepoints(value):
+    """Returns `value` with its codepoint escapes replaced by the characters."""
+    if value is None or "\\u{" not in value:
+        return value
+
+    def chk(x):
+        try:
+            return chr(int(x.group(1), 16))
+        except ValueError:
+            raise ValueError("Invalid codepoint escape: %r" % x.group(0))
+
+    return CP_REGEX.sub(chk, value)
+
+
+class DesktopKeymap(collections.abc.Mapping):
+    """The keys of a desktop mode, stored as a tuple in `ISO_KEYS` order.
+
+    Code that only walks the keys should use `values()`, which is the tuple
+    itself; looking keys up by name works as with a read-only dict.
+    `decoded_values()` has the same keys with their codepoint escapes
+    decoded, which is done once when the keymap is made."""
+
+    __slots__ = ("_values", "_decoded")
+
+    def __init__(self, values, decoded=None):
+        values = tuple(values)
+        if len(values) != len(ISO_KEYS):
+            raise ValueError(
+                "Expected %d keys, got %d" % (len(ISO_KEYS), len(values))
+            )
+        self._values = values
+        if decoded is None:
+            decoded = tuple(decode_codepoints(x) for x in values)
+        self._decoded = decoded
+
+    def __getitem__(self, key):
+        return self._values[ISO_KEY_INDEX[key]]
+
+    def __iter__(self):
+        return iter(ISO_KEYS)
+
+    def __len__(self):
+        return len(ISO_KEYS)
+
+    def __contains__(self, key):
+        return key in ISO_KEY_INDEX
+
+    def __eq__(self, other):
+        if isinstance(other, DesktopKeymap):
+            return self._values == other._values
+        return super().__eq__(other)
+
+    def __reduce__(self):
+        return (DesktopKeymap, (self._values, self._decoded))
+
+    def __repr__(self):
+        return "DesktopKeymap(%r)" % (self._values,)
+
+    def get(self, key, default=None):
+        n = ISO_KEY_INDEX.get(key, None)
+        if n is None:
+            return default
+        return self._values[n]
+
+    def values(self):
+        return self._values
+
+    def decoded_values(self):
+        return self._decoded
+
+    def items(self):
+        return DesktopKeymapItems(self)
+
+
+EMPTY_KEYMAP = DesktopKeymap((None,) * len(ISO_KEYS))
+
+
 def parse_desktop_layout(data, length_check=True):
     if isinstance(data, dict):
-        o = OrderedDict()
-        for key in ISO_KEYS:
-            v = data.get(key, None)
-            o[key] = str(v) if v is not None else None
-        return o
+        return DesktopKeymap(
+            str(v) if v is not None else None
+            for v in (data.get(key, None) for key in ISO_KEYS)
+        )
     elif isinstance(data, str):
-        data = re.sub(r"[\r\n\s]+", " ", data.strip()).split(" ")
+        data = data.split()
         if length_check and len(data) != len(ISO_KEYS):
             raise Exception(len(data))
-        o = OrderedDict(zip(ISO_KEYS, data))
         # Remove nulls
-        for k in ISO_KEYS:
-            if o[k] == r"\u{0}":
-                o[k] = None
-        return o
+        return DesktopKeymap(
+            [None if v == r"\u{0}" else v for v in data[: len(ISO_KEYS)]]
+        )
+
+
+# Parses "\s{foo:42.12}", "\s{foo}" and "\{foo:42}"
+RE_SPECIAL_KEY = re.compile(r"^\\s{([^}:]+)(?::(\d+(?:\.\d+)?))?}$")
+
+
+class MobileKey:
+    r"""A special key in a mobile row, written as `\s{id}` or `\s{id:width}`.
+
+    Named keys such as `\s{shift}` get the id "_shift" and no label. Quoted
+    ones such as `\s{"ABC":2}` are identified and labelled by their text."""
+
+    __slots__ = ("id", "label", "width")
+
+    def __init__(self, id, label, width):
+        self.id = id
+        self.label = label
+        self.width = width
+
+    def _key(self):
+        return (self.id, self.label, self.width)
+
+    def __eq__(self, other):
+        if not isinstance(other, MobileKey):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def encode(self):
+        return {"id": self.id, "width": self.width}
+
+    def __repr__(self):
+        return "MobileKey(%r, %r, %r)" % (self.id, self.label, self.width)
+
+
+def parse_mobile_key(key):
+    match = RE_SPECIAL_KEY.match(key)
+    if match is None:
+        return key
+
+    (id_, width) = match.groups()
+    if width is None:
+        width = 1.0
+    else:
+        width = float(width)
+
+    if id_.startswith('"') and id_.endswith('"'):
+        return MobileKey(id_[1:-1], id_[1:-1], width)
+    return MobileKey("_%s" % id_, None, width)
 
 
 def parse_touch_layout(data):
-    return [re.split(r"\s+", x.strip()) for x in data.strip().split("\n")]
+    r"""Returns the rows of a mobile mode as tuples of keys, which are strings
+    or, for `\s{...}` keys, MobileKeys."""
+    return tuple(
+        tuple(parse_mobile_key(k) for k in re.split(r"\s+", x.strip()))
+        for x in data.strip().split("\n")
+    )
 
 
 class MobileLayoutMode(dict):
@@ -129,79 +227,66 @@ def assert_valid_keysets(cand_keys, parent_keys, base_keys, cand, parent):
     #     raise Exception("Missing modes in `%s` relative to `%s`: %s" % (cand, parent, ", ".join(diff)))
 
 
-def parse_modes(tree):
-    # We support these top levels:
-    # mobile, ios, android, desktop, win, mac, ipad-9in, ipad-12in
-    #
+def assert_valid_modes(modes):
     # If ios and/or android exist, if any of their children exist, the same must not exist in mobile
     # If win and/or mac exist, if any of their children exist, the same must not exist in desktop
-    modes = OrderedDict()
-
-    if "mobile" in tree:
-        mobile_layers = MobileLayoutMode.decode(tree["mobile"])
-        mobile_keyset = frozenset(mobile_layers.keys())
-        modes["mobile"] = mobile_layers
-    else:
-        mobile_keyset = frozenset()
+    mobile_keyset = frozenset(modes.get("mobile", {}).keys())
+    desktop_keyset = frozenset(modes.get("desktop", {}).keys())
+
+    for name in ("android", "ios"):
+        if name in modes:
+            assert_valid_keysets(
+                frozenset(modes[name].keys()),
+                mobile_keyset,
+                MOBILE_MODES,
+                name,
+                "mobile",
+            )
 
-    if "desktop" in tree:
-        desktop_layers = DesktopLayoutMode.decode(tree["desktop"])
-        desktop_keyset = frozenset(desktop_layers.keys())
-        modes["desktop"] = desktop_layers
-    else:
-        desktop_keyset = frozenset()
+    # assert_valid_keysets(ipad_keyset, mobile_keyset, MOBILE_MODES, "ipad-9in", "mobile")
+    # assert_valid_keysets(ipad_keyset, mobile_keyset, MOBILE_MODES, "ipad-12in", "mobile")
+
+    for name in ("win", "chrome"):
+        if name in modes:
+            assert_valid_keysets(
+                frozenset(modes[name].keys()),
+                desktop_keyset,
+                DESKTOP_MODES,
+                name,
+                "desktop",
+            )
 
-    if "android" in tree:
-        android_layers = MobileLayoutMode.decode(tree["android"])
-        android_keyset = frozenset(android_layers.keys())
+    if "mac" in modes:
         assert_valid_keysets(
-            android_keyset, mobile_keyset, MOBILE_MODES, "android", "mobile"
+            frozenset(modes["mac"].keys()),
+            desktop_keyset,
+            DESKTOP_MODES | MAC_MODES,
+            "mac",
+            "desktop",
         )
-        modes["android"] = android_layers
-
-    if "ios" in tree:
-        ios_layers = MobileLayoutMode.decode(tree["ios"])
-        ios_keyset = frozenset(ios_layers.keys())
-        assert_valid_keysets(ios_keyset, mobile_keyset, MOBILE_MODES, "ios", "mobile")
-        modes["ios"] = ios_layers
-
-    if "ipad-9in" in tree:
-        ipad_layers = MobileLayoutMode.decode(tree["ipad-9in"])
-        ipad_keyset = frozenset(ipad_layers.keys())
-        # assert_valid_keysets(ipad_keyset, mobile_keyset, MOBILE_MODES, "ipad-9in", "mobile")
-        modes["ipad-9in"] = ipad_layers
-
-    if "ipad-12in" in tree:
-        ipad_layers = MobileLayoutMode.decode(tree["ipad-12in"])
-        ipad_keyset = frozenset(ipad_layers.keys())
-        # assert_valid_keysets(ipad_keyset, mobile_keyset, MOBILE_MODES, "ipad-12in", "mobile")
-        modes["ipad-12in"] = ipad_layers
 
-    if "win" in tree:
-        win_layers = DesktopLayoutMode.decode(tree["win"])
-        win_keyset = frozenset(win_layers.keys())
-        assert_valid_keysets(
-            win_keyset, desktop_keyset, DESKTOP_MODES, "win", "desktop"
-        )
-        modes["win"] = win_layers
 
-    # TODO: deduplicate this mess
-    if "chrome" in tree:
-        chrome_layers = DesktopLayoutMode.decode(tree["chrome"])
-        chrome_keyset = frozenset(chrome_layers.keys())
-        assert_valid_keysets(
-            chrome_keyset, desktop_keyset, DESKTOP_MODES, "chrome", "desktop"
-        )
-        modes["chrome"] = chrome_layers
+def parse_modes(tree, validate=True):
+    # We support these top levels:
+    # mobile, ios, android, desktop, win, mac, ipad-9in, ipad-12in
+    modes = OrderedDict()
+
+    for name in ("mobile", "desktop", "android", "ios", "ipad-9in", "ipad-12in"):
+        if name in tree:
+            if name == "desktop":
+                modes[name] = DesktopLayoutMode.decode(tree[name])
+            else:
+                modes[name] = MobileLayoutMode.decode(tree[name])
 
+    if "win" in tree:
+        modes["win"] = DesktopLayoutMode.decode(tree["win"])
+    if "chrome" in tree:
+        modes["chrome"] = DesktopLayoutMode.decode(tree["chrome"])
     if "mac" in tree:
-        mac_layers = DesktopLayoutMode.decode(tree["mac"], DESKTOP_MODES | MAC_MODES)
-        mac_keyset = frozenset(mac_layers.keys())
-        assert_valid_keysets(
-            mac_keyset, desktop_keyset, DESKTOP_MODES | MAC_MODES, "mac", "desktop"
-        )
-        modes["mac"] = mac_layers
+        modes["mac"] = DesktopLayoutMode.decode(tree["mac"], DESKTOP_MODES | MAC_MODES)
 
+    if validate:
+        assert_valid_modes(modes)
     return modes
 
 
@@ -244,25 +329,39 @@ def derive_transforms(layout, allow_glyphbombs=False):
     if layout.transforms is None:
         layout.transforms = {}
 
-    dead_keys = sorted(set(itertools.chain.from_iterable(layout.dead_keys.values())))
+    dead_keys = sorted(
+        set(
+            itertools.chain.from_iterable(
+                itertools.chain.from_iterable(
+                    (x.values() for x in (layout.dead_keys or {}).values())
+                )
+            )
+        )
+    )
     logger.trace("Dead keys: %r" % dead_keys)
 
     # Get all letter category input chars
     def char_filter(ch):
-        if ch is None:
+        # Mobile rows hold MobileKey records for their special keys.
+        if not isinstance(ch, str):
             return False
         if len(ch) != 1:
             return False
         return unicodedata.category(ch).startswith("L")
 
+    def mode_values(mode):
+        if isinstance(mode, DesktopKeymap):
+            return mode.values()
+        return itertools.chain.from_iterable(mode)
+
     input_chars = sorted(
         set(
             filter(
                 char_filter,
-                set(
-                    itertools.chain.from_iterable(
-                        (x.values() for x in layout.modes.values())
-                    )
+                itertools.chain.from_iterable(
+                    mode_values(mode)
+                    for x in layout.modes.values()
+                    for mode in x.values()
                 ),
             )
         )
@@ -275,35 +374,115 @@ def derive_transforms(layout, allow_glyphbombs=False):
             layout.transforms[d] = {" ": d}
 
         dc = decompose(d)
+        transforms = layout.transforms[d]
+        added = []
 
         for ch in input_chars:
-            composed = "%s%s" % (ch, dc)
+            composed = ch + dc
             normalised = unicodedata.normalize("NFKC", composed)
 
             # Check if when composed the codepoint is not the same as decomposed
             if not allow_glyphbombs and composed == normalised:
-                logger.trace("Skipping %s%s" % (d, ch))
                 continue
 
-            logger.trace("Adding transform: %s%s -> %s" % (d, ch, normalised))
-            layout.transforms[d][ch] = normalised
+            transforms[ch] = normalised
+            added.append(normalised)
 
+        # Logged once per dead key: every log call walks the stack, even at
+        # levels that are filtered out, which costs more than the lookups.
+        logger.trace("Added transforms for %s: %s" % (d, " ".join(added)))
 
-def decode_layout(tree):
-    layout = Layout.decode(tree)
-    layout.modes = parse_modes(layout.modes)
 
-    if layout.longpress is None:
-        layout.longpress = OrderedDict()
+EMPTY_DEAD_KEYS = frozenset()
+
+
+class DeadKeyIndex:
+    """A layout's dead keys as frozensets by platform and mode, for membership
+    tests in the generators' per-key loops. `all` holds every dead key of
+    every platform."""
+
+    __slots__ = ("platforms", "all")
+
+    def __init__(self, dead_keys):
+        self.platforms = {
+            platform: {mode: frozenset(keys) for mode, keys in modes.items()}
+            for platform, modes in (dead_keys or {}).items()
+        }
+        self.all = frozenset(
+            itertools.chain.from_iterable(
+                keys for modes in self.platforms.values() for keys in modes.values()
+            )
+        )
+
+    def modes(self, target, base=None):
+        """Returns the dead keys of each mode of `target`, with `base` filling
+        in the modes the target does not define."""
+        o = {}
+        if base is not None:
+            o.update(self.platforms.get(base, {}))
+        o.update(self.platforms.get(target, {}))
+        return o
 
+    def get(self, target, mode, base=None):
+        keys = self.platforms.get(target, {}).get(mode, None)
+        if keys is None and base is not None:
+            keys = self.platforms.get(base, {}).get(mode, None)
+        if keys is None:
+            return EMPTY_DEAD_KEYS
+        return keys
+
+    def __repr__(self):
+        return "DeadKeyIndex(%r)" % (self.platforms,)
+
+
+class LayoutIndex:
+    """Something worked out from each decoded layout, such as its dead key
+    index, kept beside the layouts rather than on them, as the Layout model
+    is generated from the reproto schema.
+
+    Calling it with a layout returns that layout's entry, building it on
+    first use. Entries go away with their layout. Copies of a layout sent to
+    another process build their own."""
+
+    def __init__(self, build):
+        self._build = build
+        self._entries = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def __call__(self, layout):
+        with self._lock:
+            entry = self._entries.get(layout, None)
+            if entry is None:
+                entry = self._entries[layout] = self._build(layout)
+        return entry
+
+    def share(self, layout, other):
+        """Gives `layout` the entry of `other`, for layouts sharing the data
+        the entry is built from."""
+        entry = self(other)
+        with self._lock:
+            self._entries[layout] = entry
+
+
+dead_key_index = LayoutIndex(lambda layout: DeadKeyIndex(layout.dead_keys))
+transform_automaton = LayoutIndex(
+    lambda layout: TransformAutomaton(layout.transforms)
+)
+
+
+def split_longpress(longpress):
     lp = OrderedDict()
-    for longpress, strings in layout.longpress.items():
-        lp[longpress] = re.split(r"\s+", strings.strip())
-    layout.longpress = lp
+    for key, strings in (longpress or {}).items():
+        lp[key] = re.split(r"\s+", strings.strip())
+    return lp
 
-    transforms_derive = layout.derive is not None and layout.derive.get(
-        "transforms", False
-    )
+
+def decode_layout(tree):
+    layout = Layout.decode(tree)
+    layout.modes = parse_modes(layout.modes)
+    layout.longpress = split_longpress(layout.longpress)
+
+    transforms_derive = layout.derive is not None and layout.derive.transforms
     if transforms_derive is True:
         derive_transforms(
             layout, False
@@ -312,76 +491,439 @@ def decode_layout(tree):
     return layout
 
 
-def normalized_yaml_load(f):
-    data = unicodedata.normalize("NFC", f.read())
+def index_layout(layout):
+    """Builds the dead key index and transform automaton of a decoded layout,
+    once its dicts are final."""
+    dead_key_index(layout)
+    transform_automaton(layout)
+    return layout
+
+
+class LayoutOverrides:
+    """A decoded layout that `extends` another: the name of its base layout,
+    and a Layout holding only what it sets itself."""
+
+    __slots__ = ("base", "layout")
+
+    def __init__(self, base, layout):
+        self.base = base
+        self.layout = layout
+
+    def __repr__(self):
+        return "LayoutOverrides(%r, %r)" % (self.base, self.layout)
+
+
+def decode_overrides(tree):
+    """Decodes the tree of a layout with an `extends` key. Required fields may
+    be left out, and modes are only validated once applied to the base."""
+    tree = OrderedDict(tree)
+    tree.setdefault("displayNames", {})
+    tree.setdefault("modes", {})
+
+    layout = Layout.decode(tree)
+    layout.modes = parse_modes(layout.modes, validate=False)
+    layout.longpress = split_longpress(layout.longpress)
+    return LayoutOverrides(tree["extends"], layout)
+
+
+def _update(base, overrides):
+    if not overrides:
+        return base
+    o = OrderedDict(base or {})
+    o.update(overrides)
+    return o
+
+
+def _update_platforms(base, overrides):
+    if not overrides:
+        return base
+    o = OrderedDict(base or {})
+    for platform, values in overrides.items():
+        o[platform] = _update(o.get(platform, None), values)
+    return o
+
+
+def extend_layout(base, overrides):
+    """Returns a new Layout of `base` with the Layout `overrides` applied.
+
+    Modes, dead keys, spaces and targets are replaced per platform and mode
+    (or target property), display names, long presses and transforms per key,
+    the rest as a whole. Anything `overrides` does not change is shared with
+    `base`, down to the mode tables, as are its dead key index and transform
+    automaton while its dead keys and transforms stay the same. Transforms
+    `base` derived are kept, and derived afresh for the new layout if the
+    overrides touch any of their inputs."""
+    layout = Layout(
+        _update(base.display_names, overrides.display_names),
+        _update_platforms(base.modes, overrides.modes),
+        overrides.decimal if overrides.decimal is not None else base.decimal,
+        _update_platforms(base.space, overrides.space),
+        _update_platforms(base.dead_keys, overrides.dead_keys),
+        _update(base.longpress, overrides.longpress),
+        _update(base.transforms, overrides.transforms),
+        overrides.strings if overrides.strings is not None else base.strings,
+        overrides.derive if overrides.derive is not None else base.derive,
+        _update_platforms(base.targets, overrides.targets),
+    )
+    if layout.modes is not base.modes:
+        assert_valid_modes(layout.modes)
+
+    changed = (
+        layout.modes is not base.modes
+        or layout.dead_keys is not base.dead_keys
+        or layout.transforms is not base.transforms
+        or layout.derive is not base.derive
+    )
+    if changed and layout.derive is not None and layout.derive.transforms is True:
+        # Derived transforms are added to the nested dicts, which must not
+        # be those of the base.
+        layout.transforms = OrderedDict(
+            (k, OrderedDict(v) if isinstance(v, dict) else v)
+            for k, v in (layout.transforms or {}).items()
+        )
+        derive_transforms(layout, False)
+
+    if layout.dead_keys is base.dead_keys:
+        dead_key_index.share(layout, base)
+    else:
+        dead_key_index(layout)
+    if layout.transforms is base.transforms:
+        transform_automaton.share(layout, base)
+    else:
+        transform_automaton(layout)
+    return layout
+
+
+def normalized_yaml_loads(data, name):
+    data = unicodedata.normalize("NFC", data)
     try:
         return orderedyaml.loads(data)
     except Exception as e:
-        layout_name = os.path.basename(f.name).split(".")[0]
+        layout_name = os.path.basename(name).split(".")[0]
         logger.error("Error while parsing layout %r" % layout_name)
         logger.error(e)
         raise e
 
 
+def normalized_yaml_load(f):
+    return normalized_yaml_loads(f.read(), f.name)
+
+
+def load_project(path, data):
+    return Project.decode(normalized_yaml_loads(data.decode("utf-8"), path))
+
+
+def load_layout(path, data):
+    tree = normalized_yaml_loads(data.decode("utf-8"), path)
+    if "extends" in tree:
+        return decode_overrides(tree)
+    return decode_layout(tree)
+
+
+def load_target(path, data):
+    tree = normalized_yaml_loads(data.decode("utf-8"), path)
+    return decode_target(os.path.basename(path), tree)
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def is_embedded():
+    """Whether kbdgen runs inside the kbdgen binary's embedded interpreter."""
+    return any(type(x).__name__ == "OxidizedFinder" for x in sys.meta_path)
+
+
+def worker_pool(workers=None, processes=True):
+    """Returns an executor with `workers` workers (default: one per CPU).
+
+    This is a process pool unless `processes` is False or kbdgen runs inside
+    the kbdgen binary, which cannot be started again as a multiprocessing
+    worker; a thread pool is used then."""
+    workers = workers or os.cpu_count() or 1
+    if processes and not is_embedded():
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+
+def decode_files(tasks, jobs=None, cache=None, read=read_file):
+    """Runs each `(fn, path)` task, returning the results in task order.
+
+    Each path's bytes are read in this process with `read`. Files found in
+    `cache` are not decoded again. With `jobs` set, the remaining tasks are
+    spread over a `worker_pool`. A `jobs` of 0 uses one worker per CPU."""
+    results = [None] * len(tasks)
+    pending = []
+
+    for n, (fn, path) in enumerate(tasks):
+        data = read(path)
+
+        key = None
+        if cache is not None:
+            key = cache.key(fn.__name__, os.path.basename(path), data)
+            results[n] = cache.get(key)
+            if results[n] is not None:
+                logger.trace("Cache hit: %r" % path)
+                continue
+
+        pending.append((n, fn, path, data, key))
+
+    if jobs is None or jobs == 1 or len(pending) < 2:
+        decoded = [fn(path, data) for (_, fn, path, data, _) in pending]
+    else:
+        logger.debug(
+            "Decoding %d files with %s workers" % (len(pending), jobs or "all")
+        )
+        with worker_pool(jobs or None) as executor:
+            futures = [
+                executor.submit(fn, path, data) for (_, fn, path, data, _) in pending
+            ]
+            decoded = [future.result() for future in futures]
+
+    for (n, _, _, _, key), value in zip(pending, decoded):
+        results[n] = value
+        if cache is not None:
+            cache.put(key, value)
+
+    if cache is not None:
+        cache.log_stats()
+
+    return results
+
+
+def layout_error(*args):
+    """A UserException for a layout that cannot be loaded. Layouts are decoded
+    on first access, long after `Parser.parse`, so the error is raised as one
+    the CLI reports cleanly."""
+    # kbdgen.base imports this module.
+    from ..base import UserException
+
+    return UserException(*args)
+
+
+class LayoutMap(collections.abc.Mapping):
+    """Maps layout names to layouts, decoding each layout file on first access.
+
+    A layout that `extends` another is decoded together with its base, and
+    resolved into an ordinary Layout sharing the base's unchanged data."""
+
+    def __init__(self, paths, cache=None, read=read_file):
+        self._paths = paths
+        self._cache = cache
+        self._read = read
+        self._pool = ValuePool()
+        self._layouts = {}
+        # The base of each loaded layout that extends another.
+        self._bases = {}
+
+    def __getitem__(self, name):
+        layout = self._layouts.get(name, None)
+        if layout is None:
+            self.preload((name,))
+            layout = self._layouts[name]
+        return layout
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def preload(self, names=None, jobs=None):
+        """Decodes the named layouts (default: all) that are not loaded yet."""
+        if names is None:
+            names = self._paths.keys()
+        names = [x for x in names if x not in self._layouts]
+        if len(names) == 0:
+            return
+
+        logger.trace("Loading layouts: %s" % ", ".join(names))
+        decoded = {}
+        pending = names
+        while len(pending) > 0:
+            tasks = [(load_layout, self._paths[x]) for x in pending]
+            try:
+                layouts = decode_files(tasks, jobs, self._cache, self._read)
+            except Exception as e:
+                raise layout_error(
+                    "Could not load layout %s. Invalid YAML?"
+                    % ", ".join("'%s'" % x for x in pending),
+                    e,
+                )
+
+            # Layouts may come from worker processes or the cache, so their
+            # strings are only shared once they are back in this process.
+            # Pooling replaces their dicts, so they are indexed after that.
+            # Those that extend another are indexed by `extend_layout`.
+            for name, layout in zip(pending, layouts):
+                if isinstance(layout, LayoutOverrides):
+                    self._pool.layout(layout.layout)
+                else:
+                    layout = index_layout(self._pool.layout(layout))
+                decoded[name] = layout
+
+            # Then the bases of those that extend another, in another round.
+            pending = []
+            for name, layout in decoded.items():
+                if not isinstance(layout, LayoutOverrides):
+                    continue
+                base = layout.base
+                if base not in self._paths:
+                    raise layout_error(
+                        "Layout '%s' extends unknown layout '%s'." % (name, base)
+                    )
+                if base not in decoded and base not in self._layouts:
+                    if base not in pending:
+                        pending.append(base)
+
+        for name in names:
+            self._resolve(name, decoded, ())
+        self._pool.log_stats()
+
+    def _resolve(self, name, decoded, chain):
+        layout = self._layouts.get(name, None)
+        if layout is not None:
+            return layout
+
+        layout = decoded[name]
+        if isinstance(layout, LayoutOverrides):
+            if name in chain:
+                raise layout_error(
+                    "Layouts extend each other: %s" % " -> ".join(chain + (name,))
+                )
+            base = self._resolve(layout.base, decoded, chain + (name,))
+            self._bases[name] = layout.base
+            layout = extend_layout(base, layout.layout)
+
+        self._layouts[name] = layout
+        return layout
+
+    def _drop(self, name):
+        # Drops the decoded layout and those of every layout extending it.
+        # Returns the names of the layouts that extend it.
+        self._layouts.pop(name, None)
+        self._bases.pop(name, None)
+        dependents = set()
+        for other, base in list(self._bases.items()):
+            if base == name:
+                dependents.add(other)
+                dependents.update(self._drop(other))
+        return dependents
+
+    def invalidate(self, name, path):
+        """Points `name` at `path` and drops its decoded layout, if any.
+        Returns the names of the loaded layouts that extend it, which are
+        dropped as well."""
+        self._paths[name] = path
+        return self._drop(name)
+
+    def discard(self, name):
+        self._paths.pop(name, None)
+        return self._drop(name)
+
+
 class ProjectBundle:
     """A project bundle consists of a project.yaml file, a targets/ directory and a layouts/ directory."""
 
     @staticmethod
-    def load(bundle_path):
+    def load(bundle_path, jobs=None, cache=None):
+        """Loads the bundle at `bundle_path`, which is either a directory or a
+        zip or tar archive containing one."""
         logger.trace("Loading %r" % bundle_path)
-        project_yaml_path = os.path.join(bundle_path, "project.yaml")
-        layouts_path = os.path.join(bundle_path, "layouts")
-        targets_path = os.path.join(bundle_path, "targets")
-
-        with open(project_yaml_path, encoding="utf-8") as f:
-            logger.trace("Loading project: %r" % project_yaml_path)
-            project = Project.decode(normalized_yaml_load(f))
-
-        logger.trace("Loading layouts")
-        layouts = dict(
-            [
-                (
-                    os.path.splitext(x)[0],
-                    decode_layout(
-                        normalized_yaml_load(
-                            open(os.path.join(layouts_path, x), encoding="utf-8")
-                        )
-                    ),
-                )
-                for x in os.listdir(layouts_path)
-            ]
+        source = open_source(bundle_path)
+
+        # Sorted so that the resulting dicts do not depend on directory order.
+        layout_files = source.listdir("layouts")
+        target_files = source.listdir("targets")
+
+        logger.trace("Loading project and targets")
+        tasks = [(load_project, "project.yaml")]
+        tasks += [(load_target, "targets/%s" % x) for x in target_files]
+        results = decode_files(tasks, jobs, cache, source.read)
+
+        project = results[0]
+        targets = OrderedDict(
+            (os.path.splitext(x)[0], v) for (x, v) in zip(target_files, results[1:])
         )
 
-        logger.trace("Loading targets")
-        targets = dict(
-            [
-                (
-                    os.path.splitext(x)[0],
-                    decode_target(
-                        x,
-                        normalized_yaml_load(
-                            open(os.path.join(targets_path, x), encoding="utf-8")
-                        ),
-                    ),
-                )
-                for x in os.listdir(targets_path)
-            ]
+        # Layouts are only decoded once something asks for them.
+        layouts = LayoutMap(
+            OrderedDict(
+                (os.path.splitext(x)[0], "layouts/%s" % x) for x in layout_files
+            ),
+            cache,
+            source.read,
         )
 
-        return ProjectBundle(bundle_path, project, layouts, targets)
+        return ProjectBundle(bundle_path, project, layouts, targets, source)
+
+    @staticmethod
+    def load_snapshot(fn):
+        logger.trace("Loading snapshot %r" % fn)
+        return ProjectBundle(*read_snapshot(fn))
+
+    def save_snapshot(self, fn):
+        write_snapshot(self, fn)
 
-    def __init__(self, path, project, layouts, targets):
+    def __init__(self, path, project, layouts, targets, source=None):
         self._path = os.path.abspath(path)
         self._project = project
         self._layouts = layouts
         self._targets = targets
+        self._source = source if source is not None else open_source(self._path)
+
+    def reload(self, changed, cache=None):
+        """Re-decodes the changed (or added, or removed) files of this bundle in place.
+
+        Returns the names of the affected layouts, or None if the project or a
+        target changed, which affects every layout."""
+        project_yaml_path = os.path.join(self._path, "project.yaml")
+        affected = set()
+        everything = False
+
+        for path in changed:
+            path = os.path.abspath(path)
+            kind = os.path.basename(os.path.dirname(path))
+            name = os.path.splitext(os.path.basename(path))[0]
+            exists = os.path.isfile(path)
+
+            if path == project_yaml_path:
+                logger.trace("Reloading project")
+                self._project = decode_files([(load_project, path)], cache=cache)[0]
+                everything = True
+            elif kind == "targets":
+                logger.trace("Reloading target %r" % name)
+                if exists:
+                    self._targets[name] = decode_files(
+                        [(load_target, path)], cache=cache
+                    )[0]
+                else:
+                    self._targets.pop(name, None)
+                everything = True
+            elif kind == "layouts":
+                logger.trace("Reloading layout %r" % name)
+                if exists:
+                    affected.update(self._layouts.invalidate(name, path))
+                else:
+                    affected.update(self._layouts.discard(name))
+                affected.add(name)
+
+        if everything:
+            return None
+        return affected
 
     def relpath(self, end):
-        return os.path.abspath(os.path.join(self.path, end))
+        """Returns the path on disk of `end` within the bundle. For archives,
+        `end` and anything below it is extracted first."""
+        return self._source.extract(end)
 
     @property
     def name(self):
-        return os.path.splitext(os.path.basename(self._path[:-1]))[0]
+        return self._source.name
 
     @property
     def path(self):
@@ -400,4 +942,4 @@ class ProjectBundle:
         return self._targets
 
     def resources(self, target):
-        return os.path.join(self.relpath("resources"), target)
+        return self.relpath(os.path.join("resources", target))
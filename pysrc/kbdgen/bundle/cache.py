@@ -0,0 +1,80 @@
+import os
+import hashlib
+import pickle
+import tempfile
+import logging
+import unicodedata
+from pathlib import Path
+
+from kbdgen import __version__
+
+logger = logging.getLogger()
+
+# Bump whenever the shape of decoded objects changes without a version bump,
+# so that stale pickles are not picked up by a newer kbdgen.
+CACHE_FORMAT = 8
+
+
+class DecodeCache:
+    """Stores decoded project, layout and target objects on disk.
+
+    Entries are keyed by the sha256 of the source file's contents together
+    with the kbdgen version and the Unicode version of `unicodedata`, which
+    derived transforms depend on, so an edited file or an upgrade of kbdgen
+    or Python simply misses and is decoded afresh."""
+
+    @staticmethod
+    def default():
+        from ..filecache import FileCache
+
+        return DecodeCache(FileCache().cache_dir / "decoded")
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, name, data):
+        m = hashlib.sha256()
+        header = (__version__, CACHE_FORMAT, unicodedata.unidata_version, kind, name)
+        m.update(("%s\0%s\0%s\0%s\0%s\0" % header).encode("utf-8"))
+        m.update(data)
+        return m.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / ("%s.pickle" % key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with path.open("rb") as f:
+                obj = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.debug("Discarding unreadable cache entry %s: %s" % (path, e))
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so concurrent runs never see a
+            # partially written entry.
+            fd, tmp = tempfile.mkstemp(dir=str(path.parent))
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, str(path))
+        except Exception as e:
+            logger.debug("Could not write cache entry %s: %s" % (path, e))
+
+    def log_stats(self):
+        logger.debug(
+            "Decode cache: %d hits, %d misses (%s)"
+            % (self.hits, self.misses, self.cache_dir)
+        )
@@ -0,0 +1,76 @@
+import sys
+import logging
+
+logger = logging.getLogger()
+
+
+class ValuePool:
+    """Makes equal strings in decoded layouts share one instance.
+
+    Key values such as letters, digits and dead key glyphs repeat across modes
+    and layouts, but every decode (and every unpickled cache entry) produces
+    separate copies. Strings are passed through `sys.intern`, so the sharing
+    extends to every bundle loaded into the same process."""
+
+    def __init__(self):
+        self.values = 0
+        self.shared = 0
+        self.saved_bytes = 0
+
+    def str(self, value):
+        if type(value) is not str:
+            return value
+        self.values += 1
+        interned = sys.intern(value)
+        if interned is not value:
+            self.shared += 1
+            self.saved_bytes += sys.getsizeof(value)
+        return interned
+
+    def list(self, values):
+        return [self.str(x) for x in values]
+
+    def tuple(self, values):
+        return tuple(self.str(x) for x in values)
+
+    def dict(self, obj):
+        """Returns a copy of a nested dict of strings, with keys and values pooled."""
+        o = obj.__class__()
+        for k, v in obj.items():
+            if isinstance(v, dict):
+                v = self.dict(v)
+            elif isinstance(v, list):
+                v = self.list(v)
+            else:
+                v = self.str(v)
+            o[self.str(k)] = v
+        return o
+
+    def layout(self, layout):
+        from . import DesktopKeymap
+
+        for modes in layout.modes.values():
+            for name, mode in modes.items():
+                if isinstance(mode, DesktopKeymap):
+                    modes[name] = DesktopKeymap(
+                        [self.str(x) for x in mode.values()],
+                        tuple(self.str(x) for x in mode.decoded_values()),
+                    )
+                else:
+                    modes[name] = tuple(self.tuple(row) for row in mode)
+
+        if layout.dead_keys is not None:
+            layout.dead_keys = self.dict(layout.dead_keys)
+        if layout.space is not None:
+            layout.space = self.dict(layout.space)
+        if layout.transforms is not None:
+            layout.transforms = self.dict(layout.transforms)
+        layout.longpress = self.dict(layout.longpress)
+
+        return layout
+
+    def log_stats(self):
+        logger.debug(
+            "Value pool: %d of %d strings shared, ~%d KiB saved"
+            % (self.shared, self.values, self.saved_bytes // 1024)
+        )
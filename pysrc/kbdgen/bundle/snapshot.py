@@ -0,0 +1,74 @@
+import os
+import struct
+import pickle
+import logging
+from collections import OrderedDict
+
+from kbdgen import __version__
+
+logger = logging.getLogger()
+
+# A snapshot is the magic, a header and a pickle of the decoded bundle:
+#
+#   b"KBDC" | u16 format | u16 length | kbdgen version (utf-8) | pickle
+#
+# Bump FORMAT whenever the pickled objects change shape.
+MAGIC = b"KBDC"
+FORMAT = 6
+HEADER = struct.Struct("<4sHH")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(bundle, fn):
+    """Writes a fully decoded bundle to `fn`, so that it can be loaded without
+    parsing any YAML. Resources are not included; they are looked up relative
+    to the snapshot, where the bundle was relative to it when compiled."""
+    layouts = bundle.layouts
+    if hasattr(layouts, "preload"):
+        layouts.preload()
+
+    payload = {
+        "path": os.path.relpath(bundle.path, os.path.dirname(os.path.abspath(fn))),
+        "project": bundle.project,
+        "layouts": OrderedDict(layouts.items()),
+        "targets": bundle.targets,
+    }
+    version = __version__.encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(fn)), exist_ok=True)
+    tmp = "%s.tmp" % fn
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, len(version)))
+        f.write(version)
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, fn)
+
+
+def read_snapshot(fn):
+    """Returns the (path, project, layouts, targets) of a snapshot written by
+    `write_snapshot`."""
+    with open(fn, "rb") as f:
+        data = memoryview(f.read())
+
+    if len(data) < HEADER.size:
+        raise SnapshotError("'%s' is not a kbdgen snapshot." % fn)
+    magic, fmt, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("'%s' is not a kbdgen snapshot." % fn)
+
+    offset = HEADER.size + length
+    version = bytes(data[HEADER.size : offset]).decode("utf-8", "replace")
+    if fmt != FORMAT or version != __version__:
+        raise SnapshotError(
+            "'%s' was compiled by kbdgen %s (snapshot format %d), but this is "
+            "kbdgen %s (snapshot format %d). Compile it again."
+            % (fn, version, fmt, __version__, FORMAT)
+        )
+
+    payload = pickle.loads(data[offset:])
+    path = os.path.join(os.path.dirname(os.path.abspath(fn)), payload["path"])
+    logger.trace("Loaded snapshot %r (bundle path: %r)" % (fn, path))
+    return path, payload["project"], payload["layouts"], payload["targets"]
@@ -0,0 +1,216 @@
+import abc
+import os
+import atexit
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+import logging
+import posixpath
+
+logger = logging.getLogger()
+
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path):
+    path = path.lower()
+    return path.endswith(".zip") or path.endswith(TAR_EXTENSIONS)
+
+
+def open_source(path):
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return ZipSource(path)
+    if lower.endswith(TAR_EXTENSIONS):
+        return TarSource(path)
+    return DirectorySource(path)
+
+
+class DirectorySource:
+    """A bundle that is a directory on disk."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    def listdir(self, subdir):
+        return sorted(os.listdir(os.path.join(self.path, subdir)))
+
+    def read(self, name):
+        with open(os.path.join(self.path, name), "rb") as f:
+            return f.read()
+
+    def extract(self, name):
+        return os.path.abspath(os.path.join(self.path, name))
+
+
+class ArchiveSource(abc.ABC):
+    """A bundle inside a zip or tar archive.
+
+    The bundle is the directory holding the archive's shallowest `project.yaml`.
+    Files are read straight from the archive; only paths handed out through
+    `extract` (such as a target's resources) are written to a temporary
+    directory, which is removed on exit.
+
+    The open archive is not pickled along with a source; a copy sent to a
+    worker process opens the archive again when it first reads from it."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._archive = None
+        self._members = None
+        self._lock = threading.Lock()
+        self._extract_dir = None
+        self._extracted = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_archive"] = None
+        state["_members"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        if self._root():
+            return os.path.splitext(posixpath.basename(self._root()))[0]
+        name = os.path.basename(self.path)
+        for ext in (".zip",) + TAR_EXTENSIONS:
+            if name.lower().endswith(ext):
+                name = name[: -len(ext)]
+                break
+        return os.path.splitext(name)[0]
+
+    @abc.abstractmethod
+    def _open(self):
+        """Opens the archive at `self.path`."""
+
+    @abc.abstractmethod
+    def _member_names(self):
+        """Maps each file member of the open archive to its path in it."""
+
+    @abc.abstractmethod
+    def _read_member(self, member):
+        """Returns the bytes of a member of the open archive."""
+
+    def _index(self):
+        with self._lock:
+            if self._members is None:
+                self._load_index()
+        return self._members
+
+    def _load_index(self):
+        self._archive = self._open()
+        names = self._member_names()
+
+        candidates = [
+            x for x in names.values() if posixpath.basename(x) == "project.yaml"
+        ]
+        if len(candidates) == 0:
+            raise Exception("No project.yaml found in '%s'." % self.path)
+        root = posixpath.dirname(min(candidates, key=lambda x: x.count("/")))
+
+        members = {}
+        for member, name in names.items():
+            if root != "":
+                if not name.startswith(root + "/"):
+                    continue
+                name = name[len(root) + 1 :]
+            members[name] = member
+        self._root_name = root
+        self._members = members
+
+    def _root(self):
+        self._index()
+        return self._root_name
+
+    def listdir(self, subdir):
+        prefix = subdir.rstrip("/") + "/"
+        return sorted(
+            x[len(prefix) :]
+            for x in self._index()
+            if x.startswith(prefix) and "/" not in x[len(prefix) :]
+        )
+
+    def read(self, name):
+        members = self._index()
+        name = posixpath.normpath(name.replace(os.sep, "/"))
+        if name not in members:
+            raise FileNotFoundError("'%s' not found in '%s'" % (name, self.path))
+        with self._lock:
+            return self._read_member(members[name])
+
+    def extract(self, name):
+        """Extracts the file or directory `name` and returns its path on disk.
+
+        A path is returned even if the archive has no such file, so that
+        callers can check for its existence as they would for a directory."""
+        members = self._index()
+        name = posixpath.normpath(name.replace(os.sep, "/"))
+
+        # Held throughout, as targets may extract their resources from
+        # several threads at once.
+        with self._lock:
+            if self._extract_dir is None:
+                self._extract_dir = tempfile.mkdtemp(prefix="kbdgen-")
+                atexit.register(shutil.rmtree, self._extract_dir, True)
+            target = os.path.join(self._extract_dir, *name.split("/"))
+
+            if name in self._extracted:
+                return target
+
+            prefix = name + "/"
+            wanted = [x for x in members if x == name or x.startswith(prefix)]
+            logger.trace(
+                "Extracting %d files for %r from %r" % (len(wanted), name, self.path)
+            )
+            for x in wanted:
+                if x in self._extracted:
+                    continue
+                parts = x.split("/")
+                if ".." in parts:
+                    continue
+                dest = os.path.join(self._extract_dir, *parts)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                with open(dest, "wb") as f:
+                    f.write(self._read_member(members[x]))
+                self._extracted.add(x)
+
+            self._extracted.add(name)
+            return target
+
+
+class ZipSource(ArchiveSource):
+    def _open(self):
+        return zipfile.ZipFile(self.path)
+
+    def _member_names(self):
+        return {x: x.filename for x in self._archive.infolist() if not x.is_dir()}
+
+    def _read_member(self, member):
+        return self._archive.read(member)
+
+
+class TarSource(ArchiveSource):
+    def _open(self):
+        return tarfile.open(self.path)
+
+    def _member_names(self):
+        members = self._archive.getmembers()
+        return {x: posixpath.normpath(x.name) for x in members if x.isfile()}
+
+    def _read_member(self, member):
+        f = self._archive.extractfile(member)
+        try:
+            return f.read()
+        finally:
+            f.close()
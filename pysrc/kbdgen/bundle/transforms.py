@@ -0,0 +1,113 @@
+class TransformAutomaton:
+    """A layout's nested `transforms` compiled into a flat automaton.
+
+    State 0 is the start state. Each state has one edge per key of its
+    transforms node: typing that key either leads to another state, when the
+    node maps it to a further node, or ends the sequence with an output. The
+    edges of state `n` are numbered `offsets[n]` to `offsets[n + 1]`, in the
+    order the transforms list them, and `keys`, `targets` and `outputs` hold
+    each edge's key, next state (None for an output) and output (None for a
+    next state). States are numbered in depth-first order of the transforms.
+
+    Building and walking it takes time linear in the number of edges, however
+    deep the transforms nest."""
+
+    __slots__ = ("keys", "targets", "outputs", "offsets", "_edges")
+
+    def __init__(self, transforms):
+        # Number the nodes in depth-first order, noting which edge leads to
+        # each one, without recursing.
+        nodes = []
+        child_states = {}
+        stack = [(transforms or {}, None)]
+        while stack:
+            node, edge = stack.pop()
+            state = len(nodes)
+            if edge is not None:
+                child_states[edge] = state
+            nodes.append(node)
+            branches = [(k, v) for k, v in node.items() if isinstance(v, dict)]
+            for k, v in reversed(branches):
+                stack.append((v, (state, k)))
+
+        keys = []
+        targets = []
+        outputs = []
+        offsets = []
+        for state, node in enumerate(nodes):
+            offsets.append(len(keys))
+            for k, v in node.items():
+                keys.append(str(k))
+                if isinstance(v, dict):
+                    targets.append(child_states[(state, k)])
+                    outputs.append(None)
+                elif isinstance(v, (int, str)):
+                    targets.append(None)
+                    outputs.append(str(v))
+                else:
+                    raise TypeError(v)
+        offsets.append(len(keys))
+
+        self.keys = tuple(keys)
+        self.targets = tuple(targets)
+        self.outputs = tuple(outputs)
+        self.offsets = tuple(offsets)
+        self._edges = None
+
+    def __len__(self):
+        """The number of states."""
+        return len(self.offsets) - 1
+
+    def edges(self, state):
+        """Yields `(key, next state, output)` for each edge of `state`."""
+        for e in range(self.offsets[state], self.offsets[state + 1]):
+            yield self.keys[e], self.targets[e], self.outputs[e]
+
+    def step(self, state, key):
+        """Returns `(next state, output)` for typing `key` in `state`, or None
+        if `state` has no edge for `key`."""
+        if self._edges is None:
+            self._edges = {}
+            for state_ in range(len(self)):
+                for e in range(self.offsets[state_], self.offsets[state_ + 1]):
+                    self._edges[(state_, self.keys[e])] = e
+        e = self._edges.get((state, key), None)
+        if e is None:
+            return None
+        return self.targets[e], self.outputs[e]
+
+    def fallback(self, state, default):
+        """The output of `state` when it is followed by a space, which is also
+        what platforms emit when it is followed by a key it has no edge for."""
+        step = self.step(state, " ")
+        if step is None or step[1] is None:
+            return default
+        return step[1]
+
+    def walk(self):
+        """Yields `(state, key, next state, output)` for every edge, depth
+        first: each edge leading to a state comes right before that state's
+        edges."""
+        offsets = self.offsets
+        stack = [[0, offsets[0], offsets[1]]]
+        while stack:
+            top = stack[-1]
+            state, e, end = top
+            if e == end:
+                stack.pop()
+                continue
+            top[1] = e + 1
+            target = self.targets[e]
+            yield state, self.keys[e], target, self.outputs[e]
+            if target is not None:
+                stack.append([target, offsets[target], offsets[target + 1]])
+
+    def __getstate__(self):
+        return (self.keys, self.targets, self.outputs, self.offsets)
+
+    def __setstate__(self, state):
+        self.keys, self.targets, self.outputs, self.offsets = state
+        self._edges = None
+
+    def __repr__(self):
+        return "TransformAutomaton(%d states, %d edges)" % (len(self), len(self.keys))
@@ -0,0 +1,167 @@
+import logging
+
+from collections import OrderedDict, namedtuple
+
+from .base import UserException, get_logger
+from .gen.base import (
+    DesktopLayoutView,
+    MobileLayoutView,
+    MSG_LAYOUT_MISSING,
+    dead_key_problems,
+)
+
+logger = get_logger(__name__)
+
+# Targets that `check` knows how to validate. Desktop targets fall back to
+# the `desktop` modes of a layout, mobile targets to its `mobile` modes.
+DESKTOP_TARGETS = ("win", "mac", "chrome")
+MOBILE_TARGETS = ("android", "ios")
+TARGETS = DESKTOP_TARGETS + MOBILE_TARGETS
+
+# A single problem found by `check_bundle`. `layout` is None for problems with
+# the project or a target as a whole, `target` is None for problems with a
+# layout that affect every target.
+Finding = namedtuple("Finding", ["level", "layout", "target", "message"])
+
+
+def load_layouts(bundle, jobs=None):
+    """Decodes every layout of `bundle`, returning the ones that could be
+    decoded by name and a finding for each one that could not."""
+    layouts = bundle.layouts
+    findings = []
+
+    preload = getattr(layouts, "preload", None)
+    if preload is not None:
+        try:
+            preload(jobs=jobs)
+        except Exception:
+            # Decoded one at a time below, to find out which ones fail.
+            pass
+
+    loaded = OrderedDict()
+    for name in layouts:
+        try:
+            loaded[name] = layouts[name]
+        except UserException as e:
+            message = " ".join(str(x) for x in e.args)
+            findings.append(Finding(logging.ERROR, name, None, message))
+        except Exception as e:
+            findings.append(
+                Finding(logging.ERROR, name, None, "Could not decode layout: %s" % e)
+            )
+    return loaded, findings
+
+
+# The checks themselves live with their generators, which run them as part
+# of `satisfies_requirements`; generators are only imported when needed.
+
+
+def _check_win_layout(name, layout):
+    from .gen.win import win_layout_problems
+
+    return win_layout_problems(name, layout)
+
+
+def _check_android_layout(name, layout):
+    from .gen.android import android_layout_problems
+
+    return android_layout_problems(layout)
+
+
+LAYOUT_CHECKS = {"win": _check_win_layout, "android": _check_android_layout}
+
+
+def check_layout(name, layout, targets):
+    """Returns the findings for one decoded layout against each of `targets`
+    it defines modes for."""
+    findings = []
+    for target in targets:
+        if target in DESKTOP_TARGETS:
+            if target not in layout.modes and "desktop" not in layout.modes:
+                continue
+            view = DesktopLayoutView(layout, target)
+            problems = list(dead_key_problems(view))
+        else:
+            if target not in layout.modes and "mobile" not in layout.modes:
+                continue
+            view = MobileLayoutView(layout, target)
+            problems = []
+
+        if "default" not in view.modes():
+            problems.append((logging.ERROR, MSG_LAYOUT_MISSING % (name, "default")))
+
+        check = LAYOUT_CHECKS.get(target, None)
+        if check is not None:
+            problems.extend(check(name, layout))
+
+        findings.extend(Finding(level, name, target, m) for level, m in problems)
+    return findings
+
+
+def _check_win_target(bundle, layouts):
+    from .gen.win import win_target_problems
+
+    return win_target_problems(bundle.project, bundle.targets["win"])
+
+
+def _check_android_target(bundle, layouts):
+    from .gen.android import android_target_problems
+
+    return android_target_problems(bundle.targets["android"])
+
+
+def _check_mac_target(bundle, layouts):
+    from .gen.mac import mac_name_problems
+
+    return mac_name_problems(
+        name
+        for name, layout in layouts.items()
+        if "mac" in layout.modes or "desktop" in layout.modes
+    )
+
+
+TARGET_CHECKS = {
+    "win": _check_win_target,
+    "android": _check_android_target,
+    "mac": _check_mac_target,
+}
+
+
+def check_bundle(bundle, targets=None, jobs=None):
+    """Validates every layout of `bundle` against `targets` (default: each
+    target the bundle declares that `check` knows) in a single pass over the
+    decoded layouts, and returns all findings rather than stopping at the
+    first. With `jobs` set, layouts are decoded in parallel."""
+    if targets is None:
+        targets = [x for x in TARGETS if x in bundle.targets]
+
+    layouts, findings = load_layouts(bundle, jobs)
+
+    for target in targets:
+        if target not in bundle.targets:
+            findings.append(
+                Finding(
+                    logging.ERROR,
+                    None,
+                    target,
+                    "Project does not contain a `%s` target." % target,
+                )
+            )
+            continue
+
+        check = TARGET_CHECKS.get(target, None)
+        if check is not None:
+            findings.extend(
+                Finding(level, None, target, m) for level, m in check(bundle, layouts)
+            )
+
+    for name, layout in layouts.items():
+        findings.extend(check_layout(name, layout, targets))
+
+    return findings
+
+
+def log_findings(findings):
+    for finding in findings:
+        where = [x for x in (finding.layout, finding.target) if x is not None]
+        logger.log(finding.level, "[%s] %s" % ("/".join(where), finding.message))
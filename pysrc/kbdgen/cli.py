@@ -7,29 +7,40 @@ import logging
 
 from . import __version__, gen
 from .base import KbdgenException, Parser, get_logger, UserException
+from .bundle.cache import DecodeCache
+from .check import TARGETS, check_bundle, log_findings
+from .gen.base import resolved_layouts
+from .watch import watch
 
 logger = get_logger(__name__)
 
 
-def parse_args(args):
-    def logging_type(string):
-        n = {
-            "critical": 50,
-            "error": 40,
-            "warning": 30,
-            "info": 20,
-            "debug": 10,
-            "trace": 5,
-        }.get(string, None)
-
-        if n is None:
-            raise argparse.ArgumentTypeError("Invalid logging level.")
-        return n
+def logging_type(string):
+    n = {
+        "critical": 50,
+        "error": 40,
+        "warning": 30,
+        # As the kbdgen binary spells it.
+        "warn": 30,
+        "info": 20,
+        "debug": 10,
+        "trace": 5,
+    }.get(string, None)
+
+    if n is None:
+        raise argparse.ArgumentTypeError("Invalid logging level.")
+    return n
+
+
+def add_logging_argument(p):
+    p.add_argument("--logging", type=logging_type, default=20, help="Logging level")
 
+
+def parse_args(args):
     p = argparse.ArgumentParser(prog="kbdgen")
 
     p.add_argument("--version", action="version", version="%(prog)s " + __version__)
-    p.add_argument("--logging", type=logging_type, default=20, help="Logging level")
+    add_logging_argument(p)
     p.add_argument("--local", action="store_true", help="local build")
     p.add_argument("--legacy", action="store_true", help='(Windows only)')
     p.add_argument(
@@ -76,7 +87,9 @@ def parse_args(args):
         default=".",
         help="Output directory (default: current working directory)",
     )
-    p.add_argument("project", help="Keyboard generation bundle (.kbdgen)")
+    p.add_argument(
+        "project", help="Keyboard generation bundle (.kbdgen, or a zip or tar of one)"
+    )
     p.add_argument(
         "-f",
         "--flag",
@@ -92,10 +105,142 @@ def parse_args(args):
     p.add_argument("--github-token", help="GitHub token for source getting")
     p.add_argument("-c", "--command", help="Command to run for a given generators")
     p.add_argument("--ci", action="store_true", help="Continuous integration build")
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Decode and render layouts with N worker processes (0: one per CPU)",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always decode the bundle and build DLLs instead of using the caches",
+    )
+    p.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running and regenerate the outputs of layouts as they change",
+    )
+
+    return p.parse_args(args)
+
+
+def parse_compile_args(args):
+    p = argparse.ArgumentParser(
+        prog="kbdgen compile",
+        description="Decode a .kbdgen bundle into a .kbdc snapshot, which can be "
+        "given to kbdgen in place of the bundle and loads without parsing YAML.",
+    )
+    add_logging_argument(p)
+    p.add_argument(
+        "-o",
+        "--output",
+        help="Snapshot file to write (default: <bundle name>.kbdc in the "
+        "current working directory)",
+    )
+    p.add_argument(
+        "project", help="Keyboard generation bundle (.kbdgen, or a zip or tar of one)"
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Decode layouts and targets with N worker processes (0: one per CPU)",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always decode the bundle instead of using the decoded bundle cache",
+    )
+
+    return p.parse_args(args)
+
+
+def run_compile(cli_args):
+    args = parse_compile_args(cli_args)
+
+    if args.project.endswith(".kbdc"):
+        logger.error("'%s' is already a snapshot." % args.project)
+        return 1
+
+    try:
+        cache = None if args.no_cache else DecodeCache.default()
+        project = Parser().parse(args.project, jobs=args.jobs, cache=cache)
+        output = args.output
+        if output is None:
+            output = "%s.kbdc" % project.name
+        project.save_snapshot(output)
+    except UserException as e:
+        for arg in e.args:
+            logger.critical(str(arg))
+        return 1
+
+    logger.info("Wrote '%s'." % output)
+    return 0
+
+
+def parse_check_args(args):
+    p = argparse.ArgumentParser(
+        prog="kbdgen check",
+        description="Validate every layout of a bundle against its targets "
+        "without generating anything, reporting all problems found.",
+    )
+    add_logging_argument(p)
+    p.add_argument(
+        "-t",
+        "--target",
+        action="append",
+        dest="targets",
+        choices=TARGETS,
+        help="Target to validate against, may be given more than once "
+        "(default: all targets of the bundle)",
+    )
+    p.add_argument(
+        "project", help="Keyboard generation bundle (.kbdgen, or a zip or tar of one)"
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Decode layouts and targets with N worker processes (0: one per CPU)",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always decode the bundle instead of using the decoded bundle cache",
+    )
 
     return p.parse_args(args)
 
 
+def run_check(cli_args):
+    args = parse_check_args(cli_args)
+
+    try:
+        cache = None if args.no_cache else DecodeCache.default()
+        project = Parser().parse(args.project, jobs=args.jobs, cache=cache)
+    except UserException as e:
+        for arg in e.args:
+            logger.critical(str(arg))
+        return 1
+
+    try:
+        findings = check_bundle(project, args.targets, jobs=args.jobs)
+    except UserException as e:
+        for arg in e.args:
+            logger.critical(str(arg))
+        return 1
+    log_findings(findings)
+
+    errors = sum(1 for x in findings if x.level >= logging.ERROR)
+    logger.info(
+        "Checked %d layouts: %d errors, %d warnings."
+        % (len(project.layouts), errors, len(findings) - errors)
+    )
+    return 1 if errors > 0 else 0
+
+
 # def assert_not_inside_mod(output_dir):
 #     abs_output = os.path.abspath(output_dir)
 #     abs_current = os.path.abspath(os.path.join(__package__, ".."))
@@ -124,13 +269,21 @@ def print_diagnostics():
 
 
 def run_cli(cli_args):
+    if len(cli_args) > 0 and cli_args[0] == "compile":
+        return run_compile(cli_args[1:])
+    if len(cli_args) > 0 and cli_args[0] == "check":
+        return run_check(cli_args[1:])
+
     args = parse_args(cli_args)
     # logger.setLevel(args.logging)
 
     print_diagnostics()
 
     try:
-        project = Parser().parse(args.project, args.cfg_pairs)
+        cache = None if args.no_cache else DecodeCache.default()
+        project = Parser().parse(
+            args.project, args.cfg_pairs, jobs=args.jobs, cache=cache
+        )
         if project is None:
             raise Exception("Project parser returned empty project.")
     except yaml.scanner.ScannerError as e:
@@ -170,3 +323,11 @@ def run_cli(cli_args):
         x.generate(x.output_dir)
     except KbdgenException as e:
         logger.error(e)
+    except UserException as e:
+        for arg in e.args:
+            logger.critical(str(arg))
+        return 1
+    resolved_layouts.log_stats()
+
+    if args.watch:
+        watch(x, x.output_dir, cfg_pairs=args.cfg_pairs, cache=cache)
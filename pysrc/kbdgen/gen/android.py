@@ -3,9 +3,10 @@ import os.path
 import shutil
 import sys
 import subprocess
-from collections import defaultdict, OrderedDict, namedtuple
+from collections import defaultdict, namedtuple
 from pathlib import Path
 import json
+import logging
 import reqwest
 import zipfile
 import io
@@ -16,7 +17,14 @@ from xml.etree.ElementTree import Element, SubElement
 import tarfile
 import tempfile
 
-from .base import Generator, run_process, MobileLayoutView, get_bin_resource
+from .base import (
+    Generator,
+    run_process,
+    MobileLayoutView,
+    get_bin_resource,
+    render_layouts,
+)
+from ..bundle import MobileKey, dead_key_index
 from ..filecache import FileCache
 from ..base import get_logger
 from .. import boolmap
@@ -33,6 +41,27 @@ for api in (21, 23):
         ANDROID_GLYPHS[api] = boolmap.BoolMap(f.read())
 
 
+def android_target_problems(target):
+    """Yields a `(level, message)` pair for each problem with the `android`
+    target of a project."""
+    if target.package_id is None:
+        yield (logging.ERROR, "No package ID provided for Android target.")
+
+
+def android_layout_problems(layout):
+    """Yields a `(level, message)` pair for each problem with a layout's
+    Android modes. Rows that are too long are warnings."""
+    view = MobileLayoutView(layout, "android")
+    for mode in view.modes():
+        for n, row in enumerate(view.mode(mode)):
+            if len(row) > 12:
+                yield (
+                    logging.WARNING,
+                    "Row %s in mode '%s' has %s keys. It is recommended to "
+                    "have 12 keys or less per row." % (n + 1, mode, len(row)),
+                )
+
+
 class AndroidGenerator(Generator):
     REPO = "giella-ime"
     ANDROID_NS = "http://schemas.android.com/apk/res/android"
@@ -95,13 +124,8 @@ class AndroidGenerator(Generator):
         self.cache = FileCache()
 
     @property
-    # @lru_cache(maxsize=1)
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if "android" in v.modes or "mobile" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("android", "mobile")
 
     def generate(self, base="."):
         if not self.satisfies_requirements():
@@ -133,40 +157,20 @@ class AndroidGenerator(Generator):
         if dsn is not None:
             self.add_sentry_dsn(dsn, base)
 
-        styles = [("phone", "xml"), ("tablet", "xml-sw600dp")]
-
         files = []
 
         layouts = defaultdict(list)
 
         logger.info("Updating XML strings…")
+        # In threads, as the XML namespaces above are only registered in this
+        # process.
+        rendered = render_layouts(
+            self.render_layout_files, self.supported_layouts, self.jobs, processes=False
+        )
         for name, kbd in self.supported_layouts.items():
             kbd_id = self.kbd_pkg_id(name)
             clean_name = name.lower().replace("-", "_")
-            files += [
-                (
-                    "app/src/main/res/xml/keyboard_layout_set_%s.xml" % kbd_id,
-                    self.kbd_layout_set(kbd_id, kbd),
-                ),
-                (
-                    "app/src/main/res/xml/kbd_%s.xml" % kbd_id,
-                    self.keyboard(kbd_id, kbd),
-                ),
-            ]
-
-            for style, prefix in styles:
-                self.gen_key_width(kbd, style)
-
-                files.append(
-                    (
-                        "app/src/main/res/%s/rows_%s.xml" % (prefix, kbd_id),
-                        self.rows(kbd_id, kbd, style),
-                    )
-                )
-
-                for row in self.rowkeys(kbd_id, kbd, style):
-                    row = ("app/src/main/res/%s/%s" % (prefix, row[0]), row[1])
-                    files.append(row)
+            files += rendered[name]
 
             layouts[self.layout_target(kbd).get("minimumSdk", None)].append(
                 (kbd_id, clean_name, kbd)
@@ -238,28 +242,20 @@ class AndroidGenerator(Generator):
                 logger.error("STORE_PW and KEY_PW must be set for a release build.")
                 sane = False
 
-        pid = self.android_target.package_id
-        if pid is None:
-            sane = False
-            logger.error("No package ID provided for Android target.")
+        for level, message in android_target_problems(self.android_target):
+            logger.log(level, message)
+            if level >= logging.ERROR:
+                sane = False
 
         for name, kbd in self.supported_layouts.items():
             for dn_locale in kbd.display_names:
                 if dn_locale in ["zz", name]:
                     continue
 
-            layout_view = MobileLayoutView(kbd, "android")
-            for mode in layout_view.modes():
-                for n, row in enumerate(layout_view.mode(mode)):
-                    if len(row) > 12:
-                        logger.warning(
-                            (
-                                "[%s] row %s in mode '%s' has %s keys. It is "
-                                + "recommended to have 12 keys or less per "
-                                + "row."
-                            )
-                            % (name, n + 1, mode, len(row))
-                        )
+            for level, message in android_layout_problems(kbd):
+                logger.log(level, "[%s] %s" % (name, message))
+                if level >= logging.ERROR:
+                    sane = False
             for api_v in [21, 23]:
                 if not self.detect_unavailable_glyphs(name, kbd, api_v):
                     sane = False
@@ -717,6 +713,34 @@ ext.app = [
         with open(fn, "w", encoding="utf-8") as f:
             f.write(data)
 
+    def render_layout_files(self, ctx):
+        """The XML files of a layout, as `(path, data)` pairs."""
+        kbd = ctx.layout
+        kbd_id = self.kbd_pkg_id(ctx.name)
+        files = [
+            (
+                "app/src/main/res/xml/keyboard_layout_set_%s.xml" % kbd_id,
+                self.kbd_layout_set(kbd_id, kbd),
+            ),
+            ("app/src/main/res/xml/kbd_%s.xml" % kbd_id, self.keyboard(kbd_id, kbd)),
+        ]
+
+        for style, prefix in (("phone", "xml"), ("tablet", "xml-sw600dp")):
+            key_width = self.key_width(kbd, style)
+
+            files.append(
+                (
+                    "app/src/main/res/%s/rows_%s.xml" % (prefix, kbd_id),
+                    self.rows(kbd_id, kbd, style, key_width),
+                )
+            )
+
+            for row in self.rowkeys(kbd_id, kbd, style, key_width):
+                row = ("app/src/main/res/%s/%s" % (prefix, row[0]), row[1])
+                files.append(row)
+
+        return files
+
     def kbd_layout_set(self, name, kbd):
         out = Element("KeyboardLayoutSet")
 
@@ -769,7 +793,7 @@ ext.app = [
                 return True
         return False
 
-    def rows(self, name, kbd, style):
+    def rows(self, name, kbd, style, key_width):
         out = Element("merge")
 
         self._subelement(out, "include", keyboardLayout="@xml/key_styles_common")
@@ -786,14 +810,14 @@ ext.app = [
             if not self.row_has_special_keys(kbd, n, style):
                 self._attrib(include, keyWidth="%.2f%%p" % (100 / len(values)))
             else:
-                self._attrib(include, keyWidth="%.2f%%p" % self.key_width)
+                self._attrib(include, keyWidth="%.2f%%p" % key_width)
 
         # All the fun buttons!
         self._subelement(out, "include", keyboardLayout="@xml/row_qwerty4")
 
         return self._tostring(out)
 
-    def gen_key_width(self, kbd, style):
+    def key_width(self, kbd, style):
         m = 0
         for row in MobileLayoutView(kbd, "android").mode("default"):
             r = len(row)
@@ -802,7 +826,7 @@ ext.app = [
 
         vals = {"phone": 95, "tablet": 90}
 
-        self.key_width = vals[style] / m
+        return vals[style] / m
 
     def keyboard(self, name, kbd, **kwargs):
         out = Element("Keyboard")
@@ -813,7 +837,7 @@ ext.app = [
 
         return self._tostring(out)
 
-    def rowkeys(self, name, kbd, style):
+    def rowkeys(self, name, kbd, style, key_width):
         layout_view = MobileLayoutView(kbd, "android")
         # TODO check that lengths of both modes are the same
         for n in range(1, len(layout_view.mode("default")) + 1):
@@ -827,13 +851,27 @@ ext.app = [
                 + "alphabetShiftLockShifted",
             )
 
-            self.add_rows(kbd, n, layout_view.mode(
-                "shift")[n - 1], style, case, "shift")
+            self.add_rows(
+                kbd,
+                n,
+                layout_view.mode("shift")[n - 1],
+                style,
+                key_width,
+                case,
+                "shift",
+            )
 
             default = self._subelement(switch, "default")
 
-            self.add_rows(kbd, n, layout_view.mode("default")
-                          [n - 1], style, default, "default")
+            self.add_rows(
+                kbd,
+                n,
+                layout_view.mode("default")[n - 1],
+                style,
+                key_width,
+                default,
+                "default",
+            )
 
             yield (
                 "rowkeys_%s%s.xml" % (name.lower(), n),
@@ -844,13 +882,13 @@ ext.app = [
         for k, v in kwargs.items():
             node.attrib["{%s}%s" % (self.NS, k)] = v
 
-    def add_button_type(self, key, action, row, tree, is_start):
+    def add_button_type(self, key, action, row, key_width, tree, is_start):
         node = self._element("Key")
         width = action.width
 
         if width == "fill":
             if is_start:
-                width = "%.2f%%" % ((100 - (self.key_width * len(row))) / 2)
+                width = "%.2f%%" % ((100 - (key_width * len(row))) / 2)
             else:
                 width = "fillRight"
         elif width.endswith("%"):
@@ -866,29 +904,32 @@ ext.app = [
 
         tree.append(node)
 
-    def add_special_buttons(self, kbd, n, style, row, tree, is_start):
+    def add_special_buttons(self, kbd, n, style, key_width, row, tree, is_start):
         side = "left" if is_start else "right"
 
         for key, action in self.get_actions(kbd, style).items():
             action = Action(*action)
             if action.row == n and action.position in [side, "both"]:
-                self.add_button_type(key, action, row, tree, is_start)
+                self.add_button_type(key, action, row, key_width, tree, is_start)
 
     def _is_dead_key(self, kbd, mode, key):
-        if kbd.dead_keys is None:
-            return False
-        dead_keys_android = kbd.dead_keys.get("android", {})
-        dead_keys = dead_keys_android.get(mode, [])
-        return key in dead_keys
+        return key in dead_key_index(kbd).get("android", mode)
 
-    def add_rows(self, kbd, n, values, style, out, mode):
+    def add_rows(self, kbd, n, values, style, key_width, out, mode):
         i = 1
 
         show_number_hints = self.layout_target(kbd).get("showNumberHints", True)
 
-        self.add_special_buttons(kbd, n, style, values, out, True)
+        self.add_special_buttons(kbd, n, style, key_width, values, out, True)
 
         for key in values:
+            if isinstance(key, MobileKey):
+                # Android's own special keys come from the style's actions.
+                if key.label is None:
+                    logger.debug("Skipping special key %r" % key.id)
+                    continue
+                key = key.label
+
             more_keys = kbd.longpress.get(key, None)
             node = self._subelement(out, "Key", keySpec=key)
 
@@ -917,7 +958,7 @@ ext.app = [
             if i > 0:
                 i += 1
 
-        self.add_special_buttons(kbd, n, style, values, out, False)
+        self.add_special_buttons(kbd, n, style, key_width, values, out, False)
 
     def layout_target(self, layout):
         if layout.targets is not None:
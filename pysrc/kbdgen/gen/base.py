@@ -6,18 +6,21 @@ import subprocess
 import sys
 import re
 import io
+import threading
+import weakref
 
 from functools import lru_cache
 from collections import OrderedDict
+from collections.abc import Mapping
+from types import MappingProxyType
 
 from . import bin as resources
-from ..base import ISO_KEYS, KbdgenException
+from ..base import KbdgenException
+from ..keys import ISO_KEYS
+from ..bundle import EMPTY_KEYMAP, MobileKey, dead_key_index, worker_pool
 
 logger = logging.getLogger(__name__)
 
-# Parses "\s{foo:42.12}", "\s{foo}" and "\{foo:42}"
-RE_SPECIAL_KEY = re.compile(r"^\\s{([^}:]+)(?::(\d+(?:\.\d+)?))?}$")
-
 
 class MissingApplicationException(KbdgenException):
     pass
@@ -35,114 +38,182 @@ def get_bin_resource(res, text=False):
     return o
 
 
-def bind_iso_keys(other):
-    return OrderedDict(((k, v) for k, v in zip(ISO_KEYS, other)))
+def encode_rows(rows):
+    """Returns mobile rows as lists, with MobileKeys encoded for JSON."""
+    if rows is None:
+        return None
+    return [
+        [k.encode() if isinstance(k, MobileKey) else k for k in row] for row in rows
+    ]
+
+
+def merge_platforms(tree, base, target):
+    o = {}
+    if tree is None:
+        return o
+    if base is not None:
+        o.update(tree.get(base, {}))
+    o.update(tree.get(target, {}))
+    return o
 
 
-def interpret_special_keys(rows):
-    # Parse out all the \s keys
-    for row in rows:
-        for (n, key) in enumerate(row):
-            match = RE_SPECIAL_KEY.match(key)
-            if match is not None:
-                (id_, width) = match.groups()
-                if width is None:
-                    width = 1.0
-                else:
-                    width = float(width)
+class ResolvedLayout:
+    """A layout's modes, dead keys and space overrides merged for one target,
+    with a `base` platform ("desktop" or "mobile") the target overrides.
 
-                if id_.startswith('"') and id_.endswith('"'):
-                    id_ = id_[1:-1]
-                else:
-                    id_ = "_%s" % id_
-                row[n] = {"id": id_, "width": width}
+    The mappings are read-only, as every generator and view shares them."""
+
+    __slots__ = ("modes", "dead_keys", "dead_key_sets", "all_dead_keys", "space")
+
+    def __init__(self, layout, base, target):
+        self.modes = MappingProxyType(merge_platforms(layout.modes, base, target))
+        self.dead_keys = MappingProxyType(
+            merge_platforms(layout.dead_keys, base, target)
+        )
+        dead_key_sets = dead_key_index(layout).modes(target, base)
+        self.dead_key_sets = MappingProxyType(dead_key_sets)
+        self.all_dead_keys = frozenset(
+            itertools.chain.from_iterable(dead_key_sets.values())
+        )
+        self.space = MappingProxyType(merge_platforms(layout.space, base, target))
+
+
+class ResolvedLayouts:
+    """Resolves each (layout, target) pair once and hands out the same
+    ResolvedLayout afterwards. Entries go away with their layout.
+
+    Layouts may be rendered on several threads at once, so lookups and the
+    counters are guarded by a lock."""
+
+    def __init__(self):
+        self._layouts = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.resolved = 0
+        self.reused = 0
+
+    def get(self, layout, base, target):
+        with self._lock:
+            by_target = self._layouts.get(layout, None)
+            if by_target is None:
+                by_target = self._layouts[layout] = {}
+
+            resolved = by_target.get((base, target), None)
+            if resolved is None:
+                logger.trace("Resolving layout for %s/%s" % (base, target))
+                resolved = by_target[(base, target)] = ResolvedLayout(
+                    layout, base, target
+                )
+                self.resolved += 1
+            else:
+                self.reused += 1
+        return resolved
+
+    def log_stats(self):
+        logger.debug(
+            "Resolved layouts: %d resolved, %d reused" % (self.resolved, self.reused)
+        )
+
+
+resolved_layouts = ResolvedLayouts()
 
 
 class MobileLayoutView:
     def __init__(self, layout, target):
-        self._layout = layout
-        self._target = target
+        self._resolved = resolved_layouts.get(layout, "mobile", target)
 
     def mode(self, mode):
-        o = {}
-        o.update(self._layout.modes.get("mobile", {}))
-        o.update(self._layout.modes.get(self._target, {}))
-        rows = o.get(mode, None)
-        if rows is None:
-            return None
-        interpret_special_keys(rows)
-        return rows
+        return self._resolved.modes.get(mode, None)
 
     def modes(self):
-        o = {}
-        o.update(self._layout.modes.get("mobile", {}))
-        o.update(self._layout.modes.get(self._target, {}))
-        return o
+        return self._resolved.modes
 
     def dead_keys(self):
-        o = {}
-        if self._layout.dead_keys is None:
-            return o
-        o.update(self._layout.dead_keys.get("mobile", {}))
-        o.update(self._layout.dead_keys.get(self._target, {}))
-        return o
+        return self._resolved.dead_keys
 
 
 class TabletLayoutView:
     def __init__(self, layout, target):
-        self._layout = layout
-        self._target = target
+        self._resolved = resolved_layouts.get(layout, None, target)
 
     def mode(self, mode):
-        o = {}
-        o.update(self._layout.modes.get(self._target, {}))
-        rows = o.get(mode, None)
-        if rows is None:
-            return []
-        interpret_special_keys(rows)
-        return rows
+        return self._resolved.modes.get(mode, ())
 
     def modes(self):
-        o = {}
-        o.update(self._layout.modes.get(self._target, {}))
-        return o
+        return self._resolved.modes
 
 
 class DesktopLayoutView:
     def __init__(self, layout, target):
-        self._layout = layout
-        self._target = target
+        self._resolved = resolved_layouts.get(layout, "desktop", target)
 
     def mode(self, mode):
-        return self.modes().get(mode, None)
+        return self._resolved.modes.get(mode, None)
 
     def modes(self):
-        o = {}
-        o.update(self._layout.modes.get("desktop", {}))
-        o.update(self._layout.modes.get(self._target, {}))
-        return o
+        return self._resolved.modes
 
     def dead_keys(self):
-        o = {}
-        if self._layout.dead_keys is None:
-            return o
-        o.update(self._layout.dead_keys.get("desktop", {}))
-        o.update(self._layout.dead_keys.get(self._target, {}))
-        return o
+        return self._resolved.dead_keys
+
+    def dead_key_sets(self):
+        return self._resolved.dead_key_sets
+
+    def all_dead_keys(self):
+        return self._resolved.all_dead_keys
 
     def space(self):
-        o = {}
-        if self._layout.space is None:
-            return o
-        o.update(self._layout.space.get("desktop", {}))
-        o.update(self._layout.space.get(self._target, {}))
-        return o
+        return self._resolved.space
+
+
+class RenderContext:
+    """What rendering one layout works with: its `name` and `layout`, and
+    whatever else a generator sets on it while rendering that layout.
+
+    Generators keep per-layout state here rather than on `self`, so that
+    `render_layouts` can render several layouts at once. State known before
+    rendering starts can be given as keyword arguments."""
+
+    def __init__(self, name, layout, **state):
+        self.name = name
+        self.layout = layout
+        self.__dict__.update(state)
+
+    def __repr__(self):
+        return "RenderContext(%r)" % self.name
+
+
+def render_layouts(render, layouts, jobs=None, processes=True):
+    """Calls `render` with a RenderContext for each layout, returning the
+    results by layout name in the order given.
+
+    `layouts` maps names to layouts, or is a list of RenderContexts. With
+    `jobs` set, layouts are spread over a `worker_pool`, which is a thread
+    pool if `processes` is False; `render` and its results must pickle for a
+    process pool. A `jobs` of 0 uses one worker per CPU."""
+    if isinstance(layouts, Mapping):
+        contexts = [RenderContext(name, layout) for name, layout in layouts.items()]
+    else:
+        contexts = list(layouts)
+
+    if jobs is None or jobs == 1 or len(contexts) < 2:
+        results = [render(ctx) for ctx in contexts]
+    else:
+        workers = min(jobs or os.cpu_count() or 1, len(contexts))
+        logger.debug("Rendering %d layouts with %d workers" % (len(contexts), workers))
+        with worker_pool(workers, processes) as executor:
+            # In chunks, so that `render` (often a bound method, taking its
+            # generator and bundle along) is pickled once per worker.
+            chunksize = -(-len(contexts) // workers)
+            results = list(executor.map(render, contexts, chunksize=chunksize))
+
+    return OrderedDict((ctx.name, result) for ctx, result in zip(contexts, results))
 
 
 class Generator:
     def __init__(self, bundle, args=None):
         self._bundle = bundle
         self._args = args or {}
+        self._supported_layouts = {}
 
     @property
     def repo(self):
@@ -164,6 +235,58 @@ class Generator:
     def output_dir(self):
         return self._args.get("output", ".")
 
+    @property
+    def jobs(self):
+        return self._args.get("jobs", None)
+
+    @property
+    def layouts(self):
+        """The layouts covered by this run: all of the bundle's, or only the one
+        selected with `-l`. Only these are decoded, in parallel with `--jobs`."""
+        layouts = self._bundle.layouts
+        selected = self._args.get("layout", None)
+        if selected is None:
+            names = list(layouts.keys())
+        else:
+            names = [selected] if selected in layouts else []
+            if len(names) == 0:
+                logger.error("No layout named %r in this project." % selected)
+
+        preload = getattr(layouts, "preload", None)
+        if preload is not None:
+            preload(names, jobs=self.jobs)
+
+        return OrderedDict((name, layouts[name]) for name in names)
+
+    def layouts_with_modes(self, *platforms):
+        """The layouts covered by this run that define modes for any of
+        `platforms`. Worked out once, until `reset_layouts` is called."""
+        supported = self._supported_layouts.get(platforms, None)
+        if supported is None:
+            supported = OrderedDict(
+                (k, v)
+                for k, v in self.layouts.items()
+                if any(x in v.modes for x in platforms)
+            )
+            self._supported_layouts[platforms] = supported
+        return supported
+
+    def reset_layouts(self):
+        """Forgets the layouts worked out so far, after the bundle changed."""
+        self._supported_layouts.clear()
+
+    def supports_layout_regeneration(self, base, layout):
+        """Whether `generate_layout` can regenerate `layout` in the output
+        directory `base`, as checked by `--watch` before writing anything.
+
+        Generators that can only build everything at once do not override this."""
+        return False
+
+    def generate_layout(self, base, name, layout):
+        """Regenerates the output of a single layout, used by `--watch` where
+        `supports_layout_regeneration` allows it."""
+        raise NotImplementedError()
+
     def satisfies_requirements(self) -> bool:
         # if len(self.supported_layouts) == 0:
         #     logger.error("This project defines no supported layouts for this target.")
@@ -176,38 +299,10 @@ class Generator:
 
 class PhysicalGenerator(Generator):
     def validate_layout(self, layout, target):
-        view = DesktopLayoutView(layout, target)
-
-        mode_keys = set(view.modes().keys())
-        deadkey_keys = set(view.dead_keys().keys())
-
-        print(mode_keys)
-
-        undefined_modes = deadkey_keys - mode_keys
-
-        if len(undefined_modes) > 0:
-            # raise Exception(
-            #     "Dead key modes are defined for undefined modes: %r"
-            #     % (list(undefined_modes),)
-            # )
-            logger.warn(
-                "Dead key modes are defined for undefined modes: %r"
-                % (list(undefined_modes),)
-            )
-
-        for mode, keys in view.dead_keys().items():
-            dead_keys = set(keys)
-            layer_keys = set(view.modes()[mode].values())
-
-            logger.trace("Dead: %r, layer: %r" % (dead_keys, layer_keys))
-
-            matched_keys = dead_keys & layer_keys
-
-            if matched_keys != dead_keys:
-                raise Exception(
-                    "Specified dead keys missing from mode %r: %r"
-                    % (mode, list(dead_keys - matched_keys))
-                )
+        for level, message in dead_key_problems(DesktopLayoutView(layout, target)):
+            if level >= logging.ERROR:
+                raise Exception(message)
+            logger.warn(message)
 
 
 class MobileGenerator(Generator):
@@ -218,25 +313,59 @@ class MobileGenerator(Generator):
 MSG_LAYOUT_MISSING = "Layout '%s' is missing a required mode: '%s'."
 
 
-def mode_iter(locale, keyboard, key, target, required=False):
-    mode = DesktopLayoutView(keyboard, target).mode(key)
+def dead_key_problems(view):
+    """Yields a `(level, message)` pair for each problem with the dead keys of
+    a DesktopLayoutView. Dead keys of modes the layout does not define are
+    warnings, dead keys that are not on any key of their mode are errors."""
+    modes = view.modes()
+
+    undefined_modes = view.dead_keys().keys() - modes.keys()
+    if len(undefined_modes) > 0:
+        yield (
+            logging.WARNING,
+            "Dead key modes are defined for undefined modes: %r"
+            % (sorted(undefined_modes),),
+        )
+
+    for mode, dead_keys in view.dead_key_sets().items():
+        keymap = modes.get(mode, None)
+        if keymap is None:
+            continue
+
+        missing = dead_keys.difference(keymap.values())
+        if len(missing) > 0:
+            yield (
+                logging.ERROR,
+                "Specified dead keys missing from mode %r: %r"
+                % (mode, sorted(missing)),
+            )
+
+
+def mode_iter(locale, keyboard, key, target, required=False, decoded=False):
+    """Iterates the values of a desktop mode in `ISO_KEYS` order, with their
+    codepoint escapes already decoded if `decoded` is set."""
+    mode = resolved_layouts.get(keyboard, "desktop", target).modes.get(key, None)
     if mode is None:
         if required:
             raise GenerationError(MSG_LAYOUT_MISSING % (locale, key))
         return itertools.repeat(None)
 
+    if decoded:
+        return mode.decoded_values()
     return mode.values()
 
 
 def mode_dict(locale, keyboard, key, target, required=False, space=False):
-    mode = DesktopLayoutView(keyboard, target).mode(key)
+    mode = resolved_layouts.get(keyboard, "desktop", target).modes.get(key, None)
     if mode is None:
         if required:
             raise GenerationError(MSG_LAYOUT_MISSING % (locale, key))
-        return OrderedDict(zip(ISO_KEYS, itertools.repeat(None)))
+        mode = EMPTY_KEYMAP
 
     # TODO this isn't handled properly yet
     if space:
+        # Keymaps are shared and immutable, and A03 is not part of them.
+        mode = OrderedDict(mode.items())
         sp = keyboard.special.get("space", {}).get(key, " ")
         mode["A03"] = sp
     return mode
@@ -288,41 +417,6 @@ def filepath(fp, *args):
     return os.path.join(os.path.dirname(fp), *args)
 
 
-class DictWalker:
-    def on_branch(self, base, branch):
-        return base, branch
-
-    def on_leaf(self, base, branch, leaf):
-        return base, branch, leaf
-
-    def __init__(self, dict_):
-        self._dict = dict_
-
-    def __iter__(self):
-        def walk(dict_, buf):
-            for k, v in dict_.items():
-                if isinstance(v, dict):
-                    c = yield self.on_branch(tuple(buf), k)
-                    if c is False:
-                        continue
-                    nbuf = buf[:]
-                    nbuf.append(k)
-                    for vv in walk(v, nbuf):
-                        yield vv
-                elif isinstance(v, (int, str)):
-                    yield self.on_leaf(tuple(buf), k, v)
-                else:
-                    raise TypeError(v)
-
-        for v in walk(self._dict, []):
-            yield v
-
-    def __call__(self):
-        # Run iterator to death
-        for _ in self:
-            pass
-
-
 def run_process(
     cmd,
     cwd=None,
@@ -1,4 +1,3 @@
-from collections import OrderedDict
 import json
 import os
 import os.path
@@ -8,73 +7,16 @@ import urllib
 import urllib.request
 
 from ..base import get_logger
+from ..keys import CHROME_KEY_CODES
 from .base import (
     PhysicalGenerator,
     run_process,
     DesktopLayoutView,
-    bind_iso_keys,
     get_bin_resource,
 )
 
 logger = get_logger(__name__)
 
-KEY_MAP = bind_iso_keys(
-    (
-        # Row E
-        "Backquote",
-        "Digit1",
-        "Digit2",
-        "Digit3",
-        "Digit4",
-        "Digit5",
-        "Digit6",
-        "Digit7",
-        "Digit8",
-        "Digit9",
-        "Digit0",
-        "Minus",
-        "Equal",
-        # Row D
-        "KeyQ",
-        "KeyW",
-        "KeyE",
-        "KeyR",
-        "KeyT",
-        "KeyY",
-        "KeyU",
-        "KeyI",
-        "KeyO",
-        "KeyP",
-        "BracketLeft",
-        "BracketRight",
-        # Row C
-        "KeyA",
-        "KeyS",
-        "KeyD",
-        "KeyF",
-        "KeyG",
-        "KeyH",
-        "KeyJ",
-        "KeyK",
-        "KeyL",
-        "Semicolon",
-        "Quote",
-        "Backslash",
-        # Row B
-        "IntlBackslash",
-        "KeyZ",
-        "KeyX",
-        "KeyC",
-        "KeyV",
-        "KeyB",
-        "KeyN",
-        "KeyM",
-        "Comma",
-        "Period",
-        "Slash",
-    )
-)
-
 LAYOUT_NAMES = {
     "nb": "{} tastatur",
     "no": "{} tastatur",
@@ -98,15 +40,7 @@ def layout_name(locale, name):
 
 
 def replace_iso_keys(obj):
-    o = {}
-    for k in obj.keys():
-        if obj[k] is None:
-            continue
-        o[KEY_MAP[k]] = obj[k]
-    for k in o.keys():
-        if len(o[k]) == 0:
-            del o[k]
-    return o
+    return {code: v for code, v in zip(CHROME_KEY_CODES, obj.values()) if v}
 
 
 ICONS = {"16": "icon16.png", "48": "icon48.png", "128": "icon128.png"}
@@ -115,11 +49,7 @@ ICONS = {"16": "icon16.png", "48": "icon48.png", "128": "icon128.png"}
 class ChromeOSGenerator(PhysicalGenerator):
     @property
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if "chrome" in v.modes or "desktop" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("chrome", "desktop")
 
     @property
     def chrome_target(self):
@@ -352,10 +282,10 @@ class ChromeOSGenerator(PhysicalGenerator):
                 modes[name] = replace_iso_keys(mode)
 
             layout_descriptor = {
-                "deadKeys": layout_view.dead_keys(),
+                "deadKeys": dict(layout_view.dead_keys()),
                 "transforms": layout.transforms,
                 "layers": modes,
-                "space": layout_view.space(),
+                "space": dict(layout_view.space()),
             }
 
             layouts[locale] = layout_descriptor
@@ -1,7 +1,7 @@
 import os.path
 
 from io import StringIO
-from collections import namedtuple, OrderedDict
+from collections import namedtuple
 from math import sqrt
 from .base import Generator, MobileLayoutView
 from ..base import get_logger
@@ -53,7 +53,7 @@ def generate_coordinates(rows, offsets):
 
 
 def convert_phy_mode(mode):
-    if isinstance(mode, list):
+    if isinstance(mode, (list, tuple)):
         return mode
 
     rows = []
@@ -98,13 +98,8 @@ def generate_att(coords):
 
 class ErrorModelGenerator(Generator):
     @property
-    # @lru_cache(maxsize=1)
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if "ios" in v.modes or "mobile" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("ios", "mobile")
 
     def generate(self, base="."):
         out_dir = os.path.abspath(base)
@@ -17,7 +17,13 @@ from pathlib import Path
 
 from ..base import get_logger
 from ..filecache import FileCache
-from .base import Generator, run_process, MobileLayoutView, TabletLayoutView
+from .base import (
+    Generator,
+    run_process,
+    MobileLayoutView,
+    TabletLayoutView,
+    encode_rows,
+)
 from .osxutil import Pbxproj
 
 logger = get_logger(__name__)
@@ -169,13 +175,8 @@ class AppleiOSGenerator(Generator):
             return
 
     @property
-    # @lru_cache(maxsize=1)
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if "ios" in v.modes or "mobile" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("ios", "mobile")
 
     def satisfies_requirements(self):
         if not super().satisfies_requirements():
@@ -829,25 +830,25 @@ class AppleiOSGenerator(Generator):
         ipad_12in = out["ipad-12in"] = {}
 
         view = MobileLayoutView(layout, "ios")
-        iphone["normal"] = view.mode("default")
-        iphone["shifted"] = view.mode("shift")
-        iphone["symbols-1"] = view.mode("symbols-1")
-        iphone["symbols-2"] = view.mode("symbols-2")
+        iphone["normal"] = encode_rows(view.mode("default"))
+        iphone["shifted"] = encode_rows(view.mode("shift"))
+        iphone["symbols-1"] = encode_rows(view.mode("symbols-1"))
+        iphone["symbols-2"] = encode_rows(view.mode("symbols-2"))
 
         view = TabletLayoutView(layout, "ipad-9in")
-        ipad_9in["normal"] = view.mode("default")
-        ipad_9in["shifted"] = view.mode("shift")
-        ipad_9in["alt"] = view.mode("alt")
-        ipad_9in["alt+shift"] = view.mode("alt+shift")
-        ipad_9in["symbols-1"] = view.mode("symbols-1")
-        ipad_9in["symbols-2"] = view.mode("symbols-2")
+        ipad_9in["normal"] = encode_rows(view.mode("default"))
+        ipad_9in["shifted"] = encode_rows(view.mode("shift"))
+        ipad_9in["alt"] = encode_rows(view.mode("alt"))
+        ipad_9in["alt+shift"] = encode_rows(view.mode("alt+shift"))
+        ipad_9in["symbols-1"] = encode_rows(view.mode("symbols-1"))
+        ipad_9in["symbols-2"] = encode_rows(view.mode("symbols-2"))
 
         view = TabletLayoutView(layout, "ipad-12in")
-        ipad_12in["normal"] = view.mode("default")
-        ipad_12in["shifted"] = view.mode("shift")
-        ipad_12in["alt"] = view.mode("alt")
-        ipad_12in["alt+shift"] = view.mode("alt+shift")
-        ipad_12in["symbols-1"] = view.mode("symbols-1")
-        ipad_12in["symbols-2"] = view.mode("symbols-2")
+        ipad_12in["normal"] = encode_rows(view.mode("default"))
+        ipad_12in["shifted"] = encode_rows(view.mode("shift"))
+        ipad_12in["alt"] = encode_rows(view.mode("alt"))
+        ipad_12in["alt+shift"] = encode_rows(view.mode("alt+shift"))
+        ipad_12in["symbols-1"] = encode_rows(view.mode("symbols-1"))
+        ipad_12in["symbols-2"] = encode_rows(view.mode("symbols-2"))
 
         return out
@@ -19,7 +19,7 @@ class JSONGenerator(Generator):
 
         layouts = OrderedDict()
 
-        for name, layout in self._bundle.layouts.items():
+        for name, layout in self.layouts.items():
             layouts[name] = layout
 
         with open(fn, "w", encoding="utf-8") as f:
@@ -1,6 +1,6 @@
+import logging
 import os.path
 import shutil
-import itertools
 import tempfile
 import sys
 import re
@@ -8,18 +8,38 @@ import binascii
 import xml.etree.ElementTree as etree
 
 from xml.etree.ElementTree import SubElement
-from collections import defaultdict, OrderedDict
+from collections import defaultdict
 from textwrap import indent, dedent
 
 from ..base import get_logger
-from .base import PhysicalGenerator, run_process, DictWalker, DesktopLayoutView
-from .osxutil import OSXKeyLayout, OSX_HARDCODED, OSX_KEYMAP
+from .base import PhysicalGenerator, run_process, DesktopLayoutView, render_layouts
+from .osxutil import OSXKeyLayout, OSX_HARDCODED
+from ..bundle import dead_key_index, transform_automaton
+from ..keys import MAC_KEY_CODES
 
 logger = get_logger(__name__)
 
 INVERTED_ID_RE = re.compile(r"[^A-Za-z0-9]")
 
 
+def mac_name_problems(layouts):
+    """Yields a `(level, message)` pair for each of `layouts` whose internal
+    name, its name with only A-Z, a-z and 0-9 kept, is already taken."""
+    seen = {}
+    for name in layouts:
+        id_ = INVERTED_ID_RE.sub("", name)
+        if id_ in seen:
+            yield (
+                logging.ERROR,
+                "Layouts '%s' and '%s' have the same internal name '%s'. "
+                "macOS keyboard internal names are converted to only contain "
+                "A-Z, a-z, and 0-9.  Please ensure your internal names are "
+                "still unique after this process." % (seen[id_], name, id_),
+            )
+        else:
+            seen[id_] = name
+
+
 class MacGenerator(PhysicalGenerator):
     @property
     def disable_transforms(self):
@@ -34,13 +54,8 @@ class MacGenerator(PhysicalGenerator):
         return self._bundle.resources("mac")
 
     @property
-    # @lru_cache(maxsize=1)
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if "mac" in v.modes or "desktop" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("mac", "desktop")
 
     @property
     def sign_id(self):
@@ -86,19 +101,10 @@ class MacGenerator(PhysicalGenerator):
                 return False
 
         fail = False
-        ids = []
-        for locale, layout in self.supported_layouts.items():
-            id_ = self._layout_name(locale, layout)
-            if id_ in ids:
-                logger.error("A duplicate internal name was detected: '%s'." % id_)
-            else:
-                ids.append(id_)
-        if fail:
-            logger.error(
-                "macOS keyboard internal names are converted to only contain "
-                + "A-Z, a-z, and 0-9.  Please ensure your internal names are "
-                + "still unique after this process."
-            )
+        for level, message in mac_name_problems(self.supported_layouts):
+            logger.log(level, message)
+            if level >= logging.ERROR:
+                fail = True
         return not fail
 
     def generate(self, base="."):
@@ -113,18 +119,7 @@ class MacGenerator(PhysicalGenerator):
                 "Dead keys and transforms will not be generated (disable-transforms)"
             )
 
-        o = OrderedDict()
-
-        for name, layout in self.supported_layouts.items():
-            try:
-                self.validate_layout(layout, "mac")
-            except Exception as e:
-                logger.error("[%s] Error while validating layout:\n%s" % (name, e))
-                raise e
-                return
-
-            logger.info("Generating '%s'…" % name)
-            o[name] = self.generate_xml(name, layout)
+        o = render_layouts(self.render_xml, self.supported_layouts, self.jobs)
 
         if self.dry_run:
             logger.info("Dry run completed.")
@@ -160,6 +155,35 @@ class MacGenerator(PhysicalGenerator):
         else:
             logger.info("Installer generated at '%s'." % pkg_path)
 
+    def render_xml(self, ctx):
+        try:
+            self.validate_layout(ctx.layout, "mac")
+        except Exception as e:
+            logger.error("[%s] Error while validating layout:\n%s" % (ctx.name, e))
+            raise e
+
+        logger.info("Generating '%s'…" % ctx.name)
+        return self.generate_xml(ctx.name, ctx.layout)
+
+    def _resources_path(self, base):
+        return os.path.join(
+            os.path.abspath(base), "%s.bundle" % self.bundle_id, "Contents", "Resources"
+        )
+
+    def supports_layout_regeneration(self, base, layout):
+        # The .keylayout is updated in place in a previously built bundle; the
+        # bundle itself and the installer are only created by a full build.
+        return os.path.isdir(self._resources_path(base))
+
+    def generate_layout(self, base, name, layout):
+        res_path = self._resources_path(base)
+        self.validate_layout(layout, "mac")
+        fn = self._layout_name(name, layout)
+
+        logger.debug("%s.keylayout -> bundle" % fn)
+        with open(os.path.join(res_path, "%s.keylayout" % fn), "w", encoding="utf-8") as f:
+            f.write(self.generate_xml(name, layout))
+
     def generate_iconset(self, icon, output_fn):
         cmd_tmpl = (
             "convert -resize {d}x{d} -background transparent "
@@ -221,16 +245,80 @@ class MacGenerator(PhysicalGenerator):
                 for name, lname in o.items():
                     f.write('"%s" = "%s";\n' % (name, lname))
 
+    def _add_transforms(self, name, out, automaton, dead_keys, all_dead_keys):
+        # States are numbered by automaton state, so a sequence's state is the
+        # same whichever action leads to it.
+        skipped = set()
+
+        for state, key, target, output in automaton.walk():
+            if state in skipped:
+                if target is not None:
+                    skipped.add(target)
+                continue
+
+            if target is None:
+                if not out.actions.has(key):
+                    logger.debug(
+                        "Leaf (%r) transform %r not supported. Is a deadkey missing?"
+                        % (output, key)
+                    )
+                    continue
+
+                action_id = out.actions.get(key)
+                when_state = out.states.get(state)
+                try:
+                    out.add_transform(action_id, when_state, output=output)
+                except Exception as e:
+                    logger.error(
+                        "[%s] Error while adding leaf transform:\n%s\n%r"
+                        % (name, e, (action_id, when_state, output))
+                    )
+                continue
+
+            if key not in dead_keys or not out.actions.has(key):
+                if key in all_dead_keys:
+                    logger.debug("Transform %r not supported by current target." % key)
+                else:
+                    logger.error(
+                        "Transform %r not supported; is a deadkey missing?" % key
+                    )
+                skipped.add(target)
+                continue
+
+            action_id = out.actions.get(key)
+
+            if state == 0:
+                action = out.action_cache.get(action_id, None)
+                if action is not None:
+                    if len(action.findall('when[@state="none"]')) > 0:
+                        continue
+                when_state = "none"
+            else:
+                when_state = out.states.get(state)
+            next_state = out.states.get(target)
+
+            try:
+                out.add_transform(action_id, when_state, next=next_state)
+            except Exception as e:
+                logger.error(
+                    "[%s] Error while adding branch transform:\n%s\n%r"
+                    % (name, e, (key, action_id, when_state, next_state))
+                )
+
     def _layout_name(self, locale, layout):
         return INVERTED_ID_RE.sub("", locale)
 
-    def create_bundle(self, path):
+    @property
+    def bundle_id(self):
         # Bundle ID must contain be in format *.keyboardlayout.<name>
         # Failure to do so and the bundle will not be detected as a keyboard bundle
-        bundle_id = "%s.keyboardlayout.%s" % (
+        return "%s.keyboardlayout.%s" % (
             self.mac_target.package_id,
             self._bundle.name,
         )
+
+    def create_bundle(self, path):
+        bundle_id = self.bundle_id
         logger.debug(
             "target.package_id: %r, _bundle.name: %r"
             % (self.mac_target.package_id, self._bundle.name)
@@ -478,19 +566,12 @@ class MacGenerator(PhysicalGenerator):
         layout_view = DesktopLayoutView(layout, "mac")
 
         # Create list to ignore false negatives for different targets
-        dead_keys = layout.dead_keys or {}
-        dead_key_lists = [v for v in [k.values() for k in dead_keys.values()]]
-        all_dead_keys = set(
-            itertools.chain.from_iterable(
-                [k for sublist in dead_key_lists for k in sublist]
-            )
-        )
+        all_dead_keys = dead_key_index(layout).all
 
-        dead_keys = set(itertools.chain.from_iterable(layout_view.dead_keys().values()))
-        action_keys = set()
-        for x in DictWalker(layout.transforms or {}):
-            for i in x[0] + (x[1],):
-                action_keys.add(str(i))
+        mode_dead_keys = layout_view.dead_key_sets()
+        dead_keys = layout_view.all_dead_keys()
+        automaton = transform_automaton(layout)
+        action_keys = set(automaton.keys)
 
         # Naively add all keys
         for mode_name in OSXKeyLayout.modes:
@@ -508,33 +589,36 @@ class MacGenerator(PhysicalGenerator):
             # All keymaps must include a code 0
             out.set_key(mode_name, "", "0")
 
+            current_dead_keys = mode_dead_keys.get(mode_name, frozenset())
             logger.trace(
                 "Dead keys - mode:%r keys:%r"
-                % (mode_name, (layout.dead_keys or {}).get(mode_name, []))
+                % (mode_name, sorted(current_dead_keys))
             )
 
-            for iso, key in mode.items():
+            for key_id, key in zip(MAC_KEY_CODES, mode.values()):
                 if key is None:
                     key = ""
 
-                key_id = OSX_KEYMAP[iso]
-
                 if self.disable_transforms:
                     out.set_key(mode_name, key, key_id)
                     continue
 
-                dead_keys = layout.dead_keys or {}
-                if key in dead_keys.get(mode_name, []):
+                if key in current_dead_keys:
                     logger.trace("Dead key found - mode:%r key:%r" % (mode_name, key))
 
-                    transforms = layout.transforms or {}
-                    if key in transforms:
+                    step = automaton.step(0, key)
+                    if step is not None and step[0] is not None:
                         logger.trace(
                             "Set deadkey - mode:%r key:%r id:%r"
                             % (mode_name, key, key_id)
                         )
+                        state = step[0]
                         out.set_deadkey(
-                            mode_name, key, key_id, transforms[key].get(" ", key)
+                            mode_name,
+                            key,
+                            key_id,
+                            automaton.fallback(state, key),
+                            state,
                         )
                     else:
                         logger.warning(
@@ -559,7 +643,7 @@ class MacGenerator(PhysicalGenerator):
                 sp = " "
 
             out.set_key(mode_name, sp, "49")
-            if not self.disable_transforms and len(layout.transforms or {}) > 0:
+            if not self.disable_transforms and len(automaton.keys) > 0:
                 out.set_transform_key(mode_name, sp, "49")
 
             # Add hardcoded keyboard bits
@@ -571,72 +655,7 @@ class MacGenerator(PhysicalGenerator):
             for key_id, key in self._numpad(decimal):
                 out.set_key(mode_name, str(key), str(key_id))
 
-        class TransformWalker(DictWalker):
-            def on_branch(self, base, branch):
-                logger.debug("BRANCH: %r" % branch)
-                if branch not in dead_keys or not out.actions.has(branch):
-                    if branch in all_dead_keys:
-                        logger.debug(
-                            "Transform %r not supported by current target." % branch
-                        )
-                    else:
-                        logger.error(
-                            "Transform %r not supported; is a deadkey missing?" % branch
-                        )
-                    return False
-
-                action_id = out.actions.get(branch)  # "Key %s" % branch
-
-                if base == ():
-                    action = out.action_cache.get(action_id, None)
-                    if action is not None:
-                        if len(action.findall('when[@state="none"]')) > 0:
-                            return
-                    when_state = "none"
-                    next_state = out.states.get(branch)  # "State %s" % branch
-                else:
-                    when_state = out.states.get(
-                        "".join(base)
-                    )  # "State %s" % "".join(base)
-                    next_state = "%s%s" % (when_state, branch)
-
-                logger.trace(
-                    "Branch: action:%r when:%r next:%r"
-                    % (action_id, when_state, next_state)
-                )
-
-                try:
-                    out.add_transform(action_id, when_state, next=next_state)
-                except Exception as e:
-                    logger.error(
-                        "[%s] Error while adding branch transform:\n%s\n%r"
-                        % (name, e, (branch, action_id, when_state, next_state),)
-                    )
-
-            def on_leaf(self, base, branch, leaf):
-                if not out.actions.has(branch):
-                    logger.debug(out.actions)
-                    logger.debug(
-                        "Leaf (%r) transform %r not supported. Is a deadkey missing?"
-                        % (leaf, branch)
-                    )
-                    return
-
-                action_id = out.actions.get(branch)  # "Key %s" % branch
-                when_state = out.states.get("".join(base))  # "State %s" % "".join(base)
-
-                logger.trace(
-                    "Leaf: action:%r when:%r leaf:%r" % (action_id, when_state, leaf)
-                )
-                try:
-                    out.add_transform(action_id, when_state, output=str(leaf))
-                except Exception as e:
-                    logger.error(
-                        "[%s] Error while adding leaf transform:\n%s\n%r"
-                        % (name, e, (action_id, when_state, leaf))
-                    )
-
         if not self.disable_transforms:
-            TransformWalker(layout.transforms or {})()
+            self._add_transforms(name, out, automaton, dead_keys, all_dead_keys)
 
         return bytes(out).decode("utf-8")
@@ -16,64 +16,6 @@ from ..cldr import CP_REGEX
 
 logger = get_logger(__name__)
 
-OSX_KEYMAP = OrderedDict(
-    (
-        ("C01", "0"),
-        ("C02", "1"),
-        ("C03", "2"),
-        ("C04", "3"),
-        ("C06", "4"),
-        ("C05", "5"),
-        ("B01", "6"),
-        ("B02", "7"),
-        ("B03", "8"),
-        ("B04", "9"),
-        ("B00", "50"),  # E00 flipped!
-        ("B05", "11"),
-        ("D01", "12"),
-        ("D02", "13"),
-        ("D03", "14"),
-        ("D04", "15"),
-        ("D06", "16"),
-        ("D05", "17"),
-        ("E01", "18"),
-        ("E02", "19"),
-        ("E03", "20"),
-        ("E04", "21"),
-        ("E06", "22"),
-        ("E05", "23"),
-        ("E12", "24"),
-        ("E09", "25"),
-        ("E07", "26"),
-        ("E11", "27"),
-        ("E08", "28"),
-        ("E10", "29"),
-        ("D12", "30"),
-        ("D09", "31"),
-        ("D07", "32"),
-        ("D11", "33"),
-        ("D08", "34"),
-        ("D10", "35"),
-        # U WOT 36 - space yeah yeah
-        ("C09", "37"),
-        ("C07", "38"),
-        ("C11", "39"),
-        ("C08", "40"),
-        ("C10", "41"),
-        ("D13", "42"),
-        ("B08", "43"),
-        ("B10", "44"),
-        ("B06", "45"),
-        ("B07", "46"),
-        ("B09", "47"),
-        # U WOT 48 - backspace yeah yeah
-        ("A03", "49"),
-        ("E00", "10"),  # B00 flipped!
-        ("E13", "93"),
-        ("B11", "94"),
-    )
-)
-
 OSX_HARDCODED = OrderedDict(
     (
         ("36", r"\u{D}"),
@@ -926,11 +868,12 @@ class OSXKeyLayout:
     def set_key(self, mode, key, key_id):
         self._set_key(mode, key, key_id, output=key)
 
-    def set_deadkey(self, mode, key, key_id, output):
-        """output is the output when the deadkey is followed by an invalid"""
+    def set_deadkey(self, mode, key, key_id, output, state):
+        """output is the output when the deadkey is followed by an invalid,
+        state the transform automaton state the deadkey leads to"""
         logger.trace("%r %r %r %r" % (mode, key, key_id, output))
         action_id = self.actions.get(key)  # "Key %s" % key
-        pressed_id = self.states.get(key)  # "State %s" % key
+        pressed_id = self.states.get(state)
 
         self._set_key(mode, key, key_id, action=action_id)
 
@@ -4,47 +4,45 @@ import itertools
 
 import xml.etree.ElementTree as etree
 from xml.etree.ElementTree import Element, SubElement
+from functools import lru_cache
 from textwrap import dedent
-from collections import OrderedDict
 
 from ..base import get_logger
-from .base import Generator, mode_dict, ISO_KEYS, get_bin_resource
-from ..cldr import decode_u
+from .base import (
+    Generator,
+    RenderContext,
+    mode_iter,
+    render_layouts,
+    ISO_KEYS,
+    get_bin_resource,
+)
+from ..bundle import dead_key_index
 
 logger = get_logger(__name__)
 
 NS = "{http://www.w3.org/2000/svg}"
 
 
+@lru_cache(maxsize=None)
+def svg_template():
+    """The keyboard drawing each layout's SVG is made from. Copy it before
+    changing it."""
+    with get_bin_resource("keyboard-iso.svg", text=True) as f:
+        return etree.parse(f).getroot()
+
+
 class SVGGenerator(Generator):
     @property
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if (
-                "desktop" in v.modes
-                or "mac" in v.modes
-                or "win" in v.modes
-                or "chrome" in v.modes
-            ):
-                o[k] = v
-        return o
+        return self.layouts_with_modes("desktop", "mac", "win", "chrome")
 
     def generate(self, base="."):
-        with get_bin_resource("keyboard-iso.svg", text=True) as f:
-            tree = etree.parse(f)
-        root = tree.getroot()
-
-        files = []
-
-        for name, layout in self.supported_layouts.items():
-            files.append(
-                (
-                    "%s.svg" % name,
-                    layout.display_names.get(name, name),
-                    self.generate_svg(name, layout, copy.deepcopy(root)),
-                )
-            )
+        layouts = self.supported_layouts
+        svgs = render_layouts(self.render_svg, layouts, self.jobs)
+        files = [
+            ("%s.svg" % name, layouts[name].display_names.get(name, name), data)
+            for name, data in svgs.items()
+        ]
 
         out_dir = os.path.abspath(base)
         os.makedirs(out_dir, exist_ok=True)
@@ -53,6 +51,26 @@ class SVGGenerator(Generator):
             with open(os.path.join(out_dir, fn), "w", encoding="utf-8") as f:
                 f.write(data)
 
+        self.write_index(out_dir, files)
+
+    def supports_layout_regeneration(self, base, layout):
+        return True
+
+    def generate_layout(self, base, name, layout):
+        out_dir = os.path.abspath(base)
+        os.makedirs(out_dir, exist_ok=True)
+
+        with open(os.path.join(out_dir, "%s.svg" % name), "w", encoding="utf-8") as f:
+            f.write(self.render_svg(RenderContext(name, layout)))
+
+        # Layouts may have been added or renamed, so the index is rewritten too.
+        files = [
+            ("%s.svg" % k, v.display_names.get(k, k), None)
+            for k, v in self.supported_layouts.items()
+        ]
+        self.write_index(out_dir, files)
+
+    def write_index(self, out_dir, files):
         # Get English name, or fallback to internal name
         kbd_name = self._bundle.name
 
@@ -168,57 +186,49 @@ class SVGGenerator(Generator):
             logger.warning("For char 0x%04x: %s" % (ord(secondary), e))
         return (g, p, s)
 
+    def render_svg(self, ctx):
+        return self.generate_svg(ctx.name, ctx.layout, copy.deepcopy(svg_template()))
+
     def generate_svg(self, locale, layout, root):
         logger.info("Generating SVG for '%s'..." % locale)
-        default = mode_dict(locale, layout, "default", "win", required=True)
-        shift = mode_dict(locale, layout, "shift", "win")
-
-        caps = mode_dict(locale, layout, "caps", "win")
-        caps_shift = mode_dict(locale, layout, "caps+shift", "win")
-
-        alts = mode_dict(locale, layout, "alt", "win")
-        alts_shift = mode_dict(locale, layout, "alt+shift", "win")
-
-        alt_caps = mode_dict(locale, layout, "caps+alt", "win")
-        alt_caps_shift = mode_dict(locale, layout, "caps+alt+shift", "win")
-
-        for k in itertools.chain(ISO_KEYS, ("A03",)):
+        modes = (
+            "default",
+            "shift",
+            "caps+alt",
+            "caps+alt+shift",
+            "alt",
+            "alt+shift",
+            "caps",
+            "caps+shift",
+        )
+        raw = [
+            mode_iter(locale, layout, mode, "win", required=mode == "default")
+            for mode in modes
+        ]
+        decoded = [
+            mode_iter(locale, layout, mode, "win", decoded=True) for mode in modes
+        ]
+
+        dead_keys = dead_key_index(layout).modes("win", "desktop")
+
+        rows = zip(zip(*raw), zip(*decoded))
+        # The space bar has no value in the keymap, but is drawn all the same.
+        rows = itertools.chain(rows, (((None,) * 8, (None,) * 8),))
+
+        for k, (values, decoded_values) in zip(ISO_KEYS + ("A03",), rows):
+            d, s, ac, acs, a, as_, c, cs = values
+            dk, sk, ack, acsk, ak, ask, ck, csk = (x or None for x in decoded_values)
             logger.trace("%s" % k)
             groups = []
 
-            dk = decode_u(default.get(k, "")) or None
-            dk_dead = dk is not None and default[k] in layout.dead_keys.get(
-                "default", {}
-            )
-
-            sk = decode_u(shift.get(k, "")) or None
-            sk_dead = sk is not None and shift[k] in layout.dead_keys.get("shift", {})
-
-            ack = decode_u(alt_caps.get(k, "")) or None
-            ack_dead = ack is not None and alt_caps[k] in layout.dead_keys.get(
-                "caps+alt", {}
-            )
-
-            acsk = decode_u(alt_caps_shift.get(k, "")) or None
-            acsk_dead = acsk is not None and alt_caps_shift[k] in layout.dead_keys.get(
-                "caps+alt+shift", {}
-            )
-
-            ak = decode_u(alts.get(k, "")) or None
-            ak_dead = ak is not None and alts[k] in layout.dead_keys.get("alt", {})
-
-            ask = decode_u(alts_shift.get(k, "")) or None
-            ask_dead = ask is not None and alts_shift[k] in layout.dead_keys.get(
-                "alt+shift", {}
-            )
-
-            ck = decode_u(caps.get(k, "")) or None
-            ck_dead = ck is not None and caps[k] in layout.dead_keys.get("caps", {})
-
-            csk = decode_u(caps_shift.get(k, "")) or None
-            csk_dead = csk is not None and caps_shift[k] in layout.dead_keys.get(
-                "caps+shift", {}
-            )
+            dk_dead = dk is not None and d in dead_keys.get("default", ())
+            sk_dead = sk is not None and s in dead_keys.get("shift", ())
+            ack_dead = ack is not None and ac in dead_keys.get("caps+alt", ())
+            acsk_dead = acsk is not None and acs in dead_keys.get("caps+alt+shift", ())
+            ak_dead = ak is not None and a in dead_keys.get("alt", ())
+            ask_dead = ask is not None and as_ in dead_keys.get("alt+shift", ())
+            ck_dead = ck is not None and c in dead_keys.get("caps", ())
+            csk_dead = csk is not None and cs in dead_keys.get("caps+shift", ())
 
             for g in root.iter():
                 if not g.tag.endswith("g"):
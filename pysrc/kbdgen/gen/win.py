@@ -1,4 +1,6 @@
+import contextlib
 import io
+import hashlib
 import os
 import os.path
 import ntpath
@@ -9,23 +11,31 @@ import uuid
 import re
 import sys
 import json
+import logging
 import subprocess
+import tempfile
+import threading
+import time
 import language_tags
 
-from collections import OrderedDict
+from pathlib import Path
 from distutils.dir_util import copy_tree
 from textwrap import dedent
 
 from ..base import get_logger
 from .base import (
     Generator,
-    bind_iso_keys,
     run_process,
     mode_iter,
     DesktopLayoutView,
     get_bin_resource,
+    RenderContext,
+    render_layouts,
 )
+from ..bundle import dead_key_index, transform_automaton
 from ..cldr import decode_u
+from ..filecache import FileCache
+from ..keys import WIN_SCAN_CODES, WIN_VK_CODES
 
 logger = get_logger(__name__)
 
@@ -57,112 +67,85 @@ def guid(kbd_id):
     return uuid.uuid5(KBDGEN_NAMESPACE, kbd_id)
 
 
-# SC 53 is decimal, 39 is space
-WIN_VK_MAP = bind_iso_keys(
-    (
-        "OEM_5",
-        "1",
-        "2",
-        "3",
-        "4",
-        "5",
-        "6",
-        "7",
-        "8",
-        "9",
-        "0",
-        "OEM_PLUS",
-        "OEM_4",
-        "Q",
-        "W",
-        "E",
-        "R",
-        "T",
-        "Y",
-        "U",
-        "I",
-        "O",
-        "P",
-        "OEM_6",
-        "OEM_1",
-        "A",
-        "S",
-        "D",
-        "F",
-        "G",
-        "H",
-        "J",
-        "K",
-        "L",
-        "OEM_3",
-        "OEM_7",
-        "OEM_2",
-        "OEM_102",
-        "Z",
-        "X",
-        "C",
-        "V",
-        "B",
-        "N",
-        "M",
-        "OEM_COMMA",
-        "OEM_PERIOD",
-        "OEM_MINUS",
-    )
-)
+def win_layout_target(layout):
+    if layout.targets is not None:
+        return layout.targets.get("win", {})
+    return {}
+
+
+def win_target_problems(project, target):
+    """Yields a `(level, message)` pair for each problem with the `win` target
+    of a project. Missing version or UUID are errors."""
+    if project.organisation == "":
+        yield (
+            logging.WARNING,
+            "Property 'organisation' is undefined for this project.",
+        )
+    if project.copyright == "":
+        yield (
+            logging.WARNING,
+            "Property 'copyright' is undefined for this project.",
+        )
+
+    if target.version is None:
+        yield (
+            logging.ERROR,
+            "Property 'targets.win.version' must be defined in the "
+            + "project for this target.",
+        )
+
+    if target.uuid is None:
+        yield (
+            logging.ERROR,
+            "Property 'targets.win.uuid' must be defined in the project "
+            + "for this target.",
+        )
+    else:
+        try:
+            uuid.UUID(target.uuid)
+        except Exception:
+            yield (logging.ERROR, "Property 'targets.win.uuid' is not a valid UUID.")
+
+
+def win_layout_problems(locale, layout):
+    """Yields a `(level, message)` pair for each problem with a layout whose
+    locale Windows does not know. A missing language name is only a warning,
+    as the language is then named "Undefined"."""
+    if lcid_get(locale) is not None:
+        return
+
+    target = win_layout_target(layout)
+    if target.get("locale", None) is None:
+        yield (
+            logging.ERROR,
+            dedent(
+                """\
+            Layout '%s' specifies a locale not recognised by Windows.
+            To solve this issue, insert the below into the relevant layout file with the ISO 639-3 code plus the written script of the language in BCP 47 format:
+
+            targets:
+              win:
+                locale: xyz-Latn
+            """  # noqa: E501
+            )
+            % locale,
+        )
+
+    if target.get("languageName", None) is None:
+        yield (
+            logging.WARNING,
+            dedent(
+                """\
+            Layout '%s' requires the display name for the language to be supplied.
+
+            targets:
+              win:
+                languageName: Pig Latin
+            """
+            )
+            % locale,
+        )
 
-WIN_KEYMAP = bind_iso_keys(
-    (
-        "29",
-        "02",
-        "03",
-        "04",
-        "05",
-        "06",
-        "07",
-        "08",
-        "09",
-        "0a",
-        "0b",
-        "0c",
-        "0d",
-        "10",
-        "11",
-        "12",
-        "13",
-        "14",
-        "15",
-        "16",
-        "17",
-        "18",
-        "19",
-        "1a",
-        "1b",
-        "1e",
-        "1f",
-        "20",
-        "21",
-        "22",
-        "23",
-        "24",
-        "25",
-        "26",
-        "27",
-        "28",
-        "2b",
-        "56",
-        "2c",
-        "2d",
-        "2e",
-        "2f",
-        "30",
-        "31",
-        "32",
-        "33",
-        "34",
-        "35",
-    )
-)
 
 DEFAULT_KEYNAMES = """\
 KEYNAME
@@ -247,34 +230,46 @@ KEYNAME_EXT
 """
 
 
-def win_filter(*args, force=False):
-    def wf(v):
-        """actual filter function"""
-        if v is None:
-            return "-1"
+HEX_CELL_RE = re.compile(r"^\d{4}$")
+LETTER_RE = re.compile("^[A-Za-z]$")
+
 
-        v = str(v)
-        if re.match(r"^\d{4}$", v):
-            return v
+def klc_cell(v, force=False, decoded=False):
+    """Formats a value as a KLC char: -1 for none, a letter as is (unless
+    `force` is set), anything else as its hex codepoint."""
+    if v is None:
+        return "-1"
 
+    v = str(v)
+    if HEX_CELL_RE.match(v):
+        return v
+
+    if not decoded:
         v = decode_u(v)
 
-        if v == "\0":
-            return "-1"
+    if v == "\0":
+        return "-1"
+
+    # check for anything outsize A-Za-z range
+    if not force and LETTER_RE.match(v):
+        return v
 
-        # check for anything outsize A-Za-z range
-        if not force and re.match("^[A-Za-z]$", v):
-            return v
+    return "%04x" % ord(v)
 
-        return "%04x" % ord(v)
 
-    return tuple(wf(i) for i in args)
+def win_filter(*args, force=False, decoded=False):
+    """Formats each value as a KLC char. Pass `decoded=True` for values whose
+    codepoint escapes were already decoded, such as `mode_iter(decoded=True)`
+    gives."""
+    return tuple(klc_cell(v, force, decoded) for v in args)
 
 
 # Grapheme clusters are known as 'ligatures' in Microsoft jargon.
 # This naming is terrible so we're going to use glyphbomb instead.
-def win_glyphbomb(v):
-    o = tuple("%04x" % ord(c) for c in decode_u(v))
+def win_glyphbomb(v, decoded=False):
+    if not decoded:
+        v = decode_u(v)
+    o = tuple("%04x" % ord(c) for c in v)
     if len(o) > 4:
         raise Exception(
             'Glyphbombs ("grapheme clusters") cannot be longer than 4 codepoints.'
@@ -282,11 +277,271 @@ def win_glyphbomb(v):
     return o
 
 
+class KlcEncoder:
+    """`win_filter` and `win_glyphbomb` for the values of one layout, working
+    out each distinct value only once. Layouts repeat most of their values
+    across modes (every `\\u{0}` is one), so a KLC needs a fraction of the
+    conversions it would otherwise."""
+
+    def __init__(self):
+        self._cells = {(f, d): {} for f in (False, True) for d in (False, True)}
+        self._glyphbombs = {}
+
+    def cell(self, v, force=False, decoded=False):
+        cells = self._cells[force, decoded]
+        try:
+            return cells[v]
+        except KeyError:
+            cell = cells[v] = klc_cell(v, force, decoded)
+            return cell
+
+    def cells(self, *args, force=False, decoded=False):
+        return tuple(self.cell(v, force, decoded) for v in args)
+
+    def glyphbomb(self, v, decoded=False):
+        key = (v, decoded)
+        o = self._glyphbombs.get(key, None)
+        if o is None:
+            o = self._glyphbombs[key] = win_glyphbomb(v, decoded)
+        return o
+
+
 inno_langs = {"en": "English", "fi": "Finnish", "nb": "Norwegian"}
 
 custom_msgs = {"Enable": {"en": "Enable %1", "fi": "Aktivoi %1", "nb": "Aktiver %1"}}
 
 
+# The DLLs built for each layout, by kbdutool's name for the architecture.
+DLL_ARCHS = ("i386", "amd64", "wow64")
+
+# kbdutool's flag for building each of them (x86, x64, wow64).
+KBDUTOOL_FLAGS = {"i386": "-x", "amd64": "-m", "wow64": "-o"}
+
+# Bump whenever the way DLLs are built changes, so that DLLs built the old way
+# are not restored from the cache.
+DLL_CACHE_FORMAT = 1
+
+
+class BuildScheduler:
+    """Runs build jobs on a pool of `jobs` threads (default: one per CPU),
+    starting each as soon as it is submitted.
+
+    Each job's time is logged when it finishes. The first job to fail cancels
+    the jobs that have not started yet, and its error is raised by the next
+    `submit` or by `wait`. Leaving a `with` block early cancels them too."""
+
+    def __init__(self, jobs=None):
+        self.workers = jobs or os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers
+        )
+        self._lock = threading.Lock()
+        self._futures = []
+        self._error = None
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, label, fn, *args):
+        self._raise_error()
+        with self._lock:
+            future = self._executor.submit(self._run, label, fn, *args)
+            self._futures.append(future)
+
+    def _run(self, label, fn, *args):
+        if self._error is not None:
+            return
+
+        start = time.perf_counter()
+        try:
+            fn(*args)
+        except BaseException as e:
+            # run_process exits on failure, so SystemExit is a failure too.
+            logger.error(
+                "Building %s failed after %.2fs." % (label, time.perf_counter() - start)
+            )
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self.cancel()
+            raise
+        logger.info("Built %s in %.2fs." % (label, time.perf_counter() - start))
+
+    def cancel(self):
+        with self._lock:
+            cancelled = sum(1 for future in self._futures if future.cancel())
+        if cancelled > 0:
+            logger.debug("Cancelled %d pending builds." % cancelled)
+
+    def wait(self):
+        """Waits for every job, raising the first failure."""
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+        self._raise_error()
+        logger.debug(
+            "Ran %d builds in %.2fs with %d workers."
+            % (len(futures), time.perf_counter() - self._started, self.workers)
+        )
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+
+def file_digest(path):
+    m = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+class DllCache:
+    """Stores built keyboard DLLs on disk.
+
+    Entries are keyed by the sha256 of the KLC file a DLL was built from, its
+    architecture, the kbdutool binary that built it and the certificate it was
+    signed with, so only layouts whose KLC changed are built again."""
+
+    @staticmethod
+    def default():
+        return DllCache(FileCache().cache_dir / "dll")
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        # DLLs are built on BuildScheduler threads.
+        self._lock = threading.Lock()
+
+    def key(self, arch, klc_path, kbdutool_path, pfx_path=None):
+        m = hashlib.sha256()
+        m.update(("%s\0%s\0" % (DLL_CACHE_FORMAT, arch)).encode("utf-8"))
+        for path in (klc_path, kbdutool_path, pfx_path):
+            m.update(("%s\0" % ("" if path is None else file_digest(path))).encode())
+        return m.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / ("%s.dll" % key)
+
+    def get(self, key, dll_path):
+        """Copies the DLL for `key` to `dll_path`, returning whether there was
+        one."""
+        try:
+            shutil.copyfile(str(self._path(key)), dll_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, dll_path):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Copy to a temporary file first so concurrent builds never see a
+            # partially written entry.
+            fd, tmp = tempfile.mkstemp(dir=str(path.parent))
+            os.close(fd)
+            shutil.copyfile(dll_path, tmp)
+            os.replace(tmp, str(path))
+        except Exception as e:
+            logger.debug("Could not write cache entry %s: %s" % (path, e))
+
+    def log_stats(self):
+        logger.debug(
+            "DLL cache: %d hits, %d misses (%s)"
+            % (self.hits, self.misses, self.cache_dir)
+        )
+
+
+def wine_path(thing):
+    if is_windows:
+        return ntpath.abspath(thing)
+    else:
+        return "Z:%s" % ntpath.abspath(thing)
+
+
+class WineSession:
+    """Runs Windows programs under wine for the length of a build.
+
+    While it is open, a persistent wineserver is kept running, so that each
+    wine process does not start its own and wait for the prefix to come up;
+    the server is stopped again on leaving, unless it was running already.
+    `run_batch` runs several commands in a single wine process.
+
+    The `WINE` and `WINESERVER` environment variables override which wine is
+    used. With `persistent` False, no server is started."""
+
+    def __init__(self, persistent=True):
+        self.wine = os.environ.get("WINE", "wine")
+        self.wineserver = os.environ.get("WINESERVER", "wineserver")
+        self.persistent = persistent
+        self._started = False
+
+    def __enter__(self):
+        if self.persistent:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        if shutil.which(self.wineserver) is None:
+            logger.debug("'%s' not found; wine will start its own." % self.wineserver)
+            return
+
+        # Exits straight away, leaving the server running in the background,
+        # or fails if one is running for this prefix already.
+        process = subprocess.run(
+            [self.wineserver, "-p"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._started = process.returncode == 0
+        if self._started:
+            logger.debug("Started a persistent wineserver.")
+        else:
+            logger.debug("Using the wineserver that is running already.")
+
+    def stop(self):
+        if not self._started:
+            return
+        subprocess.run(
+            [self.wineserver, "-k"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self._started = False
+        logger.debug("Stopped the wineserver.")
+
+    def run(self, cmd, cwd=None):
+        return run_process([self.wine] + cmd, cwd=cwd)
+
+    def run_batch(self, commands, batch_dir):
+        """Runs each `(cwd, cmd)` of `commands` in turn, as Windows paths, in a
+        single wine process, stopping at the first one that fails."""
+        lines = ["@echo off"]
+        for cwd, cmd in commands:
+            lines.append('cd /d "%s"' % cwd)
+            lines.append(" ".join('"%s"' % x for x in cmd))
+            lines.append("if errorlevel 1 exit /b 1")
+
+        fd, path = tempfile.mkstemp(suffix=".bat", dir=batch_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="\r\n") as f:
+                f.write("\n".join(lines) + "\n")
+            return self.run(["cmd", "/c", wine_path(path)], cwd=batch_dir)
+        finally:
+            os.remove(path)
+
+
 class WindowsGenerator(Generator):
     @property
     def win_target(self):
@@ -300,17 +555,10 @@ class WindowsGenerator(Generator):
         return self._bundle.resources("win")
 
     @property
-    # @lru_cache(maxsize=1)
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            if "win" in v.modes or "desktop" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("win", "desktop")
 
     def generate(self, base="."):
-        outputs = OrderedDict()
-
         if not self.satisfies_requirements():
             return
 
@@ -323,60 +571,92 @@ class WindowsGenerator(Generator):
                 raise e
                 return
 
-        for locale, layout in self.supported_layouts.items():
-            outputs[self._klc_get_name(locale, layout, False)] = self.generate_klc(
-                locale, layout
-            )
-
         if self.dry_run:
+            # Rendered all the same, to find any errors, but not kept.
+            render_layouts(self.check_klc, self.supported_layouts, self.jobs)
             logger.info("Dry run completed.")
             return
 
         build_dir = os.path.abspath(base)
         os.makedirs(build_dir, exist_ok=True)
 
-        # signcode = self.get_or_download_signcode()
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
-        try:
-            futures = []
+        contexts = self.klc_contexts(build_dir)
 
-            for name, data in outputs.items():
-                klc_path = os.path.join(build_dir, "%s.klc" % name)
-                self.write_klc_file(klc_path, data)
+        if not self.is_release:
+            render_layouts(self.render_klc_file, contexts, self.jobs)
+            return
 
-                if self.is_release:
-                    futures.append(
-                        executor.submit(
-                            self.build_dll, name, "i386", klc_path, build_dir
-                        )
-                    )
-                    futures.append(
-                        executor.submit(
-                            self.build_dll, name, "amd64", klc_path, build_dir
-                        )
-                    )
-                    futures.append(
-                        executor.submit(
-                            self.build_dll, name, "wow64", klc_path, build_dir
-                        )
-                    )
+        self.build_layouts(contexts, build_dir)
+        self.copy_nlp_files(build_dir)
 
-            for future in futures:
-                future.result()
-        finally:
-            executor.shutdown()
+        oses = [("Windows 8.1/10", kbdi)]
+        if self.is_legacy:
+            oses.append(("legacy Windows", kbdi_legacy))
 
-        if self.is_release:
-            self.copy_nlp_files(build_dir)
+        for os_ in oses:
+            shutil.copyfile(os_[1], os.path.join(build_dir, "kbdi.exe"))
+            self.generate_inno_script(os_[0], build_dir)
+            self.build_installer(os_[0], build_dir)
+
+    def klc_contexts(self, build_dir):
+        """A RenderContext for each layout, with the `klc_name` and `path` of
+        its KLC file in `build_dir`."""
+        contexts = []
+        for locale, layout in self.supported_layouts.items():
+            name = self._klc_get_name(locale, layout, False)
+            path = os.path.join(build_dir, "%s.klc" % name)
+            contexts.append(RenderContext(locale, layout, klc_name=name, path=path))
+        return contexts
+
+    @property
+    def wine_session(self):
+        return "no-wine-session" not in self._args.get("flags", [])
+
+    def build_layouts(self, contexts, build_dir):
+        """Writes the KLC of each RenderContext from `generate` and builds its
+        DLLs into `build_dir`."""
+        dll_cache = None
+        if not self._args.get("no_cache", False):
+            dll_cache = DllCache.default()
+
+        wine = None
+        session = contextlib.nullcontext()
+        if not is_windows:
+            wine = session = WineSession(persistent=self.wine_session)
+
+        # signcode = self.get_or_download_signcode()
+        with session, BuildScheduler(self.jobs) as builds:
+            # Written one at a time, so that the DLLs of each layout start
+            # building as soon as its KLC is written.
+            for ctx in contexts:
+                self.render_klc_file(ctx)
+                builds.submit(
+                    "'%s'" % ctx.klc_name,
+                    self.build_dlls,
+                    ctx.klc_name,
+                    ctx.path,
+                    build_dir,
+                    dll_cache,
+                    wine,
+                )
+
+            builds.wait()
 
-            oses = [("Windows 8.1/10", kbdi)]
-            if self.is_legacy:
-                oses.append(("legacy Windows", kbdi_legacy))
+        if dll_cache is not None:
+            dll_cache.log_stats()
 
-            for os_ in oses:
-                shutil.copyfile(os_[1], os.path.join(build_dir, "kbdi.exe"))
-                self.generate_inno_script(os_[0], build_dir)
-                self.build_installer(os_[0], build_dir)
+    def supports_layout_regeneration(self, base, layout):
+        # Release builds bundle every layout into one installer.
+        return not self.is_release
+
+    def generate_layout(self, base, name, layout):
+        build_dir = os.path.abspath(base)
+        os.makedirs(build_dir, exist_ok=True)
+
+        klc_name = self._klc_get_name(name, layout, False)
+        self.write_klc_file(
+            os.path.join(build_dir, "%s.klc" % klc_name), self.iter_klc(name, layout)
+        )
 
     @property
     def is_legacy(self):
@@ -393,11 +673,21 @@ class WindowsGenerator(Generator):
         nlp_path = os.path.join(build_dir, "nlp")
         copy_tree(src_path, nlp_path)
 
-    def write_klc_file(self, filepath, data):
+    def write_klc_file(self, filepath, chunks):
+        """Writes the KLC text in `chunks` (see `iter_klc`) to `filepath` as it
+        comes. The file only replaces an existing one once it is complete."""
         logger.info("Writing '%s'…" % filepath)
-        with open(filepath, "w", encoding="utf-16-le", newline="\r\n") as f:
-            f.write("\ufeff")
-            f.write(data)
+        tmp_path = "%s.tmp" % filepath
+        try:
+            with open(tmp_path, "w", encoding="utf-16-le", newline="\r\n") as f:
+                f.write("\ufeff")
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def get_inno_setup_dir(self):
         possibles = [os.environ.get("INNO_PATH", None)]
@@ -426,9 +716,7 @@ class WindowsGenerator(Generator):
                 return p
 
     def layout_target(self, layout):
-        if layout.targets is not None:
-            return layout.targets.get("win", {})
-        return {}
+        return win_layout_target(layout)
 
     @property
     def codesign_pfx(self):
@@ -454,64 +742,14 @@ class WindowsGenerator(Generator):
         elif pfx is None:
             logger.warn("No code signing PFX was provided; setup will not be signed.")
 
-        if self._bundle.project.organisation == "":
-            logger.warn("Property 'organisation' is undefined for this project.")
-        if self._bundle.project.copyright == "":
-            logger.warn("Property 'copyright' is undefined for this project.")
-
-        if self.win_target.version is None:
-            logger.error(
-                "Property 'targets.win.version' must be defined in the "
-                + "project for this target."
-            )
-            return False
-
-        guid = self.win_target.uuid
-        if guid is None:
-            logger.error(
-                "Property 'targets.win.uuid' must be defined in the project "
-                + "for this target."
-            )
-            return False
-        try:
-            uuid.UUID(guid)
-        except Exception:
-            logger.error("Property 'targets.win.uuid' is not a valid UUID.")
-            return False
-
+        problems = list(win_target_problems(self._bundle.project, self.win_target))
         for locale, layout in self.supported_layouts.items():
-            lcid = lcid_get(locale)
-            if lcid is None and self.layout_target(layout).get("locale", None) is None:
-                logger.error(
-                    dedent(
-                        """\
-                Layout '%s' specifies a locale not recognised by Windows.
-                To solve this issue, insert the below into the relevant layout file with the ISO 639-3 code plus the written script of the language in BCP 47 format:
-
-                targets:
-                  win:
-                    locale: xyz-Latn
-                """  # noqa: E501
-                    )
-                    % locale
-                )
-                return False
-
-            if (
-                lcid is None
-                and self.layout_target(layout).get("languageName", None) is None
-            ):
-                logger.error(
-                    dedent(
-                        """\
-                Layout '%s' requires the display name for the language to be supplied.
+            problems.extend(win_layout_problems(locale, layout))
 
-                targets:
-                  win:
-                    languageName: Pig Latin
-                """
-                    )
-                )
+        for level, message in problems:
+            logger.log(level, message)
+        if any(level >= logging.ERROR for level, _ in problems):
+            return False
 
         fail = False
         ids = []
@@ -535,13 +773,14 @@ class WindowsGenerator(Generator):
 
         if not is_windows:
             # Check for wine
-            if not shutil.which("wine"):
+            wine = os.environ.get("WINE", "wine")
+            if not shutil.which(wine):
                 logger.error("`wine` must exist on your PATH to build keyboard DLLs.")
                 return False
 
             # Check wine version
             out, err = subprocess.Popen(
-                ["wine", "--version"], stdout=subprocess.PIPE
+                [wine, "--version"], stdout=subprocess.PIPE
             ).communicate()
             v_chunks = [int(x) for x in out.decode().split("-").pop().split(".")]
             if v_chunks[0] < 2 or (v_chunks[0] == 2 and v_chunks[1] < 10):
@@ -569,10 +808,7 @@ class WindowsGenerator(Generator):
         return True
 
     def _wine_path(self, thing):
-        if is_windows:
-            return ntpath.abspath(thing)
-        else:
-            return "Z:%s" % ntpath.abspath(thing)
+        return wine_path(thing)
 
     @property
     def _kbdutool(self):
@@ -581,19 +817,70 @@ class WindowsGenerator(Generator):
         else:
             return "%s/bin/i386/kbdutool.exe" % self.get_msklc_dir()
 
-    def build_dll(self, name, arch, klc_path, build_dir):
-        # x86, x64, wow64
-        flags = {"i386": "-x", "amd64": "-m", "wow64": "-o"}
+    def build_dlls(self, name, klc_path, build_dir, cache=None, wine=None):
+        """Builds the DLL of each of `DLL_ARCHS` from a KLC file, unless it
+        is in `cache`, and code signs it.
+
+        Without `wine`, kbdutool is run directly. With a persistent
+        WineSession, the DLLs are all compiled in one wine process, else each
+        in its own."""
+        pfx = self.codesign_pfx
+        pending = []
+        for arch in DLL_ARCHS:
+            out_path = os.path.join(build_dir, arch)
+            os.makedirs(out_path, exist_ok=True)
+            dll_path = os.path.join(out_path, "%s.dll" % name)
+
+            key = None
+            if cache is not None:
+                key = cache.key(
+                    arch,
+                    klc_path,
+                    self._kbdutool,
+                    None if pfx is None else self._bundle.relpath(pfx),
+                )
+                if cache.get(key, dll_path):
+                    logger.info(
+                        "Restored '%s' for %s from the DLL cache." % (name, arch)
+                    )
+                    continue
+            pending.append((arch, out_path, dll_path, key))
+
+        if len(pending) == 0:
+            return
 
-        flag = flags[arch]
+        for arch, _, _, _ in pending:
+            logger.info("Building '%s' for %s…" % (name, arch))
 
-        out_path = os.path.join(build_dir, arch)
-        os.makedirs(out_path, exist_ok=True)
+        if wine is not None and wine.persistent:
+            wine.run_batch(
+                [
+                    (
+                        self._wine_path(out_path),
+                        [self._wine_path(self._kbdutool)]
+                        + self._kbdutool_args(arch, klc_path),
+                    )
+                    for arch, out_path, _, _ in pending
+                ],
+                build_dir,
+            )
+        else:
+            for arch, out_path, _, _ in pending:
+                cmd = [self._kbdutool] + self._kbdutool_args(arch, klc_path)
+                if wine is None:
+                    run_process(cmd, cwd=out_path)
+                else:
+                    wine.run(cmd, cwd=out_path)
 
-        logger.info("Building '%s' for %s…" % (name, arch))
-        cmd = [self._kbdutool, "-n", flag, "-u", self._wine_path(klc_path)]
-        run_process(cmd, cwd=out_path)
+        for arch, out_path, dll_path, key in pending:
+            self.sign_dll(name, arch, dll_path, out_path)
+            if key is not None:
+                cache.put(key, dll_path)
+
+    def _kbdutool_args(self, arch, klc_path):
+        return ["-n", KBDUTOOL_FLAGS[arch], "-u", self._wine_path(klc_path)]
 
+    def sign_dll(self, name, arch, dll_path, out_path):
         pfx = self.codesign_pfx
         if pfx is None:
             logger.warn(
@@ -610,7 +897,7 @@ class WindowsGenerator(Generator):
             "signtool.exe",
             "sign", "/t", "http://timestamp.verisign.com/scripts/timstamp.dll",
             "/f", pfx_path, "/p", self.codesign_pw,
-            self._wine_path(os.path.join(out_path, "%s.dll" % name))
+            self._wine_path(dll_path)
         ]
         run_process(cmd, cwd=out_path)
 
@@ -969,8 +1256,8 @@ Source: "{#BuildDir}\\wow64\\*"; DestDir: "{syswow64}"; Check: Is64BitInstallMod
         logger.trace("Override locale: %s" % o)
         return str(o)
 
-    def _klc_write_headers(self, locale, layout, buf):
-        buf.write(
+    def _klc_headers(self, locale, layout):
+        yield (
             'KBD\t%s\t"%s"\n\n'
             % (self._klc_get_name(locale, layout, False), layout.display_names[locale])
         )
@@ -979,26 +1266,26 @@ Source: "{#BuildDir}\\wow64\\*"; DestDir: "{syswow64}"; Check: Is64BitInstallMod
         organisation = self._bundle.project.organisation or r"¯\_(ツ)_/¯"
         override_locale = self.override_locale(locale, layout)
 
-        buf.write('COPYRIGHT\t"%s"\n\n' % copyright_)
-        buf.write('COMPANY\t"%s"\n\n' % organisation)
-        buf.write('LOCALENAME\t"%s"\n\n' % override_locale)
+        yield 'COPYRIGHT\t"%s"\n\n' % copyright_
+        yield 'COMPANY\t"%s"\n\n' % organisation
+        yield 'LOCALENAME\t"%s"\n\n' % override_locale
 
         lcid = lcid_get_hex8(override_locale) or lcid_get_hex8(locale) or "00002000"
 
-        buf.write('LOCALEID\t"%s"\n\n' % lcid)
-        buf.write("VERSION\t1.0\n\n")
+        yield 'LOCALEID\t"%s"\n\n' % lcid
+        yield "VERSION\t1.0\n\n"
         # 0: default, 1: shift, 2: ctrl, 6: altGr/ctrl+alt, 7: shift+6
-        buf.write("SHIFTSTATE\n\n0\n1\n2\n6\n7\n\n")
+        yield "SHIFTSTATE\n\n0\n1\n2\n6\n7\n\n"
 
-        buf.write("LAYOUT       ;\n\n")
-        buf.write(
+        yield "LAYOUT       ;\n\n"
+        yield (
             "//SC\tVK_ \t\tCaps\tNormal\tShift\tCtrl\tAltGr\tAltShft\t-> Output\n"
         )
-        buf.write(
+        yield (
             "//--\t----\t\t----\t------\t-----\t----\t-----\t-------\t   ------\n\n"
         )
 
-    def _klc_write_keys(self, locale, layout, buf):
+    def _klc_keys(self, locale, layout):
         col0 = mode_iter(locale, layout, "default", "win", required=True)
         col1 = mode_iter(locale, layout, "shift", "win")
         col2 = mode_iter(locale, layout, "ctrl", "win")
@@ -1007,13 +1294,23 @@ Source: "{#BuildDir}\\wow64\\*"; DestDir: "{syswow64}"; Check: Is64BitInstallMod
         alt_caps = mode_iter(locale, layout, "alt+caps", "win")
         caps = mode_iter(locale, layout, "caps", "win")
         caps_shift = mode_iter(locale, layout, "caps+shift", "win")
+        decoded = tuple(
+            mode_iter(locale, layout, mode, "win", decoded=True)
+            for mode in ("default", "shift", "ctrl", "alt", "alt+shift")
+        )
+        caps_decoded = mode_iter(locale, layout, "caps", "win", decoded=True)
+        caps_shift_decoded = mode_iter(
+            locale, layout, "caps+shift", "win", decoded=True
+        )
+        dead_keys = dead_key_index(layout).modes("win", "desktop")
+        encoder = KlcEncoder()
 
         # Hold all the glyphbombs
         glyphbombs = []
 
-        for (sc, vk, c0, c1, c2, c6, c7, cap, scap, acap) in zip(
-            WIN_KEYMAP.values(),
-            WIN_VK_MAP.values(),
+        for (sc, vk, c0, c1, c2, c6, c7, cap, scap, acap, d, dcap, dscap) in zip(
+            WIN_SCAN_CODES,
+            WIN_VK_CODES,
             col0,
             col1,
             col2,
@@ -1022,6 +1319,9 @@ Source: "{#BuildDir}\\wow64\\*"; DestDir: "{syswow64}"; Check: Is64BitInstallMod
             caps,
             caps_shift,
             alt_caps,
+            zip(*decoded),
+            caps_decoded,
+            caps_shift_decoded,
         ):
 
             cap_mode = 0
@@ -1037,59 +1337,57 @@ Source: "{#BuildDir}\\wow64\\*"; DestDir: "{syswow64}"; Check: Is64BitInstallMod
 
             if len(vk) < 8:
                 vk += "\t"
-            buf.write("%s\t%s\t%s" % (sc, vk, cap_mode))
+            row = ["%s\t%s\t%s" % (sc, vk, cap_mode)]
 
             # n is the col number for glyphbombs.
-            for n, mode, key in (
-                (0, "default", c0),
-                (1, "shift", c1),
-                (2, "ctrl", c2),
-                (3, "alt", c6),
-                (4, "alt+shift", c7),
+            for n, mode, key, filtered in zip(
+                range(5),
+                ("default", "shift", "ctrl", "alt", "alt+shift"),
+                (c0, c1, c2, c6, c7),
+                d,
             ):
-
-                filtered = decode_u(key or "")
-                if key is not None and len(filtered) > 1:
-                    buf.write("\t%%")
-                    glyphbombs.append((filtered, (vk, str(n)) + win_glyphbomb(key)))
+                if filtered is not None and len(filtered) > 1:
+                    row.append("\t%%")
+                    glyphbombs.append(
+                        (filtered, (vk, str(n)) + encoder.glyphbomb(filtered, True))
+                    )
                 else:
-                    buf.write("\t%s" % win_filter(key))
-                    dead_keys = layout.dead_keys or {}
-                    if key in dead_keys.get(mode, []):
-                        buf.write("@")
+                    row.append("\t%s" % encoder.cell(filtered, decoded=True))
+                    if key in dead_keys.get(mode, ()):
+                        row.append("@")
 
-            buf.write("\t// %s %s %s %s %s\n" % (c0, c1, c2, c6, c7))
+            row.append("\t// %s %s %s %s %s\n" % (c0, c1, c2, c6, c7))
+            yield "".join(row)
 
             if cap_mode == "SGCap":
-                if cap is not None and len(win_glyphbomb(cap)) > 1:
-                    cap = None
+                if dcap is not None and len(dcap) > 1:
                     logger.error(
                         "Caps key '%s' is a glyphbomb and cannot be used in Caps Mode."
                         % cap
                     )
+                    cap = dcap = None
 
-                if scap is not None and len(win_glyphbomb(scap)) > 1:
-                    scap = None
+                if dscap is not None and len(dscap) > 1:
                     msg = (
                         "Caps+Shift key '%s' is a glyphbomb and "
                         + "cannot be used in Caps Mode."
                     )
-                    logger.error(msg % cap)
+                    logger.error(msg % scap)
+                    scap = dscap = None
 
-                buf.write(
+                yield (
                     "-1\t-1\t\t0\t%s\t%s\t\t\t\t// %s %s\n"
-                    % (win_filter(cap, scap) + (cap, scap))
+                    % (encoder.cells(dcap, dscap, decoded=True) + (cap, scap))
                 )
 
         # Space, such special case oh my.
-        buf.write("39\tSPACE\t\t0\t")
         if layout.space is None or layout.space.get("win", None) is None:
-            buf.write("0020\t0020\t0020\t-1\t-1\n")
+            yield "39\tSPACE\t\t0\t0020\t0020\t0020\t-1\t-1\n"
         else:
             o = layout.space.get("win")
-            buf.write(
-                "%s\t%s\t%s\t%s\t%s\n"
-                % win_filter(
+            yield (
+                "39\tSPACE\t\t0\t%s\t%s\t%s\t%s\t%s\n"
+                % encoder.cells(
                     o.get("default", "0020"),
                     o.get("shift", "0020"),
                     o.get("ctrl", "0020"),
@@ -1100,91 +1398,102 @@ Source: "{#BuildDir}\\wow64\\*"; DestDir: "{syswow64}"; Check: Is64BitInstallMod
 
         # Decimal key on keypad.
         decimal = layout.decimal or "."
-        buf.write(
-            "53\tDECIMAL\t\t0\t%s\t%s\t-1\t-1\t-1\n\n" % win_filter(decimal, decimal)
+        yield (
+            "53\tDECIMAL\t\t0\t%s\t%s\t-1\t-1\t-1\n\n"
+            % encoder.cells(decimal, decimal)
         )
 
         # Glyphbombs!
         if len(glyphbombs) > 0:
-            buf.write("LIGATURE\n\n")
-            buf.write("//VK_\tMod#\tChr0\tChr1\tChr2\tChr3\n")
-            buf.write("//----\t----\t----\t----\t----\t----\n\n")
+            yield "LIGATURE\n\n"
+            yield "//VK_\tMod#\tChr0\tChr1\tChr2\tChr3\n"
+            yield "//----\t----\t----\t----\t----\t----\n\n"
             for original, col in glyphbombs:
                 more_tabs = len(col) - 7
-                buf.write(
+                yield (
                     "%s\t\t%s%s\t// %s\n"
                     % (col[0], "\t".join(col[1:]), "\t" * more_tabs, original)
                 )
-            buf.write("\n")
+            yield "\n"
 
         # Deadkeys!
-        transforms = layout.transforms or {}
-        for basekey, o in transforms.items():
-            if len(basekey) != 1:
-                logger.warning(
-                    ("Base key '%s' invalid for Windows deadkeys; skipping.") % basekey
-                )
-                continue
-
-            buf.write("DEADKEY\t%s\n\n" % win_filter(basekey))
-            for key, output in o.items():
+        automaton = transform_automaton(layout)
+        skipped = []
+        for basekey, state in self._klc_dead_keys(automaton):
+            yield "DEADKEY\t%s\n\n" % encoder.cell(basekey)
+            for key, target, output in automaton.edges(state):
                 if key == " ":
                     continue
 
-                key = str(key)
-                output = str(output)
-
-                if len(key) != 1 or len(output) != 1:
-                    logger.debug(
-                        ("%s%s -> %s is invalid for Windows " + "deadkeys; skipping.")
-                        % (basekey, key, output)
-                    )
+                if target is not None or len(key) != 1 or len(output) != 1:
+                    skipped.append(basekey + key)
                     continue
-                buf.write(
+                yield (
                     "%s\t%s\t// %s -> %s\n"
-                    % (win_filter(key, output, force=True) + (key, output))
+                    % (encoder.cells(key, output, force=True) + (key, output))
                 )
 
             # Create fallback key from space, or the basekey.
-            output = o.get(" ", basekey)
-            buf.write("0020\t%s\t//   -> %s\n\n" % (win_filter(output)[0], output))
-
-    def _klc_write_deadkey_names(self, layout, buf):
-        buf.write("KEYNAME_DEAD\n\n")
+            output = automaton.fallback(state, basekey)
+            yield "0020\t%s\t//   -> %s\n\n" % (encoder.cell(output), output)
+
+        # Logged once, as logging is slow.
+        if len(skipped) > 0:
+            logger.debug(
+                "Skipping transforms that are invalid for Windows deadkeys: %s"
+                % " ".join(skipped)
+            )
 
-        transforms = layout.transforms or {}
-        for basekey, o in transforms.items():
+    def _klc_dead_keys(self, automaton):
+        """Yields each base key of the transforms that Windows can use as a
+        dead key, with the automaton state it leads to."""
+        for basekey, state, _ in automaton.edges(0):
+            if state is None:
+                continue
             if len(basekey) != 1:
                 logger.warning(
-                    ("Base key '%s' invalid for Windows " + "deadkeys; skipping.")
-                    % basekey
+                    ("Base key '%s' invalid for Windows deadkeys; skipping.") % basekey
                 )
                 continue
+            yield basekey, state
+
+    def _klc_deadkey_names(self, layout):
+        yield "KEYNAME_DEAD\n\n"
 
-            buf.write(
+        for basekey, _ in self._klc_dead_keys(transform_automaton(layout)):
+            yield (
                 '%s\t"%s"\n' % (win_filter(basekey)[0], unicodedata.name(basekey))
             )
 
-    def _klc_write_footer(self, locale, layout, buf):
+    def _klc_footer(self, locale, layout):
         language_name = self.layout_target(layout).get("languageName", "Undefined")
         lcid = lcid_get(locale) or 0x0C00
         layout_name = layout.display_names[locale]
 
-        buf.write("\nDESCRIPTIONS\n\n")
-        buf.write("%04x\t%s\n" % (lcid, layout_name))
+        yield "\nDESCRIPTIONS\n\n"
+        yield "%04x\t%s\n" % (lcid, layout_name)
 
-        buf.write("\nLANGUAGENAMES\n\n")
-        buf.write("%04x\t%s\n" % (lcid, language_name))
+        yield "\nLANGUAGENAMES\n\n"
+        yield "%04x\t%s\n" % (lcid, language_name)
 
-        buf.write("ENDKBD\n")
+        yield "ENDKBD\n"
 
-    def generate_klc(self, locale, layout):
-        buf = io.StringIO()
+    def iter_klc(self, locale, layout):
+        """Yields the KLC of a layout a line or key row at a time, so that it is
+        never held in memory whole."""
+        sections = (
+            self._klc_headers(locale, layout),
+            self._klc_keys(locale, layout),
+            (DEFAULT_KEYNAMES,),
+            self._klc_deadkey_names(layout),
+            self._klc_footer(locale, layout),
+        )
+        for section in sections:
+            yield from section
 
-        self._klc_write_headers(locale, layout, buf)
-        self._klc_write_keys(locale, layout, buf)
-        buf.write(DEFAULT_KEYNAMES)
-        self._klc_write_deadkey_names(layout, buf)
-        self._klc_write_footer(locale, layout, buf)
+    def render_klc_file(self, ctx):
+        self.write_klc_file(ctx.path, self.iter_klc(ctx.name, ctx.layout))
 
-        return buf.getvalue()
+    def check_klc(self, ctx):
+        for _ in self.iter_klc(ctx.name, ctx.layout):
+            pass
@@ -1,9 +1,16 @@
+import io
 import os
-from collections import OrderedDict
 
 from ..base import get_logger
-from .base import Generator, filepath, mode_iter, ISO_KEYS, get_bin_resource
-from ..cldr import CP_REGEX
+from .base import (
+    Generator,
+    RenderContext,
+    filepath,
+    mode_iter,
+    render_layouts,
+    ISO_KEYS,
+    get_bin_resource,
+)
 
 logger = get_logger(__name__)
 
@@ -25,16 +32,14 @@ with get_bin_resource("keysym.tsv", text=True) as f:
         line = f.readline()
 
 
+# First char in Supplemental Private Use Area-A
+FIRST_SURROGATE = 0xF0000
+
+
 class XKBGenerator(Generator):
     @property
-    # @lru_cache(maxsize=1)
     def supported_layouts(self):
-        o = OrderedDict()
-        for k, v in self._bundle.layouts.items():
-            # TODO: we might need an X11 target
-            if "win" in v.modes or "desktop" in v.modes:
-                o[k] = v
-        return o
+        return self.layouts_with_modes("win", "desktop")
 
     def generate(self, base="."):
         if not self.satisfies_requirements():
@@ -50,36 +55,65 @@ class XKBGenerator(Generator):
         xkb_fn = os.path.join(self.build_dir, "%s.xkb" % (self._bundle.name))
         xcompose_fn = os.path.join(self.build_dir, "%s.xcompose" % (self._bundle.name))
 
-        # First char in Supplemental Private Use Area-A
-        self.surrogate = 0xF0000
-        self.xkb = open(xkb_fn, "w", encoding="utf-8")
-        self.xcompose = open(xcompose_fn, "w", encoding="utf-8")
-
+        # Ligatures are numbered across all layouts, so each layout starts
+        # where the ones before it left off.
+        contexts = []
+        surrogate = FIRST_SURROGATE
         for name, layout in self.supported_layouts.items():
-            self.write_nonsense(name, layout)
-
-        self.xkb.close()
-        self.xcompose.close()
-
-    def filter_xkb_keysyms(self, v):
+            contexts.append(RenderContext(name, layout, surrogate=surrogate))
+            surrogate += self.ligature_count(name, layout)
+
+        symbols = render_layouts(self.render_symbols, contexts, self.jobs)
+
+        with open(xkb_fn, "w", encoding="utf-8") as xkb, open(
+            xcompose_fn, "w", encoding="utf-8"
+        ) as xcompose:
+            for xkb_data, xcompose_data in symbols.values():
+                xkb.write(xkb_data)
+                xcompose.write(xcompose_data)
+
+    def columns(self, name, layout):
+        return (
+            mode_iter(name, layout, "default", "win", required=True, decoded=True),
+            mode_iter(name, layout, "shift", "win", decoded=True),
+            mode_iter(name, layout, "alt", "win", decoded=True),
+            mode_iter(name, layout, "alt+shift", "win", decoded=True),
+        )
+
+    def ligature_count(self, name, layout):
+        """The number of surrogates `write_nonsense` uses for a layout."""
+        return sum(
+            1
+            for row in zip(ISO_KEYS, *self.columns(name, layout))
+            for v in row[1:]
+            if v is not None and len(v) > 1
+        )
+
+    def render_symbols(self, ctx):
+        ctx.xkb = io.StringIO()
+        ctx.xcompose = io.StringIO()
+        self.write_nonsense(ctx)
+        return ctx.xkb.getvalue(), ctx.xcompose.getvalue()
+
+    def filter_xkb_keysyms(self, ctx, v):
         """actual filter function"""
         if v is None:
             return ""
 
-        v = CP_REGEX.sub(lambda x: chr(int(x.group(1), 16)), v)
-
         if len(v) > 1:
             cps = " ".join(["U%04X" % ord(x) for x in v])
-            self.xcompose.write("<U%X> : %s # %s\n" % (self.surrogate, cps, v))
-            o = self.surrogate
-            self.surrogate += 1
+            ctx.xcompose.write("<U%X> : %s # %s\n" % (ctx.surrogate, cps, v))
+            o = ctx.surrogate
+            ctx.surrogate += 1
         else:
             o = ord(v)
         return keysym_to_str.get(o, "U%04X" % o)
 
-    def write_nonsense(self, name, layout):
-        buf = self.xkb
-        ligs = self.xcompose
+    def write_nonsense(self, ctx):
+        name = ctx.name
+        layout = ctx.layout
+        buf = ctx.xkb
+        ligs = ctx.xcompose
 
         ligs.write("# %s\n" % name)
 
@@ -88,13 +122,10 @@ class XKBGenerator(Generator):
         buf.write('    include "latin"\n')
         buf.write('    name[Group1] = "%s";\n\n' % layout.display_names[name])
 
-        col0 = mode_iter(name, layout, "default", "win", required=True)
-        col1 = mode_iter(name, layout, "shift", "win")
-        col2 = mode_iter(name, layout, "alt", "win")
-        col3 = mode_iter(name, layout, "alt+shift", "win")
+        col0, col1, col2, col3 = self.columns(name, layout)
 
         def xkb_filter(self, *args):
-            out = [self.filter_xkb_keysyms(i) for i in args]
+            out = [self.filter_xkb_keysyms(ctx, i) for i in args]
             while len(out) > 0 and out[-1] == "":
                 out.pop()
             return tuple(out)
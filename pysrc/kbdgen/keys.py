@@ -0,0 +1,302 @@
+"""ISO key ids, and the codes each target has for them.
+
+A key's id is its position in ISO_KEYS, which is also where a DesktopKeymap
+keeps its value, so a target's codes are a tuple in the same order and
+translating a whole mode is a single `zip(codes, keymap.values())`."""
+
+ISO_KEYS = (
+    "E00",
+    "E01",
+    "E02",
+    "E03",
+    "E04",
+    "E05",
+    "E06",
+    "E07",
+    "E08",
+    "E09",
+    "E10",
+    "E11",
+    "E12",
+    "D01",
+    "D02",
+    "D03",
+    "D04",
+    "D05",
+    "D06",
+    "D07",
+    "D08",
+    "D09",
+    "D10",
+    "D11",
+    "D12",
+    "C01",
+    "C02",
+    "C03",
+    "C04",
+    "C05",
+    "C06",  # TODO fix the D13 special case.
+    "C07",
+    "C08",
+    "C09",
+    "C10",
+    "C11",
+    "D13",  # C12 -> D13
+    "B00",
+    "B01",
+    "B02",
+    "B03",
+    "B04",
+    "B05",
+    "B06",
+    "B07",
+    "B08",
+    "B09",
+    "B10",
+)
+
+ISO_KEY_INDEX = {k: n for n, k in enumerate(ISO_KEYS)}
+
+
+def bind_iso_keys(codes):
+    """Returns a target's codes, given in ISO_KEYS order, as a tuple."""
+    codes = tuple(codes)
+    if len(codes) != len(ISO_KEYS):
+        raise ValueError("Expected %d key codes, got %d" % (len(ISO_KEYS), len(codes)))
+    return codes
+
+
+# Scan codes. SC 53 is decimal, 39 is space
+WIN_SCAN_CODES = bind_iso_keys(
+    (
+        # Row E
+        "29",  # E00
+        "02",  # E01
+        "03",  # E02
+        "04",  # E03
+        "05",  # E04
+        "06",  # E05
+        "07",  # E06
+        "08",  # E07
+        "09",  # E08
+        "0a",  # E09
+        "0b",  # E10
+        "0c",  # E11
+        "0d",  # E12
+        # Row D
+        "10",  # D01
+        "11",  # D02
+        "12",  # D03
+        "13",  # D04
+        "14",  # D05
+        "15",  # D06
+        "16",  # D07
+        "17",  # D08
+        "18",  # D09
+        "19",  # D10
+        "1a",  # D11
+        "1b",  # D12
+        # Row C
+        "1e",  # C01
+        "1f",  # C02
+        "20",  # C03
+        "21",  # C04
+        "22",  # C05
+        "23",  # C06
+        "24",  # C07
+        "25",  # C08
+        "26",  # C09
+        "27",  # C10
+        "28",  # C11
+        "2b",  # D13
+        # Row B
+        "56",  # B00
+        "2c",  # B01
+        "2d",  # B02
+        "2e",  # B03
+        "2f",  # B04
+        "30",  # B05
+        "31",  # B06
+        "32",  # B07
+        "33",  # B08
+        "34",  # B09
+        "35",  # B10
+    )
+)
+
+
+# Virtual key names, without their VK_ prefix.
+WIN_VK_CODES = bind_iso_keys(
+    (
+        # Row E
+        "OEM_5",  # E00
+        "1",  # E01
+        "2",  # E02
+        "3",  # E03
+        "4",  # E04
+        "5",  # E05
+        "6",  # E06
+        "7",  # E07
+        "8",  # E08
+        "9",  # E09
+        "0",  # E10
+        "OEM_PLUS",  # E11
+        "OEM_4",  # E12
+        # Row D
+        "Q",  # D01
+        "W",  # D02
+        "E",  # D03
+        "R",  # D04
+        "T",  # D05
+        "Y",  # D06
+        "U",  # D07
+        "I",  # D08
+        "O",  # D09
+        "P",  # D10
+        "OEM_6",  # D11
+        "OEM_1",  # D12
+        # Row C
+        "A",  # C01
+        "S",  # C02
+        "D",  # C03
+        "F",  # C04
+        "G",  # C05
+        "H",  # C06
+        "J",  # C07
+        "K",  # C08
+        "L",  # C09
+        "OEM_3",  # C10
+        "OEM_7",  # C11
+        "OEM_2",  # D13
+        # Row B
+        "OEM_102",  # B00
+        "Z",  # B01
+        "X",  # B02
+        "C",  # B03
+        "V",  # B04
+        "B",  # B05
+        "N",  # B06
+        "M",  # B07
+        "OEM_COMMA",  # B08
+        "OEM_PERIOD",  # B09
+        "OEM_MINUS",  # B10
+    )
+)
+
+
+# Virtual key codes. 36 is return, 48 tab, 49 space and 51 backspace.
+MAC_KEY_CODES = bind_iso_keys(
+    (
+        # Row E
+        "10",  # E00 (flipped with B00!)
+        "18",  # E01
+        "19",  # E02
+        "20",  # E03
+        "21",  # E04
+        "23",  # E05
+        "22",  # E06
+        "26",  # E07
+        "28",  # E08
+        "25",  # E09
+        "29",  # E10
+        "27",  # E11
+        "24",  # E12
+        # Row D
+        "12",  # D01
+        "13",  # D02
+        "14",  # D03
+        "15",  # D04
+        "17",  # D05
+        "16",  # D06
+        "32",  # D07
+        "34",  # D08
+        "31",  # D09
+        "35",  # D10
+        "33",  # D11
+        "30",  # D12
+        # Row C
+        "0",  # C01
+        "1",  # C02
+        "2",  # C03
+        "3",  # C04
+        "5",  # C05
+        "4",  # C06
+        "38",  # C07
+        "40",  # C08
+        "37",  # C09
+        "41",  # C10
+        "39",  # C11
+        "42",  # D13
+        # Row B
+        "50",  # B00 (flipped with E00!)
+        "6",  # B01
+        "7",  # B02
+        "8",  # B03
+        "9",  # B04
+        "11",  # B05
+        "45",  # B06
+        "46",  # B07
+        "43",  # B08
+        "47",  # B09
+        "44",  # B10
+    )
+)
+
+
+# KeyboardEvent.code values.
+CHROME_KEY_CODES = bind_iso_keys(
+    (
+        # Row E
+        "Backquote",  # E00
+        "Digit1",  # E01
+        "Digit2",  # E02
+        "Digit3",  # E03
+        "Digit4",  # E04
+        "Digit5",  # E05
+        "Digit6",  # E06
+        "Digit7",  # E07
+        "Digit8",  # E08
+        "Digit9",  # E09
+        "Digit0",  # E10
+        "Minus",  # E11
+        "Equal",  # E12
+        # Row D
+        "KeyQ",  # D01
+        "KeyW",  # D02
+        "KeyE",  # D03
+        "KeyR",  # D04
+        "KeyT",  # D05
+        "KeyY",  # D06
+        "KeyU",  # D07
+        "KeyI",  # D08
+        "KeyO",  # D09
+        "KeyP",  # D10
+        "BracketLeft",  # D11
+        "BracketRight",  # D12
+        # Row C
+        "KeyA",  # C01
+        "KeyS",  # C02
+        "KeyD",  # C03
+        "KeyF",  # C04
+        "KeyG",  # C05
+        "KeyH",  # C06
+        "KeyJ",  # C07
+        "KeyK",  # C08
+        "KeyL",  # C09
+        "Semicolon",  # C10
+        "Quote",  # C11
+        "Backslash",  # D13
+        # Row B
+        "IntlBackslash",  # B00
+        "KeyZ",  # B01
+        "KeyX",  # B02
+        "KeyC",  # B03
+        "KeyV",  # B04
+        "KeyB",  # B05
+        "KeyN",  # B06
+        "KeyM",  # B07
+        "Comma",  # B08
+        "Period",  # B09
+        "Slash",  # B10
+    )
+)
@@ -4,17 +4,16 @@ from collections import OrderedDict
 import yaml
 import yaml.constructor
 
+try:
+    from yaml import CLoader
+except ImportError:
+    CLoader = None
+
 # Courtesy of https://gist.github.com/844388. Thanks!
 
 
-class OrderedDictYAMLLoader(yaml.Loader):
-    """A YAML loader that loads mappings into ordered dictionaries."""
-
-    def __init__(self, *args, **kwargs):
-        yaml.Loader.__init__(self, *args, **kwargs)
-
-        self.add_constructor("tag:yaml.org,2002:map", type(self).construct_yaml_map)
-        self.add_constructor("tag:yaml.org,2002:omap", type(self).construct_yaml_map)
+class OrderedDictConstructorMixin:
+    """Constructs mappings as ordered dictionaries. Mixed into a loader class."""
 
     def construct_yaml_map(self, node):
         data = OrderedDict()
@@ -50,9 +49,44 @@ class OrderedDictYAMLLoader(yaml.Loader):
         return mapping
 
 
-def load(f):
-    return yaml.load(f, OrderedDictYAMLLoader)
+class OrderedDictYAMLLoader(OrderedDictConstructorMixin, yaml.Loader):
+    """A YAML loader that loads mappings into ordered dictionaries."""
+
+    def __init__(self, *args, **kwargs):
+        yaml.Loader.__init__(self, *args, **kwargs)
+
+        self.add_constructor("tag:yaml.org,2002:map", type(self).construct_yaml_map)
+        self.add_constructor("tag:yaml.org,2002:omap", type(self).construct_yaml_map)
+
+
+if CLoader is not None:
+
+    class OrderedDictCYAMLLoader(OrderedDictConstructorMixin, CLoader):
+        """Same as `OrderedDictYAMLLoader`, but scans and parses with libyaml."""
+
+        def __init__(self, *args, **kwargs):
+            CLoader.__init__(self, *args, **kwargs)
+
+            self.add_constructor(
+                "tag:yaml.org,2002:map", type(self).construct_yaml_map
+            )
+            self.add_constructor(
+                "tag:yaml.org,2002:omap", type(self).construct_yaml_map
+            )
+
+    DefaultLoader = OrderedDictCYAMLLoader
+else:
+    OrderedDictCYAMLLoader = None
+    DefaultLoader = OrderedDictYAMLLoader
+
+
+def load(f, loader=None):
+    return yaml.load(f, loader or DefaultLoader)
 
 
-def loads(string):
-    return yaml.load(io.StringIO(string), OrderedDictYAMLLoader)
+def loads(string, loader=None):
+    loader = loader or DefaultLoader
+    if loader is OrderedDictYAMLLoader:
+        return yaml.load(io.StringIO(string), loader)
+    # libyaml takes the string as is; no need to wrap it in a stream.
+    return yaml.load(string, loader)
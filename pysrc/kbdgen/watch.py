@@ -0,0 +1,105 @@
+import os
+import time
+import logging
+
+from .base import KbdgenException, Parser
+
+logger = logging.getLogger()
+
+
+def snapshot(bundle_path):
+    """Returns the modification time and size of every file a bundle is decoded from."""
+    paths = [os.path.join(bundle_path, "project.yaml")]
+    for subdir in ("layouts", "targets"):
+        d = os.path.join(bundle_path, subdir)
+        if os.path.isdir(d):
+            paths += [os.path.join(d, x) for x in sorted(os.listdir(d))]
+
+    o = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        o[path] = (st.st_mtime_ns, st.st_size)
+    return o
+
+
+def changed_paths(old, new):
+    return sorted(
+        set(x for x in new if old.get(x) != new[x]) | set(x for x in old if x not in new)
+    )
+
+
+def regenerate(generator, base, affected):
+    """Re-runs the generator for the affected layouts only, where it supports it.
+
+    `affected` is a set of layout names, or None if everything must be rebuilt."""
+    if affected is not None:
+        supported = getattr(generator, "supported_layouts", None)
+        if supported is None:
+            supported = generator.layouts
+
+        layouts = []
+        for name in sorted(affected):
+            if name not in supported:
+                logger.info("Layout '%s' is not built for this target." % name)
+                continue
+            layouts.append((name, supported[name]))
+
+        # Checked for all of them first, so that nothing is written before
+        # falling back to a full build.
+        if all(generator.supports_layout_regeneration(base, x) for _, x in layouts):
+            for name, layout in layouts:
+                logger.info("Regenerating '%s'…" % name)
+                generator.generate_layout(base, name, layout)
+            return
+
+    logger.info("Regenerating all layouts…")
+    generator.generate(base)
+
+
+def watch(generator, base=".", interval=0.5, cfg_pairs=None, cache=None):
+    """Polls the generator's bundle for changes and regenerates the affected outputs
+    until interrupted."""
+    bundle = generator._bundle
+    if not hasattr(bundle.layouts, "invalidate") or not os.path.isdir(bundle.path):
+        logger.error(
+            "Only .kbdgen bundle directories can be watched, not archives or "
+            "compiled snapshots."
+        )
+        return
+
+    state = snapshot(bundle.path)
+
+    logger.info("Watching '%s' for changes. Press Ctrl+C to stop." % bundle.path)
+    try:
+        while True:
+            time.sleep(interval)
+            new_state = snapshot(bundle.path)
+            changed = changed_paths(state, new_state)
+            if len(changed) == 0:
+                continue
+            state = new_state
+
+            for path in changed:
+                logger.info("Changed: %s" % os.path.relpath(path, bundle.path))
+
+            start = time.perf_counter()
+            try:
+                affected = bundle.reload(changed, cache=cache)
+                if affected is None:
+                    Parser().apply_overrides(bundle, cfg_pairs)
+                generator.reset_layouts()
+                regenerate(generator, base, affected)
+            except KbdgenException as e:
+                logger.error(e)
+                continue
+            except Exception as e:
+                # Most likely a half-written file; wait for the next save.
+                logger.error("Error while regenerating: %s" % e)
+                continue
+
+            logger.info("Done in %.2fs." % (time.perf_counter() - start))
+    except KeyboardInterrupt:
+        pass
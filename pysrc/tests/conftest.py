@@ -0,0 +1,74 @@
+"""Stand-ins for the extension modules that the kbdgen binary embeds
+(`rust_logger`, `language_tags` and `reqwest`), so that the tests can run
+against the Python package on its own. The real modules are used where they
+can be imported."""
+import importlib
+import sys
+import types
+
+
+class Logger:
+    """Drops log records, which the tests do not look at."""
+
+    def __init__(self, target):
+        self.target = target
+
+    def log(self, level, msg, lno, mod):
+        pass
+
+
+class LanguageTag:
+    """The parts of a BCP 47 tag that kbdgen reads and sets: its language,
+    script and region subtags."""
+
+    def __init__(self, tag):
+        parts = tag.split("-")
+        self._language = parts[0]
+        self._script = None
+        self._region = None
+        for part in parts[1:]:
+            if len(part) == 4 and part.isalpha():
+                self._script = part
+            elif len(part) in (2, 3):
+                self._region = part
+
+    def script(self):
+        return self._script
+
+    def region(self):
+        return self._region
+
+    def set_script(self, script):
+        self._script = script
+
+    def set_region(self, region):
+        self._region = region
+
+    def __str__(self):
+        parts = (self._language, self._script, self._region)
+        return "-".join(x for x in parts if x is not None)
+
+
+class Client:
+    """Fails any download, as the tests run offline."""
+
+    def __init__(self, user_agent=None):
+        self.user_agent = user_agent
+
+    def get(self, *args, **kwargs):
+        raise RuntimeError("reqwest is not available outside the kbdgen binary")
+
+
+STAND_INS = {
+    "rust_logger": {"Logger": Logger},
+    "language_tags": {"LanguageTag": LanguageTag},
+    "reqwest": {"Client": Client},
+}
+
+for name, attrs in STAND_INS.items():
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
@@ -0,0 +1,60 @@
+import concurrent.futures
+import os
+import pickle
+import shutil
+
+import pytest
+
+from kbdgen.bundle.source import ArchiveSource, open_source
+from kbdgen.cli import run_cli
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "..", "examples")
+
+
+@pytest.fixture(params=["zip", "gztar"])
+def archive(request, tmp_path):
+    return shutil.make_archive(
+        str(tmp_path / "sme"),
+        request.param,
+        root_dir=EXAMPLES,
+        base_dir="sme.kbdgen",
+    )
+
+
+def test_source_pickles_after_reading(archive):
+    source = open_source(archive)
+    project = source.read("project.yaml")
+
+    copy = pickle.loads(pickle.dumps(source))
+
+    assert copy.read("project.yaml") == project
+    assert copy.listdir("layouts") == source.listdir("layouts")
+
+
+def test_archive_source_is_abstract():
+    with pytest.raises(TypeError):
+        ArchiveSource("sme.zip")
+
+
+def test_extract_from_many_threads(archive):
+    source = open_source(archive)
+    names = ["resources/mac", "resources/ios", "resources/mac/readme.html"] * 8
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        paths = list(pool.map(source.extract, names))
+
+    assert len({os.path.dirname(x) for x in paths[:2]}) == 1
+    for name, path in zip(names, paths):
+        assert path == source.extract(name)
+    with open(os.path.join(paths[0], "readme.html"), "rb") as f:
+        assert f.read() == source.read("resources/mac/readme.html")
+    assert os.path.exists(os.path.join(paths[1], "icon.png"))
+
+
+def test_render_archive_with_jobs(archive, tmp_path):
+    output = tmp_path / "out"
+    args = ["-j", "2", "--no-cache", "-t", "svg", "-o", str(output), archive]
+
+    assert run_cli(args) is None
+    for name in ("se-FI", "se-NO", "se-SE"):
+        assert (output / ("%s.svg" % name)).exists()
@@ -0,0 +1,18 @@
+import pytest
+
+from kbdgen.cli import parse_check_args, parse_compile_args
+
+
+def test_compile_logging_levels():
+    assert parse_compile_args(["sme.kbdgen"]).logging == 20
+    assert parse_compile_args(["--logging", "trace", "sme.kbdgen"]).logging == 5
+    assert parse_compile_args(["--logging", "warn", "sme.kbdgen"]).logging == 30
+    with pytest.raises(SystemExit):
+        parse_compile_args(["--logging", "loud", "sme.kbdgen"])
+
+
+def test_check_logging_levels():
+    assert parse_check_args(["sme.kbdgen"]).logging == 20
+    assert parse_check_args(["--logging", "debug", "sme.kbdgen"]).logging == 10
+    with pytest.raises(SystemExit):
+        parse_check_args(["--logging", "loud", "sme.kbdgen"])
@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+
+from kbdgen.bundle import derive_transforms, load_layout
+
+HERE = os.path.dirname(__file__)
+LAYOUTS = os.path.join(HERE, "..", "..", "examples", "sme.kbdgen", "layouts")
+
+# The transforms derived for the dead keys of each layout, without glyphbombs.
+EXPECTED = os.path.join(HERE, "data", "derived_transforms.json")
+
+# se.yaml is the only mobile layout and has no dead keys of its own.
+MOBILE_DEAD_KEYS = """
+deadKeys:
+  mobile:
+    default: [´, ˇ]
+    shift: [¨]
+"""
+
+
+def load_example(name):
+    with open(os.path.join(LAYOUTS, name), "rb") as f:
+        data = f.read()
+    if name == "se.yaml":
+        data += MOBILE_DEAD_KEYS.encode("utf-8")
+    layout = load_layout(name, data)
+    layout.transforms = None
+    return layout
+
+
+with open(EXPECTED, encoding="utf-8") as f:
+    expected = json.load(f)
+
+
+@pytest.mark.parametrize("name", sorted(expected))
+def test_derived_transforms(name):
+    layout = load_example(name)
+    derive_transforms(layout, False)
+
+    assert layout.transforms == expected[name]
+
+
+@pytest.mark.parametrize("name", sorted(expected))
+def test_derived_transforms_with_glyphbombs(name):
+    layout = load_example(name)
+    derive_transforms(layout, True)
+
+    # Every letter is added, composing or not, over the transforms above.
+    for dead_key, transforms in expected[name].items():
+        derived = layout.transforms[dead_key]
+        assert derived.items() >= transforms.items()
+        assert len(derived) > len(transforms)
+
+
+MOBILE_LAYOUT = r"""
+displayNames:
+  se: Davvisámegiella
+modes:
+  mobile:
+    default: |
+      á š e r t y u i o p ŋ
+      a s d f g h j k l đ ŧ
+      \s{shift} ž z č c v b n m \s{backspace}
+deadKeys:
+  mobile:
+    default: [´]
+derive:
+  transforms: true
+"""
+
+
+def test_derived_transforms_skip_special_keys_of_mobile_layouts():
+    layout = load_layout("mobile.yaml", MOBILE_LAYOUT.encode("utf-8"))
+
+    assert layout.transforms == {
+        "´": {
+            " ": "´",
+            "a": "á",
+            "c": "ć",
+            "e": "é",
+            "g": "ǵ",
+            "i": "í",
+            "k": "ḱ",
+            "l": "ĺ",
+            "m": "ḿ",
+            "n": "ń",
+            "o": "ó",
+            "p": "ṕ",
+            "r": "ŕ",
+            "s": "ś",
+            "u": "ú",
+            "y": "ý",
+            "z": "ź",
+        }
+    }
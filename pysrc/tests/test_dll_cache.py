@@ -0,0 +1,20 @@
+import concurrent.futures
+
+from kbdgen.gen.win import DllCache
+
+
+def test_counts_lookups_from_many_threads(tmp_path):
+    cache = DllCache(tmp_path / "cache")
+    dll = tmp_path / "kbd.dll"
+    dll.write_bytes(b"MZ")
+    cache.put("ab" * 32, str(dll))
+
+    def get(n):
+        key = "ab" * 32 if n % 2 == 0 else "cd" * 32
+        return cache.get(key, str(tmp_path / ("%d.dll" % n)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        found = list(pool.map(get, range(400)))
+
+    assert found.count(True) == cache.hits == 200
+    assert found.count(False) == cache.misses == 200
@@ -0,0 +1,49 @@
+from pathlib import Path
+
+import kbdgen.gen.win
+from kbdgen import orderedyaml
+from kbdgen.bundle import decode_layout, index_layout
+from kbdgen.gen.win import WindowsGenerator
+
+LAYOUT_PATH = (
+    Path(__file__).resolve().parents[2]
+    / "examples"
+    / "sme.kbdgen"
+    / "layouts"
+    / "se-NO.yaml"
+)
+
+# Glyphbombs put on the 1 key in the Windows caps modes: (old rows, new rows).
+CAPS_GLYPHBOMBS = (
+    ("    caps: |\n      | 1 2", "    caps: |\n      | ŋ\\u{301} 2"),
+    ("    caps+shift: |\n      § ! ", "    caps+shift: |\n      § a\\u{303} "),
+)
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.errors = []
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+def test_caps_glyphbombs_are_named_in_errors(monkeypatch):
+    text = LAYOUT_PATH.read_text(encoding="utf-8")
+    for old, new in CAPS_GLYPHBOMBS:
+        assert old in text, old
+        text = text.replace(old, new, 1)
+    layout = index_layout(decode_layout(orderedyaml.loads(text)))
+
+    logger = RecordingLogger()
+    monkeypatch.setattr(kbdgen.gen.win, "logger", logger)
+    keys = "".join(WindowsGenerator(None)._klc_keys("se-NO", layout))
+
+    assert logger.errors == [
+        "Caps key 'ŋ\\u{301}' is a glyphbomb and cannot be used in Caps Mode.",
+        "Caps+Shift key 'a\\u{303}' is a glyphbomb and cannot be used in Caps Mode.",
+    ]
+    assert "-1\t-1\t\t0\t-1\t-1\t\t\t\t// None None\n" in keys
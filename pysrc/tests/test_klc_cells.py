@@ -0,0 +1,78 @@
+import os
+import re
+
+import pytest
+
+from kbdgen.base import Parser
+from kbdgen.cldr import decode_u
+from kbdgen.gen.base import mode_iter
+from kbdgen.gen.win import KlcEncoder, klc_cell, win_glyphbomb
+from kbdgen.keys import WIN_SCAN_CODES
+
+BUNDLE = os.path.join(os.path.dirname(__file__), "..", "..", "examples", "sme.kbdgen")
+
+KLC_MODES = (
+    "default",
+    "shift",
+    "ctrl",
+    "alt",
+    "alt+shift",
+    "caps",
+    "caps+shift",
+    "alt+caps",
+)
+
+
+def old_cell(v, force=False):
+    """The KLC char of a value as `win_filter` worked it out for each call,
+    before cells were encoded once per value."""
+    if v is None:
+        return "-1"
+
+    v = str(v)
+    if re.match(r"^\d{4}$", v):
+        return v
+
+    v = decode_u(v)
+
+    if v == "\0":
+        return "-1"
+
+    if not force and re.match("^[A-Za-z]$", v):
+        return v
+
+    return "%04x" % ord(v)
+
+
+def old_glyphbomb(v):
+    return tuple("%04x" % ord(c) for c in decode_u(v))
+
+
+bundle = Parser().parse(BUNDLE)
+
+
+@pytest.mark.parametrize("name", sorted(bundle.layouts))
+def test_cells_match_per_call_encoding(name):
+    layout = bundle.layouts[name]
+    encoder = KlcEncoder()
+
+    # Twice, so that the second pass is served from the encoder's cache.
+    for _ in range(2):
+        for mode in KLC_MODES:
+            values = mode_iter(name, layout, mode, "win")
+            decoded = mode_iter(name, layout, mode, "win", decoded=True)
+            # Modes a layout lacks repeat None endlessly.
+            for _, v, d in zip(WIN_SCAN_CODES, values, decoded):
+                if v is None:
+                    assert d is None
+                    continue
+                if len(decode_u(v)) > 1:
+                    assert win_glyphbomb(d, decoded=True) == old_glyphbomb(v)
+                    assert encoder.glyphbomb(d, True) == old_glyphbomb(v)
+                    continue
+                for force in (False, True):
+                    expected = old_cell(v, force)
+                    assert klc_cell(v, force) == expected, (mode, v)
+                    assert klc_cell(d, force, decoded=True) == expected, (mode, v)
+                    assert encoder.cell(v, force) == expected, (mode, v)
+                    assert encoder.cell(d, force, decoded=True) == expected, (mode, v)
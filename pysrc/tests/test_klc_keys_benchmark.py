@@ -0,0 +1,76 @@
+"""Times writing the keys of a KLC file for a layout with full alt and caps modes.
+
+se-NO from examples/sme.kbdgen is given an `alt+caps` mode for Windows, so that
+it has every mode a KLC has a column for, and a few glyphbombs. The keys
+section of its KLC (`WindowsGenerator._klc_keys`) must be what kbdgen wrote
+before KLC cells were encoded once per value, and is then written
+KLC_KEYS_COUNT (default 200) times and the time per layout reported.
+
+    $ python -m pytest -m benchmark -s tests/test_klc_keys_benchmark.py
+"""
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from kbdgen import orderedyaml
+from kbdgen.bundle import decode_layout, index_layout
+from kbdgen.gen.win import WindowsGenerator
+
+pytestmark = pytest.mark.benchmark
+
+LAYOUT_PATH = (
+    Path(__file__).resolve().parents[2]
+    / "examples"
+    / "sme.kbdgen"
+    / "layouts"
+    / "se-NO.yaml"
+)
+
+# Added to the Windows modes of se-NO, after `ctrl`.
+ALT_CAPS = """\
+    alt+caps: |
+      \\u{0} \\u{0} @ £ $ € \\u{0} { [ ] } \\u{0} ´
+      Q W € \\u{0} Ŧ \\u{0} \\u{0} Ï Õ \\u{0} ¨ ~
+      Â \\u{0} \\u{0} \\u{0} Ǧ Ǥ \\u{0} Ǩ \\u{0} Ö Ä '
+      Ǯ Ʒ X \\u{0} \\u{0} \\u{0} \\u{0} µ < > \\u{0}
+"""
+
+# Glyphbombs put in place of some `alt` keys: (old row, new row).
+GLYPHBOMBS = (
+    ("      q w € \\u{0} ŧ", "      q w € ŋ\\u{301} ŧ"),
+    ("      ǯ ʒ x \\u{0}", "      ǯ ʒ x a\\u{303}\\u{301}"),
+)
+
+# The sha256 of the keys section as written by the per-call cell encoding.
+EXPECTED_SHA256 = "c84efb82c6c6534bb21701ad8355c972c42c0fe165689d12761d6de99ab45d0a"
+
+
+def layout_text():
+    text = LAYOUT_PATH.read_text(encoding="utf-8")
+    # The ctrl mode of win is the last mode before the transforms.
+    start = text.index("transforms:\n")
+    text = text[:start] + ALT_CAPS + text[start:]
+    for old, new in GLYPHBOMBS:
+        assert old in text, old
+        text = text.replace(old, new, 1)
+    return text
+
+
+def test_klc_keys():
+    layout = index_layout(decode_layout(orderedyaml.loads(layout_text())))
+    generator = WindowsGenerator(None)
+
+    section = "".join(generator._klc_keys("se-NO", layout))
+    assert hashlib.sha256(section.encode("utf-8")).hexdigest() == EXPECTED_SHA256
+
+    count = int(os.environ.get("KLC_KEYS_COUNT", "200"))
+    start = time.perf_counter()
+    for _ in range(count):
+        for _ in generator._klc_keys("se-NO", layout):
+            pass
+    seconds = time.perf_counter() - start
+
+    print("%d layouts  %.1f µs per layout" % (count, seconds * 1e6 / count))
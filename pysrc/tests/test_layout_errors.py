@@ -0,0 +1,37 @@
+import os
+import shutil
+
+import pytest
+
+from kbdgen.base import Parser, UserException
+from kbdgen.cli import run_cli
+
+BUNDLE = os.path.join(os.path.dirname(__file__), "..", "..", "examples", "sme.kbdgen")
+
+
+@pytest.fixture
+def broken_bundle(tmp_path):
+    path = tmp_path / "sme.kbdgen"
+    shutil.copytree(BUNDLE, str(path))
+    with (path / "layouts" / "se-NO.yaml").open("a", encoding="utf-8") as f:
+        f.write("modes: [\n")
+    return str(path)
+
+
+def test_bad_layout_raises_user_exception_on_access(broken_bundle):
+    bundle = Parser().parse(broken_bundle, cache=None)
+
+    assert bundle.layouts["se-FI"] is not None
+    with pytest.raises(UserException) as e:
+        bundle.layouts["se-NO"]
+    assert "se-NO" in e.value.args[0]
+
+
+def test_cli_reports_bad_layout(broken_bundle, tmp_path):
+    args = ["--no-cache", "-t", "svg", "-o", str(tmp_path / "out"), broken_bundle]
+
+    assert run_cli(args) == 1
+
+
+def test_check_reports_bad_layout(broken_bundle):
+    assert run_cli(["check", "--no-cache", broken_bundle]) == 1
@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import xml.etree.ElementTree as etree
+
+import pytest
+
+from kbdgen.base import Parser
+from kbdgen.gen.mac import MacGenerator
+
+HERE = os.path.dirname(__file__)
+BUNDLE = os.path.join(HERE, "..", "..", "examples", "sme.kbdgen")
+
+# What each key of the example layouts typed on its own in the keylayouts of
+# kbdgen 2.0.0-alpha.16, which generated no working dead keys for macOS.
+BASELINE = os.path.join(HERE, "data", "mac_baseline_keys.json")
+
+CHAR_REF_RE = re.compile(r"&#(x?[0-9A-Fa-f]+);")
+
+
+def key_outputs(keylayout):
+    """Maps each keyMap index and key code of a .keylayout to what the key
+    types from the initial state: its output, or ["dead", terminator] for a
+    key that starts a dead key sequence."""
+    # Keylayouts may contain character references that are not valid XML.
+    text = CHAR_REF_RE.sub(r"[\1]", keylayout)
+    root = etree.fromstring(text[text.index("<keyboard") :])
+
+    actions = {}
+    for action in root.iter("action"):
+        for when in action.findall("when[@state='none']"):
+            actions[action.get("id")] = when
+    terminators = {
+        x.get("state"): x.get("output") for x in root.findall("terminators/when")
+    }
+
+    o = {}
+    for key_map in root.find("keyMapSet").findall("keyMap"):
+        keys = o.setdefault(key_map.get("index"), {})
+        for key in key_map.findall("key"):
+            if key.get("output") is not None:
+                keys[key.get("code")] = key.get("output")
+                continue
+            when = actions[key.get("action")]
+            if when.get("next") is not None:
+                keys[key.get("code")] = ["dead", terminators[when.get("next")]]
+            else:
+                keys[key.get("code")] = when.get("output")
+    return o
+
+
+@pytest.fixture(scope="module")
+def generator():
+    return MacGenerator(Parser().parse(BUNDLE), {"flags": []})
+
+
+@pytest.fixture(scope="module")
+def keylayouts(generator):
+    return {
+        name: generator.generate_xml(name, layout)
+        for name, layout in generator.supported_layouts.items()
+    }
+
+
+def test_keys_type_what_they_did_before_dead_keys(generator, keylayouts):
+    """Each key types what it typed in the baseline, except that keys that
+    are dead keys in their mode now start a sequence. A key that is not part
+    of the sequence ends it with the dead key's transform for space, or with
+    what the dead key typed before."""
+    with open(BASELINE, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    assert sorted(keylayouts) == sorted(baseline)
+    for name, keylayout in keylayouts.items():
+        outputs = key_outputs(keylayout)
+        assert sorted(outputs) == sorted(baseline[name])
+        for index, keys in baseline[name].items():
+            for code, expected in keys.items():
+                actual = outputs[index][code]
+                if isinstance(actual, list):
+                    transforms = generator.supported_layouts[name].transforms
+                    expected = (transforms or {}).get(expected, {}).get(" ", expected)
+                    actual = actual[1]
+                assert actual == expected, (name, index, code)
+
+
+def test_dead_keys_start_sequences(keylayouts):
+    dead = 0
+    for keylayout in keylayouts.values():
+        for keys in key_outputs(keylayout).values():
+            dead += sum(1 for x in keys.values() if isinstance(x, list))
+    assert dead > 0
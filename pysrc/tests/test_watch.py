@@ -0,0 +1,41 @@
+import os
+
+from kbdgen.base import Parser
+from kbdgen.gen.svgkbd import SVGGenerator
+from kbdgen.watch import regenerate
+
+BUNDLE = os.path.join(os.path.dirname(__file__), "..", "..", "examples", "sme.kbdgen")
+
+
+class RecordingGenerator:
+    def __init__(self, regenerable):
+        self.supported_layouts = {"a": object(), "b": object(), "c": object()}
+        self.regenerable = regenerable
+        self.calls = []
+
+    def supports_layout_regeneration(self, base, layout):
+        return layout in [self.supported_layouts[x] for x in self.regenerable]
+
+    def generate_layout(self, base, name, layout):
+        self.calls.append(name)
+
+    def generate(self, base):
+        self.calls.append("*")
+
+
+def test_regenerates_affected_layouts_only():
+    generator = RecordingGenerator({"a", "b", "c"})
+    regenerate(generator, ".", {"b", "a", "missing"})
+    assert generator.calls == ["a", "b"]
+
+
+def test_falls_back_before_writing_any_layout():
+    generator = RecordingGenerator({"a"})
+    regenerate(generator, ".", {"a", "b"})
+    assert generator.calls == ["*"]
+
+
+def test_svg_regenerates_one_layout(tmp_path):
+    generator = SVGGenerator(Parser().parse(BUNDLE), {"flags": []})
+    regenerate(generator, str(tmp_path), {"se-NO"})
+    assert sorted(os.listdir(str(tmp_path))) == ["layout.html", "se-NO.svg"]
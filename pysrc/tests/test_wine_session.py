@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+
+import pytest
+
+from kbdgen.bundle import ProjectBundle
+from kbdgen.gen.win import DLL_ARCHS, WindowsGenerator, WineSession
+
+HERE = os.path.dirname(__file__)
+BUNDLE = os.path.join(HERE, "..", "..", "examples", "sme.kbdgen")
+STUB_DIR = os.path.join(HERE, "..", "benchmarks", "wine_stub")
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="DLLs are built without wine on Windows"
+)
+
+
+@pytest.fixture
+def stub_wine(tmp_path, monkeypatch):
+    """Runs wine and wineserver as the stubs in benchmarks/wine_stub, returning
+    a function that reads what they were run for."""
+    kbdutool = tmp_path / "msklc" / "bin" / "i386" / "kbdutool.exe"
+    kbdutool.parent.mkdir(parents=True)
+    kbdutool.write_bytes(b"kbdutool")
+
+    log_path = tmp_path / "wine.log"
+    monkeypatch.setenv("WINE", os.path.join(STUB_DIR, "wine"))
+    monkeypatch.setenv("WINESERVER", os.path.join(STUB_DIR, "wineserver"))
+    monkeypatch.setenv("WINE_STUB_LOG", str(log_path))
+    monkeypatch.setenv("WINE_STUB_STATE", str(tmp_path))
+    monkeypatch.setenv("WINE_STUB_STARTUP", "0")
+    monkeypatch.setenv("WINE_STUB_WARM", "0")
+    monkeypatch.setenv("WINE_STUB_COMPILE", "0")
+    monkeypatch.setenv("MSKLC_PATH", str(kbdutool.parent.parent.parent))
+
+    def runs():
+        if not log_path.exists():
+            return []
+        with log_path.open(encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    return runs
+
+
+@pytest.fixture
+def klcs(tmp_path):
+    generator = WindowsGenerator(
+        ProjectBundle.load(BUNDLE), {"flags": [], "release": True}
+    )
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    contexts = generator.klc_contexts(str(build_dir))
+    for ctx in contexts:
+        generator.render_klc_file(ctx)
+    return generator, build_dir, contexts
+
+
+def server_running(tmp_path):
+    return (tmp_path / "wineserver").exists()
+
+
+def test_one_session_serves_every_build(tmp_path, stub_wine, klcs):
+    generator, build_dir, contexts = klcs
+    assert len(contexts) > 1
+
+    with WineSession() as wine:
+        assert server_running(tmp_path)
+        for ctx in contexts:
+            generator.build_dlls(ctx.klc_name, ctx.path, str(build_dir), None, wine)
+    assert not server_running(tmp_path)
+
+    runs = stub_wine()
+    servers = [r["argv"] for r in runs if r["argv"][0] == "wineserver"]
+    assert servers == [["wineserver", "-p"], ["wineserver", "-k"]]
+
+    # One warm wine process per layout, building all of its DLLs.
+    wine = [r for r in runs if r["argv"][0] != "wineserver"]
+    assert len(wine) == len(contexts)
+    assert all(r["warm"] for r in wine)
+    for ctx in contexts:
+        for arch in DLL_ARCHS:
+            assert (build_dir / arch / ("%s.dll" % ctx.klc_name)).exists()
+
+
+def test_failed_build_leaves_session_usable(tmp_path, stub_wine, klcs):
+    generator, build_dir, contexts = klcs
+    ctx = contexts[0]
+
+    with WineSession() as wine:
+        with pytest.raises(SystemExit):
+            generator.build_dlls(
+                ctx.klc_name, str(build_dir / "missing.klc"), str(build_dir), None, wine
+            )
+        assert server_running(tmp_path)
+
+        generator.build_dlls(ctx.klc_name, ctx.path, str(build_dir), None, wine)
+    assert not server_running(tmp_path)
+
+    # The build after the failure still ran warm, in the same server.
+    runs = stub_wine()
+    servers = [r["argv"] for r in runs if r["argv"][0] == "wineserver"]
+    assert servers == [["wineserver", "-p"], ["wineserver", "-k"]]
+    assert runs[-2]["argv"][:2] == ["cmd", "/c"]
+    assert runs[-2]["warm"]
+    for arch in DLL_ARCHS:
+        assert (build_dir / arch / ("%s.dll" % ctx.klc_name)).exists()
+    # The batch files of both builds were cleaned up.
+    assert list(build_dir.glob("*.bat")) == []
+
+
+def test_failed_build_stops_the_server(tmp_path, stub_wine, klcs):
+    generator, build_dir, contexts = klcs
+    ctx = contexts[0]
+
+    with pytest.raises(SystemExit):
+        with WineSession() as wine:
+            generator.build_dlls(
+                ctx.klc_name, str(build_dir / "missing.klc"), str(build_dir), None, wine
+            )
+    assert not server_running(tmp_path)
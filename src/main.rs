@@ -201,6 +201,18 @@ enum Commands {
         #[structopt(long = "github-token")]
         github_token: Option<String>,
 
+        /// Decode and render layouts with N workers (0: one per CPU)
+        #[structopt(short, long = "jobs", global = true)]
+        jobs: Option<usize>,
+
+        /// Keep running and regenerate the outputs of layouts as they change
+        #[structopt(short, long = "watch", global = true)]
+        watch: bool,
+
+        /// Always decode the bundle and build DLLs instead of using the caches
+        #[structopt(long = "no-cache", global = true)]
+        no_cache: bool,
+
         #[structopt(subcommand)]
         command: BuildCommands,
     },
@@ -212,6 +224,39 @@ enum Commands {
         #[structopt(subcommand)]
         command: NewCommands,
     },
+    #[structopt(about = "Decode a .kbdgen bundle into a .kbdc snapshot for faster builds")]
+    Compile {
+        #[structopt(short, long = "output", parse(from_os_str))]
+        output_path: Option<PathBuf>,
+
+        /// Decode layouts and targets with N workers (0: one per CPU)
+        #[structopt(short, long = "jobs")]
+        jobs: Option<usize>,
+
+        /// Always decode the bundle instead of using the decoded bundle cache
+        #[structopt(long = "no-cache")]
+        no_cache: bool,
+
+        #[structopt(parse(from_os_str))]
+        project_path: PathBuf,
+    },
+    #[structopt(about = "Validate every layout of a .kbdgen bundle against its targets")]
+    Check {
+        /// Target to validate against, may be given more than once (default: all)
+        #[structopt(short, long = "target")]
+        targets: Vec<String>,
+
+        /// Decode layouts and targets with N workers (0: one per CPU)
+        #[structopt(short, long = "jobs")]
+        jobs: Option<usize>,
+
+        /// Always decode the bundle instead of using the decoded bundle cache
+        #[structopt(long = "no-cache")]
+        no_cache: bool,
+
+        #[structopt(parse(from_os_str))]
+        project_path: PathBuf,
+    },
     #[structopt(about = "Manage meta-bundles", setting(DisableHelpSubcommand))]
     Meta {
         #[structopt(subcommand)]
@@ -240,6 +285,9 @@ impl BuildCommands {
         &'a self,
         github_username: Option<&'a str>,
         github_token: Option<&'a str>,
+        jobs: Option<&'a str>,
+        watch: bool,
+        no_cache: bool,
         logging: &'a str,
     ) -> Result<Vec<&'a str>, Box<dyn std::error::Error>> {
         use BuildCommands::*;
@@ -486,6 +534,19 @@ impl BuildCommands {
             args.push(&*gh_token);
         }
 
+        if let Some(jobs) = jobs {
+            args.push("--jobs");
+            args.push(jobs);
+        }
+
+        if watch {
+            args.push("--watch");
+        }
+
+        if no_cache {
+            args.push("--no-cache");
+        }
+
         args.push("--logging");
         args.push(logging);
 
@@ -521,8 +582,10 @@ fn python_config<'a>(args: &[&str]) -> OxidizedPythonInterpreterConfig<'a> {
                 .collect::<Vec<_>>()
                 .join(", ")
         );
-        config.interpreter_config.run_command =
-            Some(format!("import kbdgen.cli; kbdgen.cli.run_cli({})", args));
+        config.interpreter_config.run_command = Some(format!(
+            "import sys, kbdgen.cli; sys.exit(kbdgen.cli.run_cli({}))",
+            args
+        ));
     }
     config
 }
@@ -549,6 +612,39 @@ fn launch_py_kbdgen(args: &[&str]) -> i32 {
     }
 }
 
+fn run_py_kbdgen(args: Vec<String>) -> i32 {
+    std::thread::spawn(move || {
+        let args = args.iter().map(|x| &**x).collect::<Vec<_>>();
+        launch_py_kbdgen(&args)
+    })
+    .join()
+    .unwrap()
+}
+
+/// Exits with an error if any of the build flags that only the Python
+/// targets understand were given for a target built in Rust.
+fn reject_py_build_flags(target: &str, jobs: Option<usize>, watch: bool, no_cache: bool) {
+    let mut flags = vec![];
+    if jobs.is_some() {
+        flags.push("--jobs");
+    }
+    if watch {
+        flags.push("--watch");
+    }
+    if no_cache {
+        flags.push("--no-cache");
+    }
+
+    if !flags.is_empty() {
+        eprintln!(
+            "{} cannot be used when building {} output.",
+            flags.join(", "),
+            target
+        );
+        std::process::exit(1);
+    }
+}
+
 fn launch_repl() -> i32 {
     let config = python_config(&[]);
     match MainPythonInterpreter::new(config) {
@@ -589,6 +685,9 @@ async fn main() {
         Commands::Build {
             github_username,
             github_token,
+            jobs,
+            watch,
+            no_cache,
             command,
         } => match command {
             BuildCommands::X11 {
@@ -599,12 +698,15 @@ async fn main() {
                     },
                 build_mode: BuildMode { .. },
                 standalone,
-            } => kbdgen::cli::to_xkb::kbdgen_to_xkb(
-                &project_path,
-                &output_path,
-                &kbdgen::cli::to_xkb::Options { standalone },
-            )
-            .unwrap(),
+            } => {
+                reject_py_build_flags("X11", jobs, watch, no_cache);
+                kbdgen::cli::to_xkb::kbdgen_to_xkb(
+                    &project_path,
+                    &output_path,
+                    &kbdgen::cli::to_xkb::Options { standalone },
+                )
+                .unwrap()
+            }
             BuildCommands::M17n {
                 in_out:
                     InOutPaths {
@@ -612,7 +714,10 @@ async fn main() {
                         project_path,
                     },
                 build_mode: BuildMode { .. },
-            } => kbdgen::cli::to_m17n_mim::kbdgen_to_mim(&project_path, &output_path).unwrap(),
+            } => {
+                reject_py_build_flags("m17n", jobs, watch, no_cache);
+                kbdgen::cli::to_m17n_mim::kbdgen_to_mim(&project_path, &output_path).unwrap()
+            }
             BuildCommands::ErrorModel {
                 in_out:
                     InOutPaths {
@@ -620,29 +725,29 @@ async fn main() {
                         project_path,
                     },
                 layout,
-            } => kbdgen::cli::to_errormodel::kbdgen_to_errormodel(
-                &project_path,
-                &output_path,
-                &kbdgen::cli::to_errormodel::Options { layout },
-            )
-            .unwrap(),
+            } => {
+                reject_py_build_flags("error model", jobs, watch, no_cache);
+                kbdgen::cli::to_errormodel::kbdgen_to_errormodel(
+                    &project_path,
+                    &output_path,
+                    &kbdgen::cli::to_errormodel::Options { layout },
+                )
+                .unwrap()
+            }
             command => match command
                 .to_py_args(
                     github_username.as_ref().map(|x| &**x),
                     github_token.as_ref().map(|x| &**x),
+                    jobs.map(|x| x.to_string()).as_ref().map(|x| &**x),
+                    watch,
+                    no_cache,
                     &opt.logging,
                 )
                 .await
             {
                 Ok(args) => {
                     let args = args.iter().map(|x| x.to_string()).collect::<Vec<String>>();
-                    let exit_code = std::thread::spawn(move || {
-                        let args = args.iter().map(|x| &**x).collect::<Vec<_>>();
-                        launch_py_kbdgen(&args)
-                    })
-                        .join()
-                        .unwrap();
-                    std::process::exit(exit_code)
+                    std::process::exit(run_py_kbdgen(args))
                 }
                 Err(e) => {
                     eprintln!("{:?}", e);
@@ -678,6 +783,56 @@ async fn main() {
             },
         },
 
+        Commands::Compile {
+            output_path,
+            jobs,
+            no_cache,
+            project_path,
+        } => {
+            let mut args = vec!["compile".to_string()];
+            if let Some(output_path) = output_path {
+                args.push("-o".to_string());
+                args.push(output_path.to_str().unwrap().to_string());
+            }
+            if let Some(jobs) = jobs {
+                args.push("--jobs".to_string());
+                args.push(jobs.to_string());
+            }
+            if no_cache {
+                args.push("--no-cache".to_string());
+            }
+            args.push(project_path.to_str().unwrap().to_string());
+            args.push("--logging".to_string());
+            args.push(opt.logging.clone());
+
+            std::process::exit(run_py_kbdgen(args))
+        }
+
+        Commands::Check {
+            targets,
+            jobs,
+            no_cache,
+            project_path,
+        } => {
+            let mut args = vec!["check".to_string()];
+            for target in targets {
+                args.push("-t".to_string());
+                args.push(target);
+            }
+            if let Some(jobs) = jobs {
+                args.push("--jobs".to_string());
+                args.push(jobs.to_string());
+            }
+            if no_cache {
+                args.push("--no-cache".to_string());
+            }
+            args.push(project_path.to_str().unwrap().to_string());
+            args.push("--logging".to_string());
+            args.push(opt.logging.clone());
+
+            std::process::exit(run_py_kbdgen(args))
+        }
+
         Commands::Repl => {
             let exit_code = std::thread::spawn(|| launch_repl()).join().unwrap();
             std::process::exit(exit_code)